@@ -5,12 +5,10 @@ from dotenv import load_dotenv
 # Cargar variables de entorno desde .env si existe
 # Esto es útil para desarrollo local. En producción (ej. GitHub Actions),
 # las variables de entorno se suelen configurar directamente en la plataforma.
+# Importar este módulo no escribe nada por pantalla ni crea directorios (ver ensure_directories()).
 dotenv_path = Path(__file__).parent.parent / '.env' # Asume que .env está en la raíz del proyecto (un nivel arriba de src/)
 if dotenv_path.exists():
     load_dotenv(dotenv_path=dotenv_path)
-    print(f"Cargado .env desde: {dotenv_path}") # Para depuración
-else:
-    print(f".env no encontrado en: {dotenv_path}") # Para depuración
 
 
 # Rutas base del proyecto
@@ -20,17 +18,30 @@ TEMPLATES_DIR = PROJECT_ROOT / "templates"
 OUTPUT_DIR = PROJECT_ROOT / "output"
 HISTORY_DIR = DATA_DIR / "history"
 ARCHIVE_DIR = OUTPUT_DIR / "archive"
+STATE_DIR = DATA_DIR / "state"  # Estado persistente entre ejecuciones (se versiona junto al historial)
+CACHE_DIR = DATA_DIR / "cache"  # Cachés locales regenerables (no se versionan)
+LLM_CACHE_DIR = CACHE_DIR / "llm"
+JINJA_CACHE_DIR = CACHE_DIR / "jinja"  # Bytecode de las plantillas compiladas (ver get_jinja_env en src/generator.py)
+LOCAL_CLASSIFIER_FILE = CACHE_DIR / "local_classifier.npz"  # Modelo del clasificador local (se reentrena desde data/history)
 
 # Nombres de archivos de configuración
-SOURCES_FILE = DATA_DIR / "sources.json"
+SOURCES_FILE = Path(os.getenv("FEEDDIGEST_SOURCES_FILE", DATA_DIR / "sources.json"))  # Sobrescribible (p. ej. fixtures)
 PREFERENCES_FILE = DATA_DIR / "preferences.json"
 PROMPTS_FILE = DATA_DIR / "prompts.json"
+FETCH_STATE_FILE = STATE_DIR / "fetch_state.json"
+SEEN_INDEX_FILE = STATE_DIR / "seen_articles.json"
+SYNTHESIS_CACHE_FILE = STATE_DIR / "synthesis_cache.json"
+FEED_RECORDINGS_DIR = Path(os.getenv("FEED_RECORDINGS_DIR", DATA_DIR / "recordings"))  # Respuestas grabadas (FEED_MODE=record/replay)
 
-# Asegurarse de que los directorios de salida y datos existan
-DATA_DIR.mkdir(parents=True, exist_ok=True)
-HISTORY_DIR.mkdir(parents=True, exist_ok=True)
-OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+
+def ensure_directories():
+    """Crea los directorios de datos y salida si no existen. Lo llaman los puntos de entrada antes de escribir."""
+    for directory in (DATA_DIR, HISTORY_DIR, OUTPUT_DIR, ARCHIVE_DIR, STATE_DIR):
+        directory.mkdir(parents=True, exist_ok=True)
+
+
+# Modo desarrollo: las plantillas se recargan si cambian en disco (en producción se compilan una vez por proceso)
+DEV_MODE = os.getenv("FEEDDIGEST_DEV", "false").lower() in ("1", "true", "yes")
 
 # Configuración de Logging (básico por ahora)
 LOG_LEVEL = "INFO" # Ejemplo: DEBUG, INFO, WARNING, ERROR
@@ -40,11 +51,66 @@ LOG_LEVEL = "INFO" # Ejemplo: DEBUG, INFO, WARNING, ERROR
 LLM_MODEL_CLASSIFICATION = os.getenv("LLM_MODEL_CLASSIFICATION_ENV") # Ejemplo
 LLM_MODEL_RELEVANCE = os.getenv("LLM_MODEL_RELEVANCE_ENV")    # Ejemplo
 LLM_MODEL_SYNTHESIS = os.getenv("LLM_MODEL_SYNTHESIS_ENV")   # Ejemplo
+# Los modelos se cargan (con el descubrimiento de plugins de llm) la primera vez que se usan: ver src/llm_models.py
 
 # Otros parámetros globales
 MAX_ARTICLES_PER_CATEGORY_DEFAULT = int(os.getenv("MAX_ARTICLES_PER_CATEGORY_DEFAULT", 10))
 MIN_ARTICLE_LENGTH_DEFAULT = int(os.getenv("MIN_ARTICLE_LENGTH_DEFAULT", 20))
 
-print(f"Usando modelo de clasificación: {LLM_MODEL_CLASSIFICATION}")
-print(f"Usando modelo de relevancia: {LLM_MODEL_RELEVANCE}")
-print(f"Usando modelo de síntesis: {LLM_MODEL_SYNTHESIS}")
\ No newline at end of file
+# Recolección de feeds
+# Número de fuentes que se descargan en paralelo (1 = recolección secuencial)
+COLLECTOR_MAX_WORKERS = int(os.getenv("COLLECTOR_MAX_WORKERS", 8))
+# Tiempo máximo (segundos de reloj) que se espera a cada fuente antes de descartarla
+COLLECTOR_SOURCE_TIMEOUT = float(os.getenv("COLLECTOR_SOURCE_TIMEOUT", 30))
+# Modo de acceso a los feeds: "live" (red), "record" (red + guardar respuestas en FEED_RECORDINGS_DIR)
+# o "replay" (sin red: se sirven las respuestas grabadas). En replay, FEED_REPLAY_LATENCY reproduce
+# también el tiempo de respuesta grabado, para medir el efecto de la concurrencia.
+FEED_MODE = os.getenv("FEED_MODE", "live")
+FEED_REPLAY_LATENCY = os.getenv("FEED_REPLAY_LATENCY", "false").lower() in ("1", "true", "yes")
+# Marca de agua por fuente: solo se ingieren entradas posteriores a la última ya procesada.
+# Sin marca de agua (primera ejecución) se miran las últimas COLLECTOR_INITIAL_LOOKBACK_HOURS horas;
+# con ella, nunca se retrocede más de COLLECTOR_MAX_LOOKBACK_HOURS (p. ej. tras varios días sin ejecutar).
+COLLECTOR_INITIAL_LOOKBACK_HOURS = float(os.getenv("COLLECTOR_INITIAL_LOOKBACK_HOURS", 24))
+COLLECTOR_MAX_LOOKBACK_HOURS = float(os.getenv("COLLECTOR_MAX_LOOKBACK_HOURS", 72))
+# Detección de casi duplicados entre fuentes (similitud de Jaccard estimada con MinHash)
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() in ("1", "true", "yes")
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", 0.5))
+# Backend para extraer texto del HTML de los feeds: "fast" (streaming, stdlib) o "bs4" (BeautifulSoup)
+TEXT_EXTRACTION_BACKEND = os.getenv("TEXT_EXTRACTION_BACKEND", "fast")
+# Conservar el HTML original de cada artículo (content_raw) además del texto limpio
+KEEP_RAW_HTML = os.getenv("KEEP_RAW_HTML", "false").lower() in ("1", "true", "yes")
+
+# Índice de artículos ya procesados: días que se recuerda la decisión de clasificación/relevancia
+SEEN_INDEX_MAX_AGE_DAYS = int(os.getenv("SEEN_INDEX_MAX_AGE_DAYS", 14))
+# Estado de descarga por feed (ETag, hash, marca de agua): días sin comprobar un feed antes de olvidar su estado
+FETCH_STATE_MAX_AGE_DAYS = int(os.getenv("FETCH_STATE_MAX_AGE_DAYS", 30))
+
+# Caché persistente de respuestas del LLM (ver src/llm_cache.py)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_MAX_AGE_DAYS = float(os.getenv("LLM_CACHE_MAX_AGE_DAYS", 30))
+LLM_CACHE_MAX_SIZE_MB = float(os.getenv("LLM_CACHE_MAX_SIZE_MB", 200))
+
+# Ejecutor de llamadas al LLM (ver src/llm_executor.py)
+# Llamadas simultáneas por modelo y peticiones por minuto (0 = sin límite) por defecto
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 4))
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", 0))
+# Límites específicos por modelo, en JSON: {"gpt-4o-mini": {"concurrency": 8, "requests_per_minute": 500}}
+LLM_MODEL_LIMITS = os.getenv("LLM_MODEL_LIMITS", "")
+# Reintentos ante errores 429/5xx o de red, con espera exponencial con jitter (segundos)
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 4))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", 1.0))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", 30.0))
+
+# Síntesis (ver src/synthesizer.py): categorías que se sintetizan a la vez (limitado además por la
+# concurrencia del modelo de síntesis) y segundos de reloj por categoría antes de usar el fallback
+SYNTHESIS_MAX_WORKERS = int(os.getenv("SYNTHESIS_MAX_WORKERS", 6))
+SYNTHESIS_CATEGORY_TIMEOUT = float(os.getenv("SYNTHESIS_CATEGORY_TIMEOUT", 300))
+# Reutilizar la síntesis de las categorías cuyas entradas no han cambiado (ver src/synthesis_cache.py)
+SYNTHESIS_CACHE_ENABLED = os.getenv("SYNTHESIS_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+SYNTHESIS_CACHE_MAX_AGE_DAYS = int(os.getenv("SYNTHESIS_CACHE_MAX_AGE_DAYS", 7))
+# Publicación progresiva de la edición diaria (ver ProgressiveNewsletter en src/generator.py): la síntesis se
+# recibe en streaming y la página se republica con lo ya sintetizado, como mucho cada N segundos
+SYNTHESIS_STREAMING = os.getenv("SYNTHESIS_STREAMING", "true").lower() in ("1", "true", "yes")
+SYNTHESIS_STREAM_RENDER_INTERVAL = float(os.getenv("SYNTHESIS_STREAM_RENDER_INTERVAL", 2.0))
+# Página parcial de la edición en curso; index.html y el archivo solo reciben la versión final
+LIVE_PAGE_FILE = OUTPUT_DIR / "live.html"
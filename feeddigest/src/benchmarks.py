@@ -0,0 +1,393 @@
+import argparse
+import json
+import logging
+import re
+import time
+import zlib
+from .. import config
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+# Micro-benchmarks reproducibles sobre los datos de data/history (sin red).
+# Uso: python -m feeddigest.src.benchmarks <benchmark> [opciones]
+
+
+def load_history_articles():
+    """Carga todos los artículos guardados en data/history como dicts, en orden cronológico."""
+    articles = []
+    for history_file in sorted(config.HISTORY_DIR.glob("*.json")):
+        try:
+            with open(history_file, 'r', encoding='utf-8') as f:
+                articles.extend(json.load(f))
+        except Exception as e:
+            logger.error(f"Error cargando {history_file}: {e}")
+    return articles
+
+
+def _time_call(function, inputs, repeat):
+    """Devuelve el mejor tiempo (segundos) de `repeat` pasadas de `function` sobre todos los `inputs`."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in inputs:
+            function(item)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_extraction(args):
+    """Compara los backends de extracción de texto (velocidad y paridad de salida) sobre el HTML del historial."""
+    from .text_extraction import html_to_text_fast, html_to_text_bs4
+
+    documents = [a['content_raw'] for a in load_history_articles() if a.get('content_raw')]
+    if not documents:
+        print("No hay HTML en data/history para el benchmark.")
+        return 1
+    total_bytes = sum(len(d.encode('utf-8')) for d in documents)
+    print(f"Documentos: {len(documents)} ({total_bytes / 1024:.0f} KiB de HTML)")
+
+    mismatches = [d for d in documents if html_to_text_fast(d) != html_to_text_bs4(d)]
+    parity = 100.0 * (len(documents) - len(mismatches)) / len(documents)
+    print(f"Paridad de salida fast vs bs4: {parity:.2f}% ({len(mismatches)} diferencias)")
+
+    time_bs4 = _time_call(html_to_text_bs4, documents, args.repeat)
+    time_fast = _time_call(html_to_text_fast, documents, args.repeat)
+    print(f"bs4:  {time_bs4 * 1000:8.1f} ms  ({time_bs4 / len(documents) * 1e6:7.1f} µs/doc)")
+    print(f"fast: {time_fast * 1000:8.1f} ms  ({time_fast / len(documents) * 1e6:7.1f} µs/doc)")
+    print(f"Speedup: {time_bs4 / time_fast:.1f}x")
+    return 0 if not mismatches else 2
+
+
+def _fresh(text):
+    """Copia de un str que no comparte objeto con el original (para medir memoria de forma realista)."""
+    return text.encode('utf-8').decode('utf-8') if text else text
+
+
+def bench_memory(args):
+    """Memoria de N artículos como dicts (formato antiguo del colector) frente a registros Article."""
+    import tracemalloc
+    from .models import Article, SourceConfig
+
+    history = [a for a in load_history_articles() if a.get('content_text')]
+    if not history:
+        print("No hay artículos en data/history para el benchmark.")
+        return 1
+    sample = [history[i % len(history)] for i in range(args.articles)]
+    sources = {}
+    for data in history:
+        name = data.get('source_name')
+        sources.setdefault(name, {"url": "", "name": name, "default_category": data.get('default_category'),
+                                  "keywords": data.get('source_keywords', []),
+                                  "blacklist": data.get('source_blacklist', []),
+                                  "include_always": data.get('include_always', False)})
+    source_configs = {name: SourceConfig.from_dict(d) for name, d in sources.items()}
+
+    def build_dicts():
+        return [{
+            "id": _fresh(d['link']), "title": _fresh(d['title']), "link": _fresh(d['link']),
+            "published_date": _fresh(d['published_date']),
+            "content_raw": _fresh(d.get('content_raw') or d['content_text']),
+            "content_text": _fresh(d['content_text']),
+            "source_name": d.get('source_name'),
+            "default_category": sources[d.get('source_name')]['default_category'],
+            "source_keywords": sources[d.get('source_name')]['keywords'],
+            "source_blacklist": sources[d.get('source_name')]['blacklist'],
+            "include_always": sources[d.get('source_name')]['include_always'],
+        } for d in sample]
+
+    def build_records():
+        return [Article(
+            id=_fresh(d['link']), title=_fresh(d['title']), link=_fresh(d['link']),
+            published_date=_fresh(d['published_date']), content_text=_fresh(d['content_text']),
+            source=source_configs[d.get('source_name')],
+        ) for d in sample]
+
+    results = {}
+    for label, build in (("dict (antiguo)", build_dicts), ("Article", build_records)):
+        tracemalloc.start()
+        articles = build()
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[label] = current
+        del articles
+        print(f"{label:15s}: {current / 1024 / 1024:8.2f} MiB para {args.articles} artículos")
+
+    old, new = results["dict (antiguo)"], results["Article"]
+    print(f"Reducción: {100.0 * (old - new) / old:.1f}%")
+    return 0
+
+
+def bench_collector(args):
+    """Colector en modo replay sobre feeds sintéticos (10, 100, 1000 fuentes) generados desde el historial."""
+    import tempfile
+    from pathlib import Path
+    from .collector import iter_source_articles
+    from .feed_fixtures import build_fixture_sources
+
+    config.FEED_MODE = "replay"
+    config.FEED_REPLAY_LATENCY = args.latency
+    for num_sources in args.sources:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config.FEED_RECORDINGS_DIR = Path(tmp_dir)
+            sources = build_fixture_sources(num_sources, tmp_dir)
+            modes = [("concurrente", config.COLLECTOR_MAX_WORKERS)]
+            if not args.latency or num_sources <= 100:  # En secuencial con latencia, 1000 fuentes tardan minutos
+                modes.insert(0, ("secuencial", 1))
+            for label, workers in modes:
+                start = time.perf_counter()
+                num_articles = sum(len(articles) for _, articles in
+                                   iter_source_articles(sources, max_workers=workers))
+                elapsed = time.perf_counter() - start
+                print(f"{num_sources:5d} fuentes, {label:11s} ({workers:2d} hilos): "
+                      f"{num_articles:6d} artículos en {elapsed:7.2f}s")
+    return 0
+
+
+class _SimulatedModel:
+    """Modelo LLM falso con latencia fija y respuesta determinista (benchmark 'llm')."""
+
+    def __init__(self, model_id, categories, latency):
+        self.model_id = model_id
+        self.categories = categories
+        self.latency = latency
+
+    def prompt(self, prompt, **options):
+        time.sleep(self.latency)
+        if "relevancia" in prompt:
+            answer = "Sí" if zlib.crc32(prompt.encode('utf-8')) % 2 else "No"
+        else:
+            answer = self.categories[zlib.crc32(prompt.encode('utf-8')) % len(self.categories)]
+        return _SimulatedResponse(answer)
+
+
+class _SimulatedResponse:
+    def __init__(self, answer):
+        self.answer = answer
+
+    def text(self):
+        return self.answer
+
+
+def bench_llm(args):
+    """Clasificación + relevancia (dos llamadas por artículo) con un modelo simulado, según la concurrencia."""
+    from . import classifier, llm_executor, llm_models
+    from .models import Article
+
+    history = [a for a in load_history_articles() if a.get('content_text')][:args.llm_articles]
+    if not history:
+        print("No hay artículos en data/history para el benchmark.")
+        return 1
+    sources_cache = {}
+    articles = [Article.from_dict(d, sources_cache) for d in history]
+    categories = classifier.get_preferences().get('global', {}).get('categories_order') or ["General"]
+
+    config.LLM_CACHE_ENABLED = False
+    llm_models.set_model("classification", _SimulatedModel("simulated-classification", categories, args.llm_latency))
+    llm_models.set_model("relevance", _SimulatedModel("simulated-relevance", categories, args.llm_latency))
+    logging.getLogger("feeddigest").setLevel(logging.ERROR)
+
+    reference = None
+    for concurrency in args.concurrency:
+        config.LLM_MAX_CONCURRENCY = concurrency
+        llm_executor.reset_limiters()
+        start = time.perf_counter()
+        decisions = classifier._decide_pending_articles(articles, categories, "two_step", batch_size=1)
+        elapsed = time.perf_counter() - start
+        reference = reference or decisions
+        print(f"Concurrencia {concurrency:3d}: {len(articles)} artículos ({2 * len(articles)} llamadas) "
+              f"en {elapsed:7.2f}s{'' if decisions == reference else '  (¡resultados distintos!)'}")
+    return 0
+
+
+def _filter_by_rules_legacy(article, global_prefs):
+    """filter_by_rules anterior (una búsqueda 'in' por keyword), como referencia del benchmark 'rules'."""
+    content_to_check = (article.title + " " + article.content_text[:150]).lower()
+    for keyword in global_prefs.get('blacklist_keywords_global', []):
+        if keyword.lower() in content_to_check:
+            return False
+    for keyword in article.source_blacklist:
+        if keyword.lower() in content_to_check:
+            return False
+    if len(article.content_text) < global_prefs.get('min_article_length_chars', config.MIN_ARTICLE_LENGTH_DEFAULT):
+        return False
+    if article.source_keywords:
+        return any(keyword.lower() in content_to_check for keyword in article.source_keywords)
+    return True
+
+
+def bench_rules(args):
+    """Filtrado por reglas con N artículos y K keywords (blacklist global y keywords de fuente)."""
+    import random
+    from . import classifier
+    from .models import Article, SourceConfig
+
+    history = [a for a in load_history_articles() if a.get('content_text')]
+    if not history:
+        print("No hay artículos en data/history para el benchmark.")
+        return 1
+    vocabulary = sorted({word.lower() for a in history for word in re.findall(r"\w{5,}", a['title'] + " " + a['content_text'])})
+    rng = random.Random(20250515)
+    sample_keywords = rng.sample(vocabulary, min(len(vocabulary), 2 * args.keywords))
+    blacklist, keywords = sample_keywords[:args.keywords], sample_keywords[args.keywords:]
+    source = SourceConfig(url="", name="benchmark", default_category=None, keywords=tuple(keywords))
+    articles = [Article(id=str(i), title=d['title'], link="", published_date=None, content_text=d['content_text'],
+                        source=source) for i, d in enumerate(history[i % len(history)] for i in range(args.articles))]
+    global_prefs = {"blacklist_keywords_global": blacklist, "min_article_length_chars": 40}
+    print(f"{len(articles)} artículos, {len(blacklist)} keywords en blacklist global, {len(keywords)} keywords de fuente")
+    logging.getLogger("feeddigest").setLevel(logging.ERROR)
+
+    legacy = [_filter_by_rules_legacy(a, global_prefs) for a in articles]
+    compiled = [classifier.filter_by_rules(a, global_prefs, {}) for a in articles]
+    print(f"Aceptados: {sum(compiled)} / {len(articles)}. Paridad con la versión anterior: "
+          f"{'sí' if compiled == legacy else 'NO'}")
+
+    time_legacy = _time_call(lambda a: _filter_by_rules_legacy(a, global_prefs), articles, args.repeat)
+    time_compiled = _time_call(lambda a: classifier.filter_by_rules(a, global_prefs, {}), articles, args.repeat)
+    print(f"anterior (in):   {time_legacy * 1000:8.1f} ms  ({time_legacy / len(articles) * 1e6:7.1f} µs/artículo)")
+    print(f"compilado (re):  {time_compiled * 1000:8.1f} ms  ({time_compiled / len(articles) * 1e6:7.1f} µs/artículo)")
+    print(f"Speedup: {time_legacy / time_compiled:.1f}x")
+    for word_boundary, accent_insensitive in ((True, False), (False, True), (True, True)):
+        options = dict(global_prefs, keyword_match_word_boundary=word_boundary,
+                       keyword_match_accent_insensitive=accent_insensitive)
+        elapsed = _time_call(lambda a: classifier.filter_by_rules(a, options, {}), articles, args.repeat)
+        accepted = sum(classifier.filter_by_rules(a, options, {}) for a in articles)
+        print(f"límite de palabra={word_boundary!s:5s} sin tildes={accent_insensitive!s:5s}: "
+              f"{elapsed * 1000:8.1f} ms, {accepted} aceptados")
+    return 0 if compiled == legacy else 2
+
+
+def _legacy_jinja_env():
+    """get_jinja_env anterior (un Environment nuevo en cada llamada), como referencia del benchmark 'render'."""
+    from jinja2 import Environment, FileSystemLoader, select_autoescape
+    return Environment(loader=FileSystemLoader(config.TEMPLATES_DIR), autoescape=select_autoescape(['html', 'xml']))
+
+
+def bench_render(args):
+    """Renderizado de N páginas diarias seguidas (re-render/backfill): entorno Jinja nuevo por página frente al compartido."""
+    from . import generator
+
+    history = load_history_articles()
+    if not history:
+        print("No hay artículos en data/history para el benchmark.")
+        return 1
+    # El Markdown se convierte una sola vez: solo se mide el coste de las plantillas
+    content = {}
+    for article in history:
+        items = content.setdefault(article.get('assigned_category') or "Sin categoría", [])
+        if len(items) < 5:
+            items.append({"content_html": generator.markdown_to_html(f"**{article['title']}** [{len(items) + 1}]")})
+    pages = [f"bench-{i:04d}" for i in range(args.pages)]
+    print(f"{len(pages)} páginas con {len(content)} categorías")
+    logging.getLogger("feeddigest").setLevel(logging.ERROR)
+
+    def render(date_str):
+        return generator._render_daily_page(content, date_str)
+
+    shared_env = generator.get_jinja_env
+    generator.get_jinja_env = _legacy_jinja_env
+    try:
+        legacy_html = render(pages[0])
+        time_legacy = _time_call(render, pages, args.repeat)
+    finally:
+        generator.get_jinja_env = shared_env
+    start = time.perf_counter()
+    shared_html = render(pages[0])  # Primera plantilla: compila o lee el bytecode de config.JINJA_CACHE_DIR
+    time_first = time.perf_counter() - start
+    time_shared = _time_call(render, pages, args.repeat)
+
+    timestamp_re = re.compile(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}")
+    same_output = timestamp_re.sub("", legacy_html) == timestamp_re.sub("", shared_html)
+    print(f"Paridad con el entorno por página: {'sí' if same_output else 'NO'}")
+    print(f"entorno por página: {time_legacy * 1000:8.1f} ms  ({time_legacy / len(pages) * 1000:6.2f} ms/página)")
+    print(f"entorno compartido: {time_shared * 1000:8.1f} ms  ({time_shared / len(pages) * 1000:6.2f} ms/página), "
+          f"primera carga {time_first * 1000:.1f} ms")
+    print(f"Speedup: {time_legacy / time_shared:.1f}x")
+    return 0 if same_output else 2
+
+
+# Presupuesto de importación (ms acumulados según `python -X importtime`, en un intérprete nuevo) de los
+# puntos de entrada, y módulos pesados que solo deben importarse al usarse (ver llm_models y generator)
+IMPORT_TIME_BUDGETS_MS = {
+    "feeddigest.src.main": 500,
+    "feeddigest.src.weekly_summary": 250,
+    "feeddigest.src.generator": 250,
+}
+LAZY_MODULES = ("llm", "jinja2", "markdown", "bs4")
+
+
+def _measure_import(module):
+    """Importa `module` en un intérprete nuevo. Devuelve (ms acumulados, módulos perezosos cargados, salida impresa)."""
+    import os
+    import subprocess
+    import sys
+
+    code = (f"import sys, {module}; "
+            f"print('\\n' + ','.join(sorted(m for m in {LAZY_MODULES!r} if m in sys.modules)))")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(config.PROJECT_ROOT),
+                                                                        os.environ.get("PYTHONPATH")])))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True,
+                            cwd=config.PROJECT_ROOT, env=env, check=True)
+    output, _, loaded = result.stdout.rstrip("\n").rpartition("\n")
+    cumulative_us = 0
+    for line in result.stderr.splitlines():
+        # Formato: "import time: <propio us> | <acumulado us> | <módulo con sangría>"
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == module:
+            cumulative_us = int(parts[1])
+    return cumulative_us / 1000, [m for m in loaded.split(",") if m], output.strip()
+
+
+def bench_imports(args):
+    """Tiempo de importación de los puntos de entrada frente a su presupuesto; falla (código 1) si se excede."""
+    failures = 0
+    for module, budget_ms in IMPORT_TIME_BUDGETS_MS.items():
+        measurements = [_measure_import(module) for _ in range(args.repeat)]
+        best_ms = min(elapsed for elapsed, _, _ in measurements)
+        _, loaded, output = measurements[-1]
+        problems = []
+        if best_ms > budget_ms:
+            problems.append(f"excede el presupuesto de {budget_ms} ms")
+        if loaded:
+            problems.append(f"importa al cargarse {', '.join(loaded)}")
+        if output:
+            problems.append(f"escribe en stdout al importarse: {output[:80]!r}")
+        failures += bool(problems)
+        print(f"{module:32s} {best_ms:7.1f} ms (presupuesto {budget_ms} ms)"
+              f"{'  ERROR: ' + '; '.join(problems) if problems else ''}")
+    return 1 if failures else 0
+
+
+BENCHMARKS = {
+    "extraction": bench_extraction,
+    "imports": bench_imports,
+    "memory": bench_memory,
+    "collector": bench_collector,
+    "llm": bench_llm,
+    "rules": bench_rules,
+    "render": bench_render,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de FeedDigest")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones (se informa del mejor tiempo)")
+    parser.add_argument("--articles", type=int, default=10000, help="Número de artículos (benchmarks 'memory' y 'rules')")
+    parser.add_argument("--pages", type=int, default=200, help="Número de páginas (benchmark 'render')")
+    parser.add_argument("--keywords", type=int, default=1000, help="Keywords por lista (benchmark 'rules')")
+    parser.add_argument("--sources", type=int, nargs="+", default=[10, 100, 1000],
+                        help="Tamaños en número de fuentes (benchmark 'collector')")
+    parser.add_argument("--latency", action="store_true",
+                        help="Simular la latencia de red grabada (benchmark 'collector')")
+    parser.add_argument("--llm-articles", type=int, default=100, help="Número de artículos (benchmark 'llm')")
+    parser.add_argument("--llm-latency", type=float, default=0.05,
+                        help="Latencia simulada por llamada en segundos (benchmark 'llm')")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8],
+                        help="Llamadas simultáneas por modelo a comparar (benchmark 'llm')")
+    args = parser.parse_args(argv)
+    return BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,107 +1,95 @@
 import json
 import logging
-import llm  # <--- AÑADIDO
+from datetime import datetime, timezone
 from .. import config
+from .llm_cache import prompt_text
+from .llm_models import get_model
+from .truncation import truncate_to_tokens, fit_texts_to_budget
+from .run_config import get_run_config
+from .keyword_matcher import get_keyword_matcher, normalize_text
+from .local_classifier import load_local_classifier, is_audit_sample, record_local_decision, \
+    log_local_classifier_stats, DEFAULT_CONFIDENCE_SCALE
+from .scheduler import CandidateQueue, CategoryCapacity, LLMBudget, FREE_PRIORITY, article_priority, \
+    decide_in_waves, record_skipped, log_scheduler_stats
+from .llm_executor import map_ordered, get_model_concurrency, LLMBudgetExhausted
+from .seen_index import load_seen_index, save_seen_index, lookup_seen_article, record_seen_article
+from .dedup import get_duplicate_detector
 
 logging.basicConfig(level=config.LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
 # --- Carga de Configuraciones ---
-_preferences_cache = None
-_prompts_cache = None
+_local_classifier_cache = None
 
 
 def get_preferences():
-    global _preferences_cache
-    if _preferences_cache is None:
-        try:
-            with open(config.PREFERENCES_FILE, 'r', encoding='utf-8') as f:  # Corrección aquí
-                _preferences_cache = json.load(f)
-        except FileNotFoundError:
-            logger.error(f"Archivo de preferencias no encontrado: {config.PREFERENCES_FILE}")
-            _preferences_cache = {}
-        except json.JSONDecodeError:
-            logger.error(f"Error decodificando el archivo JSON de preferencias: {config.PREFERENCES_FILE}")
-            _preferences_cache = {}
-    return _preferences_cache
+    """Preferencias de la instantánea de configuración de la ejecución (solo lectura)."""
+    return get_run_config().preferences
 
 
 def get_prompts():
-    global _prompts_cache
-    if _prompts_cache is None:
-        try:
-            with open(config.PROMPTS_FILE, 'r', encoding='utf-8') as f:
-                _prompts_cache = json.load(f)
-        except FileNotFoundError:
-            logger.error(f"Archivo de prompts no encontrado: {config.PROMPTS_FILE}")
-            _prompts_cache = {}  # Devolver un dict vacío para evitar errores NoneType
-        except json.JSONDecodeError:
-            logger.error(f"Error decodificando el archivo JSON de prompts: {config.PROMPTS_FILE}")
-            _prompts_cache = {}
-    return _prompts_cache
-
-
-# --- Modelos de IA ---
-try:
-    model_classification = llm.get_model(config.LLM_MODEL_CLASSIFICATION)
-    model_relevance = llm.get_model(config.LLM_MODEL_RELEVANCE)
-    # Configurar timeouts si es necesario, ej: model_classification.options.timeout = 30
-except Exception as e:
-    logger.error(f"Error al cargar modelos LLM: {e}. Las funciones de IA no operarán correctamente.")
-    model_classification = None
-    model_relevance = None
+    """Prompts de la instantánea de configuración de la ejecución (solo lectura)."""
+    return get_run_config().prompts
 
 
 # --- Nivel 1: Filtrado rápido basado en reglas ---
 def filter_by_rules(article, global_prefs, source_prefs):
-    content_to_check = (article['title'] + " " + article['content_text'][:150]).lower()
-
-    for keyword in global_prefs.get('blacklist_keywords_global', []):
-        if keyword.lower() in content_to_check:
-            logger.info(f"Filtrado por blacklist global (keyword: {keyword}): {article['title']}")
-            return False
+    # Las listas de keywords se compilan una vez por ejecución (ver keyword_matcher); opciones en preferences.json
+    word_boundary = global_prefs.get('keyword_match_word_boundary', False)
+    accent_insensitive = global_prefs.get('keyword_match_accent_insensitive', False)
+    content_to_check = normalize_text(article.title + " " + article.content_text[:150], accent_insensitive)
+
+    global_blacklist = get_keyword_matcher(global_prefs.get('blacklist_keywords_global', ()),
+                                           word_boundary, accent_insensitive)
+    keyword = global_blacklist.find(content_to_check)
+    if keyword is not None:
+        logger.info(f"Filtrado por blacklist global (keyword: {keyword}): {article.title}")
+        return False
 
-    for keyword in article.get('source_blacklist', []):
-        if keyword.lower() in content_to_check:
-            logger.info(f"Filtrado por blacklist de fuente (keyword: {keyword}): {article['title']}")
-            return False
+    keyword = get_keyword_matcher(article.source_blacklist, word_boundary, accent_insensitive).find(content_to_check)
+    if keyword is not None:
+        logger.info(f"Filtrado por blacklist de fuente (keyword: {keyword}): {article.title}")
+        return False
 
     min_len = global_prefs.get('min_article_length_chars', config.MIN_ARTICLE_LENGTH_DEFAULT)
-    if len(article['content_text']) < min_len:
-        logger.info(f"Filtrado por longitud mínima ({len(article['content_text'])} < {min_len}): {article['title']}")
+    if len(article.content_text) < min_len:
+        logger.info(f"Filtrado por longitud mínima ({len(article.content_text)} < {min_len}): {article.title}")
         return False
 
-    source_keywords = article.get('source_keywords', [])
-    if source_keywords:
-        matched_source_keyword = False
-        for keyword in source_keywords:
-            if keyword.lower() in content_to_check:
-                matched_source_keyword = True
-                break
-        if not matched_source_keyword:
-            logger.info(f"Filtrado por no coincidir con keywords de fuente: {article['title']}")
-            return False
+    source_keywords = get_keyword_matcher(article.source_keywords, word_boundary, accent_insensitive)
+    if source_keywords and source_keywords.find(content_to_check) is None:
+        logger.info(f"Filtrado por no coincidir con keywords de fuente: {article.title}")
+        return False
     return True
 
 
 # --- Nivel 2: Clasificación con IA optimizada ---
-def classify_article_ia(article, categories_list, default_category):
-    if not model_classification:
+def classify_article_ia(article, categories_list, default_category, run_config=None):
+    result = _classify_article_ia(article, categories_list, default_category, run_config)
+    return result[0] if result is not None else default_category
+
+
+def _classify_article_ia(article, categories_list, default_category, run_config=None, budget=None):
+    """
+    Devuelve (categoría, decidida_por_ia). decidida_por_ia es False cuando se usó un fallback.
+    Devuelve None si el presupuesto `budget` (scheduler.LLMBudget) no permite hacer la llamada (sin decidir).
+    """
+    model = get_model("classification")
+    if not model:
         logger.warning("Modelo de clasificación no disponible. Usando categoría por defecto.")
-        return default_category
+        return default_category, False
 
-    prompts = get_prompts()
-    prompt_template = prompts.get("classification", {}).get("default")
+    run_config = run_config or get_run_config()
+    # Plantilla precompilada: la lista de categorías (las de la configuración) ya está sustituida
+    prompt_template = run_config.classification_prompt
     if not prompt_template:
         logger.error("No se encontró la plantilla de prompt para clasificación. Usando categoría por defecto.")
-        return default_category
+        return default_category, False
 
-    title = article['title']
-    short_content = article['content_text'][
-                    :get_preferences().get('global', {}).get('max_chars_for_classification_check', 150)]
+    title = article.title
+    short_content = truncate_to_tokens(article.content_text, run_config.content_token_budget("classification"))
 
     prompt = prompt_template.format(
-        categories_list=", ".join(f"'{c}'" for c in categories_list),  # Enviar como una lista de strings
         title=title,
         short_content=short_content,
         default_category=default_category
@@ -109,175 +97,557 @@ def classify_article_ia(article, categories_list, default_category):
 
     logger.info(f"Clasificando artículo (IA): {title[:50]}...")
     try:
-        response = model_classification.prompt(prompt)
-        predicted_category = response.text().strip().replace("'", "").replace('"', '')  # Limpiar comillas
+        response_text = prompt_text(model, prompt, budget=budget)
+        predicted_category = response_text.strip().replace("'", "").replace('"', '')  # Limpiar comillas
 
         if predicted_category in categories_list:
             logger.info(f"Artículo '{title[:50]}' clasificado como '{predicted_category}' por IA.")
-            return predicted_category
+            return predicted_category, True
         else:
             logger.warning(
-                f"IA devolvió categoría no válida ('{predicted_category}') para '{title[:50]}'. Usando default: '{default_category}'. Respuesta LLM: {response.text()}")
-            return default_category
+                f"IA devolvió categoría no válida ('{predicted_category}') para '{title[:50]}'. Usando default: '{default_category}'. Respuesta LLM: {response_text}")
+            return default_category, False  # Fallback: no se recuerda en el índice de vistos
+    except LLMBudgetExhausted:
+        return None
     except Exception as e:
         logger.error(f"Error en llamada a LLM para clasificación de '{title[:50]}': {e}. Usando default.")
-        return default_category
+        return default_category, False
+
+
+def _default_category_for(article, categories_list):
+    return article.default_category or (categories_list[0] if categories_list else "General")
+
+
+def _batch_short_contents(articles, max_tokens_per_article):
+    """Extractos para un prompt por lotes: el lote comparte max_tokens_per_article x n (hasta el doble por artículo)."""
+    return fit_texts_to_budget([article.content_text for article in articles],
+                               max_tokens_per_article * len(articles), 2 * max_tokens_per_article)
+
+
+def _parse_json_object(response_text):
+    """Extrae el primer objeto JSON de la respuesta del LLM (tolera bloques ```json y texto alrededor)."""
+    start, end = response_text.find('{'), response_text.rfind('}')
+    if start == -1 or end <= start:
+        raise ValueError("la respuesta no contiene un objeto JSON")
+    parsed = json.loads(response_text[start:end + 1])
+    if not isinstance(parsed, dict):
+        raise ValueError("la respuesta JSON no es un objeto")
+    return parsed
+
+
+def classify_articles_batch_ia(articles, categories_list, run_config=None, budget=None):
+    """
+    Clasifica varios artículos en una sola llamada al LLM, que debe responder un JSON {índice: categoría}.
+    Devuelve una lista de (categoría, decidida_por_ia) alineada con `articles`. Los artículos cuya entrada
+    falte o no sea una categoría válida se reclasifican de uno en uno con classify_article_ia.
+    Las entradas son None para los artículos que el presupuesto `budget` ya no permitió clasificar.
+    """
+    run_config = run_config or get_run_config()
+    model = get_model("classification")
+    if not model or not articles:
+        return [_classify_article_ia(article, categories_list, _default_category_for(article, categories_list),
+                                     run_config, budget)
+                for article in articles]
+
+    prompt_template = run_config.classification_batch_prompt
+    article_template = run_config.classification_batch_article
+    if not prompt_template or not article_template:
+        logger.error("No se encontró la plantilla de prompt para clasificación por lotes. Clasificando uno a uno.")
+        return [_classify_article_ia(article, categories_list, _default_category_for(article, categories_list),
+                                     run_config, budget)
+                for article in articles]
+
+    short_contents = _batch_short_contents(articles, run_config.content_token_budget("classification"))
+    articles_section = "\n".join(
+        article_template.format(index=i + 1, title=article.title, short_content=short_content,
+                                default_category=_default_category_for(article, categories_list))
+        for i, (article, short_content) in enumerate(zip(articles, short_contents)))
+    prompt = prompt_template.format(articles_section=articles_section)
+
+    logger.info(f"Clasificando lote de {len(articles)} artículos (IA)...")
+    predictions = {}
+    try:
+        predictions = _parse_json_object(prompt_text(model, prompt, budget=budget))
+    except LLMBudgetExhausted:
+        return [None] * len(articles)
+    except Exception as e:
+        logger.error(f"Error en la clasificación por lotes ({len(articles)} artículos): {e}. Clasificando uno a uno.")
+
+    results = []
+    for i, article in enumerate(articles):
+        predicted_category = str(predictions.get(str(i + 1), "")).strip().replace("'", "").replace('"', '')
+        if predicted_category in categories_list:
+            logger.info(f"Artículo '{article.title[:50]}' clasificado como '{predicted_category}' por IA (lote).")
+            results.append((predicted_category, True))
+        else:
+            if predictions:
+                logger.warning(
+                    f"Lote sin categoría válida para '{article.title[:50]}' ('{predicted_category}'). Clasificando individualmente.")
+            results.append(_classify_article_ia(article, categories_list,
+                                                _default_category_for(article, categories_list), run_config, budget))
+    return results
 
 
 # --- Nivel 2: Evaluación de relevancia con IA ---
-def check_relevance_ia(article, category):
-    if not model_relevance:
-        logger.warning("Modelo de relevancia no disponible. Asumiendo relevante si pasa filtros básicos.")
-        return True  # O False, dependiendo de la política de fallback deseada
+def build_criteria_text(category, run_config=None):
+    """Texto de criterios de relevancia de `category` (precalculado una vez por categoría en la instantánea)."""
+    return (run_config or get_run_config()).criteria_text(category)
 
-    prefs = get_preferences()
-    prompts = get_prompts()
 
-    prompt_base_template = prompts.get("relevance", {}).get("base")
-    criteria_templates = prompts.get("relevance", {}).get("criteria_templates", {})
-    no_specific_criteria_text = prompts.get("relevance", {}).get("no_specific_criteria",
-                                                                 "No hay criterios específicos.")
+def get_min_relevance_score(category, run_config=None):
+    return (run_config or get_run_config()).min_relevance_score(category)
 
-    if not prompt_base_template:
-        logger.error("No se encontró la plantilla base de prompt para relevancia. Asumiendo relevante.")
-        return True
 
-    category_prefs = prefs.get('categories', {}).get(category, {})
-    title = article['title']
-    short_content = article['content_text'][:prefs.get('global', {}).get('max_chars_for_relevance_check', 300)]
+def check_relevance_ia(article, category, run_config=None):
+    result = _check_relevance_ia(article, category, run_config)
+    return result[0] if result is not None else True  # Mismo fallback que un error del LLM
 
-    # Construir el texto de criterios
-    criteria_text_parts = []
-    category_criteria_template = criteria_templates.get(category, criteria_templates.get("General"))
 
-    if category_criteria_template:
-        # Sustituir placeholders en la plantilla de criterios
-        # Ejemplo: teams_of_interest, topics_of_interest, etc.
-        # Esto requiere que los nombres de las claves en category_prefs coincidan con los placeholders
-        try:
-            formatted_criteria = category_criteria_template.format(**category_prefs)
-            criteria_text_parts.append(formatted_criteria)
-        except KeyError as e:
-            logger.warning(
-                f"Falta la clave '{e}' en preferences.json para formatear criterios de relevancia de '{category}'. Usando texto genérico.")
-            criteria_text_parts.append(no_specific_criteria_text)
-    else:
-        criteria_text_parts.append(no_specific_criteria_text)
+def _check_relevance_ia(article, category, run_config=None, budget=None):
+    """
+    Devuelve (relevante, decidido_por_ia). decidido_por_ia es False cuando se usó un fallback.
+    Devuelve None si el presupuesto `budget` (scheduler.LLMBudget) no permite hacer la llamada (sin decidir).
+    """
+    model = get_model("relevance")
+    if not model:
+        logger.warning("Modelo de relevancia no disponible. Asumiendo relevante si pasa filtros básicos.")
+        return True, False  # O False, dependiendo de la política de fallback deseada
 
-    final_criteria_text = "\n".join(criteria_text_parts)
+    run_config = run_config or get_run_config()
+    # Plantilla precompilada por categoría: category y criteria_text ya están sustituidos
+    prompt_template = run_config.relevance_prompt_for(category)
 
-    prompt = prompt_base_template.format(
-        category=category,
-        criteria_text=final_criteria_text,
+    if not prompt_template:
+        logger.error("No se encontró la plantilla base de prompt para relevancia. Asumiendo relevante.")
+        return True, False
+
+    title = article.title
+    short_content = truncate_to_tokens(article.content_text, run_config.content_token_budget("relevance"))
+
+    prompt = prompt_template.format(
         title=title,
         short_content=short_content
     )
 
     logger.info(f"Evaluando relevancia (IA) para '{title[:50]}' en '{category}'...")
     try:
-        response = model_relevance.prompt(prompt)
-        answer = response.text().strip().lower()
+        response_text = prompt_text(model, prompt, budget=budget)
+        answer = response_text.strip().lower()
         logger.info(f"Respuesta '{answer}'.")
         if answer == 'sí' or answer == 'si':
             logger.info(f"Artículo '{title[:50]}' es RELEVANTE para '{category}' según IA.")
-            return True
+            return True, True
         elif answer == 'no':
             logger.info(f"Artículo '{title[:50]}' NO es relevante para '{category}' según IA.")
-            return False
+            return False, True
         else:
             logger.warning(
-                f"IA devolvió respuesta no válida ('{answer}') para relevancia de '{title[:50]}'. Asumiendo no relevante. Respuesta LLM: {response.text()}")
-            return False  # Fallback a no relevante si la respuesta no es clara
+                f"IA devolvió respuesta no válida ('{answer}') para relevancia de '{title[:50]}'. Asumiendo no relevante. Respuesta LLM: {response_text}")
+            return False, False  # Fallback a no relevante si la respuesta no es clara
+    except LLMBudgetExhausted:
+        return None
     except Exception as e:
         logger.error(f"Error en llamada a LLM para relevancia de '{title[:50]}': {e}. Asumiendo relevante.")
-        return True
-
-
-def classify_and_filter_articles(articles):
-    prefs = get_preferences()
-    global_prefs = prefs.get('global', {})
-    defined_categories = global_prefs.get("categories_order", list(prefs.get("categories", {}).keys()))
-    logger.info(f"Categorías definidas para clasificación: {defined_categories}")
-    if not defined_categories:
-        defined_categories = ["General"]
-        logger.warning("No se encontraron 'categories_order' o 'categories' en preferences.json. Usando 'General'.")
-
-    classified_articles = {cat: [] for cat in defined_categories}
-    if "General" not in classified_articles and "General" in defined_categories:
-        classified_articles["General"] = []
-
-    num_filtered_rules = 0
-    num_filtered_relevance = 0
-    num_processed = 0
-
+        return True, False
+
+
+# --- Nivel 2 (modo fusionado): categoría + puntuación de relevancia en una sola llamada ---
+def classify_and_score_batch_ia(articles, categories_list, run_config=None, budget=None):
+    """
+    Pide al LLM, en una sola llamada para todo el lote, la categoría y una puntuación de relevancia (0-1)
+    de cada artículo, con los criterios de todas las categorías en el mismo prompt.
+    Un artículo es relevante si su puntuación alcanza el min_relevance_score de su categoría.
+    Devuelve una lista de (categoría, relevante, decidido_por_ia) alineada con `articles`; los artículos
+    sin respuesta válida se resuelven con el flujo clásico de dos llamadas. Las entradas son None para los
+    artículos que el presupuesto `budget` ya no permitió decidir.
+    """
+    run_config = run_config or get_run_config()
+    # Plantilla precompilada: la lista de categorías y sus criterios ya están sustituidos
+    prompt_template = run_config.fused_prompt
+    article_template = run_config.fused_article
+    predictions = {}
+    model = get_model("relevance")
+
+    if not model:
+        logger.warning("Modelo de relevancia no disponible para el modo fusionado. Usando el flujo de dos llamadas.")
+    elif not prompt_template or not article_template:
+        logger.error("No se encontró la plantilla de prompt del modo fusionado. Usando el flujo de dos llamadas.")
+    else:
+        short_contents = _batch_short_contents(articles, run_config.content_token_budget("relevance"))
+        articles_section = "\n".join(
+            article_template.format(index=i + 1, title=article.title, short_content=short_content,
+                                    default_category=_default_category_for(article, categories_list))
+            for i, (article, short_content) in enumerate(zip(articles, short_contents)))
+        prompt = prompt_template.format(articles_section=articles_section)
+        logger.info(f"Clasificando y evaluando relevancia de {len(articles)} artículos en una llamada (IA)...")
+        try:
+            predictions = _parse_json_object(prompt_text(model, prompt, budget=budget))
+        except LLMBudgetExhausted:
+            return [None] * len(articles)
+        except Exception as e:
+            logger.error(f"Error en la llamada fusionada ({len(articles)} artículos): {e}. Usando el flujo de dos llamadas.")
+
+    results = []
+    for i, article in enumerate(articles):
+        prediction = predictions.get(str(i + 1))
+        try:
+            category = str(prediction['category']).strip().replace("'", "").replace('"', '')
+            score = float(prediction['score'])
+            if category not in categories_list or not 0.0 <= score <= 1.0:
+                raise ValueError(f"categoría '{category}' o puntuación {score} no válidas")
+        except (KeyError, TypeError, ValueError) as e:
+            if predictions:
+                logger.warning(f"Respuesta fusionada no válida para '{article.title[:50]}' ({e}). Usando dos llamadas.")
+            classified = _classify_article_ia(article, categories_list,
+                                              _default_category_for(article, categories_list), run_config, budget)
+            relevance = (_check_relevance_ia(article, classified[0], run_config, budget)
+                         if classified is not None else None)
+            if relevance is None:
+                results.append(None)
+                continue
+            category, category_decided = classified
+            is_relevant, relevance_decided = relevance
+            results.append((category, is_relevant, category_decided and relevance_decided))
+            continue
+
+        article.relevance_score = score
+        is_relevant = score >= run_config.min_relevance_score(category)
+        logger.info(f"Artículo '{article.title[:50]}' -> '{category}' con relevancia {score:.2f} "
+                    f"({'RELEVANTE' if is_relevant else 'no relevante'}) según IA.")
+        results.append((category, is_relevant, True))
+    return results
+
+
+def _get_local_classifier(run_config):
+    """Clasificador local entrenado con el historial, o None si está desactivado o aún no tiene datos suficientes."""
+    global _local_classifier_cache
+    global_prefs = run_config.global_prefs
+    if not global_prefs.get('local_classifier_enabled', False):
+        return None
+    if _local_classifier_cache is None:
+        try:
+            _local_classifier_cache = load_local_classifier()
+        except Exception as e:
+            logger.error(f"Error cargando el clasificador local: {e}. Se clasificará solo con IA.")
+            _local_classifier_cache = False
+    min_articles = global_prefs.get('local_classifier_min_training_articles', 200)
+    if _local_classifier_cache and _local_classifier_cache.num_documents < min_articles:
+        logger.debug(f"Clasificador local con solo {_local_classifier_cache.num_documents} artículos "
+                     f"(< {min_articles}). No se usa.")
+        return None
+    return _local_classifier_cache or None
+
+
+def _predict_locally(article, categories_list, run_config):
+    """(categoría, confianza) del clasificador local, o (None, 0.0) si no está disponible."""
+    local_model = _get_local_classifier(run_config)
+    if local_model is None:
+        return None, 0.0
+    return local_model.predict(article.title, article.content_text, article.source_name,
+                               allowed_classes=categories_list,
+                               confidence_scale=run_config.global_prefs.get('local_classifier_confidence_scale',
+                                                                            DEFAULT_CONFIDENCE_SCALE))
+
+
+def _is_confident_local_prediction(article, prediction, run_config):
+    """True si la predicción local decide el artículo sin el LLM (confianza suficiente y no es de auditoría)."""
+    global_prefs = run_config.global_prefs
+    threshold = global_prefs.get('local_classifier_confidence_threshold', 0.95)
+    return (prediction[0] is not None and prediction[1] >= threshold and
+            not is_audit_sample(article.id, global_prefs.get('local_classifier_audit_rate', 0.0)))
+
+
+def _classify_pending_articles(pending, categories_list, batch_size, run_config, local_predictions=None, budget=None):
+    """
+    Devuelve (categoría, decidida) para cada artículo de `pending`, o None si el presupuesto de LLM ya no
+    permitió clasificarlo. Los artículos que el clasificador local
+    asigna con confianza >= local_classifier_confidence_threshold no se envían al LLM, salvo una fracción de
+    auditoría (local_classifier_audit_rate) que sirve para medir cuánto coinciden ambos.
+    """
+    global_prefs = run_config.global_prefs
+    if local_predictions is None:
+        local_predictions = [_predict_locally(article, categories_list, run_config) for article in pending]
+    threshold = global_prefs.get('local_classifier_confidence_threshold', 0.95)
+    audit_rate = global_prefs.get('local_classifier_audit_rate', 0.0)
+
+    results = [None] * len(pending)
+    to_llm = []
+    for i, (article, (category, confidence)) in enumerate(zip(pending, local_predictions)):
+        if category is not None and confidence >= threshold and not is_audit_sample(article.id, audit_rate):
+            logger.info(f"Artículo '{article.title[:50]}' clasificado como '{category}' por el clasificador local "
+                        f"(confianza {confidence:.2f}).")
+            record_local_decision("local")
+            results[i] = (category, True)
+        else:
+            to_llm.append(i)
+
+    def classify_batch(batch):
+        if len(batch) > 1:
+            return classify_articles_batch_ia(batch, categories_list, run_config, budget)
+        return [_classify_article_ia(article, categories_list, _default_category_for(article, categories_list),
+                                     run_config, budget)
+                for article in batch]
+
+    llm_articles = [pending[i] for i in to_llm]
+    batches = [llm_articles[i:i + batch_size] for i in range(0, len(llm_articles), batch_size)]
+    batch_categories = map_ordered(classify_batch, batches,
+                                   max_workers=get_model_concurrency(get_model("classification")))
+    for i, classified in zip(to_llm, (classified for batch in batch_categories for classified in batch)):
+        results[i] = classified
+        if classified is None:
+            continue
+        category, decided = classified
+        local_category, confidence = local_predictions[i]
+        if local_category is not None and decided:
+            record_local_decision("audited" if confidence >= threshold else "llm", agreed=local_category == category)
+    return results
+
+
+def _check_pending_relevance(pending, categories, run_config, budget=None):
+    """
+    Devuelve (relevante, decidido) para cada artículo de `pending` en su categoría, o None si el presupuesto de
+    LLM ya no permitió comprobarlo.
+    """
+    return map_ordered(lambda item: _check_relevance_ia(item[0], item[1], run_config, budget),
+                       list(zip(pending, categories)), max_workers=get_model_concurrency(get_model("relevance")))
+
+
+def _decide_pending_articles(pending, categories_list, classification_mode, batch_size=1,
+                             capacity=None, budget=None, local_predictions=None, run_config=None):
+    """
+    Devuelve (categoría, relevante, decidido_por_ia) para cada artículo pendiente de IA, en el orden de
+    `pending`, o None para los que no se llegan a decidir: su categoría ya está llena según `capacity`
+    (scheduler.CategoryCapacity) o se agotó el presupuesto `budget` (scheduler.LLMBudget, que el ejecutor LLM
+    aplica llamada a llamada; ver llm_executor.execute_prompt).
+    Los lotes de `batch_size` artículos (y, en modo two_step, las comprobaciones de relevancia) se lanzan
+    en paralelo; el ejecutor LLM limita la concurrencia y la cuota de cada modelo.
+    """
+    run_config = run_config or get_run_config()
+    if local_predictions is None:
+        local_predictions = [_predict_locally(article, categories_list, run_config) for article in pending]
+    results = [None] * len(pending)
+    if budget is not None and budget.exhausted():
+        record_skipped("budget", len(pending))
+        return results
+
+    if capacity is not None and all(capacity.is_full(category) for category in categories_list):
+        record_skipped("full", len(pending))
+        return results
+
+    # Sin gastar llamadas en artículos que el clasificador local asigna con confianza a una categoría llena
+    candidates = []
+    for i, (article, prediction) in enumerate(zip(pending, local_predictions)):
+        if (capacity is not None and _is_confident_local_prediction(article, prediction, run_config)
+                and capacity.is_full(prediction[0])):
+            record_skipped("full")
+        else:
+            candidates.append(i)
+    if not candidates:
+        return results
+
+    if classification_mode == "fused":
+        articles = [pending[i] for i in candidates]
+        batches = [articles[i:i + batch_size] for i in range(0, len(articles), batch_size)]
+        batch_decisions = map_ordered(lambda batch: classify_and_score_batch_ia(batch, categories_list, run_config,
+                                                                                budget),
+                                      batches,
+                                      max_workers=get_model_concurrency(get_model("relevance")))
+        for i, decision in zip(candidates, (decision for decisions in batch_decisions for decision in decisions)):
+            results[i] = decision
+            if decision is None:
+                record_skipped("budget")
+        return results
+
+    classified = _classify_pending_articles([pending[i] for i in candidates], categories_list, batch_size, run_config,
+                                            [local_predictions[i] for i in candidates], budget)
+    categories = {}
+    for i, classified_article in zip(candidates, classified):
+        if classified_article is None:
+            record_skipped("budget")
+        else:
+            categories[i] = classified_article
+
+    # Relevancia por oleadas (ver scheduler.decide_in_waves): no se comprueban más candidatos de los que caben
+    def check_wave(wave):
+        relevances = _check_pending_relevance([pending[i] for i in wave], [categories[i][0] for i in wave], run_config,
+                                              budget)
+        return [None if relevance is None else (categories[i][0], relevance[0], categories[i][1] and relevance[1])
+                for i, relevance in zip(wave, relevances)]
+
+    decisions = decide_in_waves([i for i in candidates if i in categories], lambda i: categories[i][0], check_wave,
+                                capacity, budget)
+    for i, decision in decisions.items():
+        results[i] = decision
+    return results
+
+
+def _iter_candidates(articles, run_config, stats, accepted_ids, duplicate_detector, seen_index):
+    """
+    Aplica a cada artículo los pasos que no llaman al LLM (reglas de Nivel 1, casi duplicados, índice de
+    vistos, clasificador local) y genera los candidatos para el planificador: (prioridad, (artículo,
+    decisión conocida o None si espera clasificación por IA, predicción local)).
+    """
+    prefs = run_config.preferences
+    global_prefs = run_config.global_prefs
+    categories_list = list(run_config.categories_order)
+    now = datetime.now(timezone.utc)
     for article in articles:
-        num_processed += 1
-        assigned_category = None # Initialize
-
-        if article.get('include_always', False):
-            assigned_category = article.get('default_category', defined_categories[0] if defined_categories else "General")
-            article['assigned_category'] = assigned_category
-            logger.info(f"Artículo '{article['title'][:50]}' incluido siempre en '{assigned_category}' por flag 'include_always'.")
+        stats["processed"] += 1
+
+        if article.id in accepted_ids:
+            logger.debug(f"Artículo '{article.title[:50]}' ya incluido hoy en una ejecución anterior.")
+            stats["already_accepted"] += 1
+            continue
+        if article.include_always:
+            assigned_category = _default_category_for(article, categories_list)
+            logger.info(f"Artículo '{article.title[:50]}' incluido siempre en '{assigned_category}' por flag 'include_always'.")
             # Bypasses filter_by_rules, IA classification, and IA relevance.
+            yield FREE_PRIORITY, (article, (assigned_category, True), None)
+            continue
+
+        if not filter_by_rules(article, global_prefs, prefs.get('sources', {}).get(article.source_name, {})):
+            logger.debug(f"Artículo '{article.title[:50]}' filtrado por reglas (Nivel 1).")
+            stats["filtered_rules"] += 1
+            continue
+
+        # Después de las reglas: un representativo descartado no arrastra a sus casi duplicados
+        if duplicate_detector is not None and duplicate_detector.add(article) is not None:
+            stats["duplicates"] += 1
+            continue
+
+        seen_decision = lookup_seen_article(seen_index, article.id)
+        if seen_decision is not None:
+            # Ya procesado en una ejecución anterior: reutilizar la decisión sin llamar al LLM
+            stats["reused"] += 1
+            logger.debug(f"Artículo '{article.title[:50]}' ya visto. Reutilizando decisión {seen_decision}.")
+            yield FREE_PRIORITY, (article, seen_decision, None)
         else:
-            # Original logic for articles without 'include_always'
-            if not filter_by_rules(article, global_prefs, prefs.get('sources', {}).get(article['source_name'], {})):
-                logger.debug(f"Artículo '{article['title'][:50]}' filtrado por reglas (Nivel 1).")
-                num_filtered_rules += 1
-                continue
+            prediction = _predict_locally(article, categories_list, run_config)
+            yield article_priority(article, prediction[1], now), (article, None, prediction)
 
-            default_cat_for_article = article.get('default_category',
-                                                  defined_categories[0] if defined_categories else "General")
-            assigned_category = classify_article_ia(article, defined_categories, default_cat_for_article)
-            article['assigned_category'] = assigned_category
 
-            if not check_relevance_ia(article, assigned_category):
-                logger.debug(
-                    f"Artículo '{article['title'][:50]}' (cat: {assigned_category}) filtrado por irrelevancia (IA).")
-                num_filtered_relevance += 1
-                continue
+class _ClassifiedArticles:
+    """Artículos aceptados por categoría, con el hueco que le queda a cada una (scheduler.CategoryCapacity)."""
 
-        # Common logic for adding to category (applies to both 'include_always' and regular articles)
-        # Ensure the assigned category exists in our main classified_articles dictionary
-        if assigned_category not in classified_articles:
-            if assigned_category in defined_categories: # It's a known category but perhaps empty so far
-                 classified_articles[assigned_category] = []
-            else: # It's a new category (e.g. from 'default_category' of an 'include_always' source not in preferences order)
-                logger.warning(
-                    f"Categoría '{assigned_category}' (de 'include_always' o default) no estaba en 'categories_order'. "
-                    f"Se añadirá al final de la salida. Artículo: {article['title'][:50]}"
-                )
-                classified_articles[assigned_category] = []
-                if assigned_category not in defined_categories: # Add to the order if truly new for iteration
-                    defined_categories.append(assigned_category) # This ensures it's iterated over if it was truly new
-
-        # Determine max articles for this category
-        category_specific_prefs = prefs.get('categories', {}).get(assigned_category, {})
-        max_articles_cat = category_specific_prefs.get('max_articles_per_category',
-                                                        global_prefs.get(
-                                                            'max_articles_per_category',
-                                                            config.MAX_ARTICLES_PER_CATEGORY_DEFAULT))
-
-        if len(classified_articles.get(assigned_category, [])) < max_articles_cat:
-            classified_articles.setdefault(assigned_category, []).append(article)
-        else:
-            logger.debug(f"Categoría '{assigned_category}' llena. Descartando: {article['title'][:50]}")
-
-    logger.info(f"Procesados: {num_processed} artículos.")
-    logger.info(f"Filtrados por reglas (Nivel 1): {num_filtered_rules}")
-    logger.info(f"Filtrados por irrelevancia (Nivel 2 IA): {num_filtered_relevance}")
-    for cat, arts in classified_articles.items():
-        if arts:
-            logger.info(f"Artículos finales en '{cat}': {len(arts)}")
+    def __init__(self, run_config):
+        # Orden de salida: el de categories_order, ampliado con categorías por defecto de fuentes 'include_always'
+        self.order = list(run_config.categories_order)
+        self.articles = {category: [] for category in self.order}
+        self.capacity = CategoryCapacity(run_config.max_articles_per_category)
 
-    # Return only categories that have articles and are in the defined_categories order
-    # (or were added to defined_categories if from 'include_always' and new)
-    final_ordered_classified_articles = {}
-    for cat_name in defined_categories: # Iterate in the preferred (or augmented) order
-        if cat_name in classified_articles and classified_articles[cat_name]:
-            final_ordered_classified_articles[cat_name] = classified_articles[cat_name]
+    def add(self, article, category):
+        if category not in self.articles:
+            logger.warning(
+                f"Categoría '{category}' (de 'include_always' o default) no estaba en 'categories_order'. "
+                f"Se añadirá al final de la salida. Artículo: {article.title[:50]}")
+            self.articles[category] = []
+            self.order.append(category)
+        if self.capacity.is_full(category):
+            logger.debug(f"Categoría '{category}' llena. Descartando: {article.title[:50]}")
+            return
+        self.articles[category].append(article)
+        self.capacity.take(category)
+
+    def result(self):
+        """Categorías con artículos, en el orden de salida."""
+        return {category: self.articles[category] for category in self.order if self.articles[category]}
+
+
+def _log_classification_stats(stats, accepted_count):
+    logger.info(f"Procesados: {stats['processed']} artículos.")
+    logger.info(f"Filtrados por reglas (Nivel 1): {stats['filtered_rules']}")
+    logger.info(f"Casi duplicados agrupados con otro artículo: {stats['duplicates']}")
+    logger.info(f"Filtrados por irrelevancia (Nivel 2 IA): {stats['filtered_relevance']}")
+    logger.info(f"Decisiones reutilizadas de ejecuciones anteriores: {stats['reused']}")
+    logger.info(f"Ya incluidos hoy en una ejecución anterior: {accepted_count} "
+                f"({stats['already_accepted']} recibidos de nuevo)")
+
+
+def classify_and_filter_articles(articles, run_config=None, accepted_articles=()):
+    """
+    Clasifica y filtra `articles`, que puede ser cualquier iterable (p. ej. el generador
+    collector.iter_articles): los artículos se procesan según llegan y solo se retienen los aceptados.
+    `run_config` es la instantánea de configuración de la ejecución (por defecto, la actual).
+    `accepted_articles` son los artículos ya aceptados en una ejecución anterior del mismo día (con su
+    assigned_category): se incluyen en el resultado, ocupan su hueco en la categoría y no se reprocesan.
+    """
+    run_config = run_config or get_run_config()
+    global_prefs = run_config.global_prefs
+    # Categorías ofrecidas al LLM: fijas, las de las plantillas precompiladas
+    llm_categories = list(run_config.categories_order)
+    logger.info(f"Categorías definidas para clasificación: {llm_categories}")
+    if not global_prefs.get("categories_order") and not run_config.preferences.get("categories"):
+        logger.warning("No se encontraron 'categories_order' o 'categories' en preferences.json. Usando 'General'.")
 
-    return final_ordered_classified_articles
+    stats = {"processed": 0, "filtered_rules": 0, "duplicates": 0, "filtered_relevance": 0, "reused": 0,
+             "already_accepted": 0}
+    seen_index = load_seen_index()
+    batch_size = max(1, int(global_prefs.get('classification_batch_size', 1)))
+    # "two_step": clasificación y relevancia en llamadas separadas; "fused": ambas en una sola llamada
+    classification_mode = global_prefs.get('classification_mode', 'two_step')
+    # Hueco restante por categoría y presupuesto de llamadas/tokens de esta ejecución (ver scheduler.py)
+    classified = _ClassifiedArticles(run_config)
+    budget = LLMBudget(global_prefs.get('max_llm_calls_per_run', 0), global_prefs.get('max_llm_tokens_per_run', 0))
+
+    # Lo aceptado hoy en una ejecución anterior se conserva: una re-ejecución solo recibe lo nuevo de cada feed
+    # Casi duplicados entre fuentes (ver dedup.py): solo se clasifica uno por grupo
+    duplicate_detector = get_duplicate_detector()
+    accepted_ids = set()
+    for article in accepted_articles:
+        accepted_ids.add(article.id)
+        if duplicate_detector is not None and not article.include_always:
+            duplicate_detector.register(article)
+        classified.add(article, article.assigned_category or _default_category_for(article, llm_categories))
+
+    def apply_decision(article, assigned_category, is_relevant):
+        article.assigned_category = assigned_category
+        if not is_relevant:
+            logger.debug(f"Artículo '{article.title[:50]}' (cat: {assigned_category}) filtrado por irrelevancia (IA).")
+            stats["filtered_relevance"] += 1
+            return
+        classified.add(article, assigned_category)
+
+    def process_candidates(batch):
+        # Las decisiones ya conocidas (prioridad máxima, al principio del lote) ocupan su hueco antes de
+        # calcular cuántos candidatos pendientes caben en cada categoría
+        pending = []
+        for article, decision, prediction in batch:
+            if decision is None:
+                pending.append((article, prediction))
+            else:
+                apply_decision(article, *decision)
+        if not pending:
+            return
+        ia_decisions = _decide_pending_articles([article for article, _ in pending], llm_categories,
+                                                classification_mode, batch_size, classified.capacity, budget,
+                                                [prediction for _, prediction in pending], run_config)
+        for (article, _), ia_decision in zip(pending, ia_decisions):
+            if ia_decision is None:  # No se llegó a decidir (categoría llena o presupuesto agotado)
+                continue
+            assigned_category, is_relevant, decided = ia_decision
+            # Solo se recuerdan decisiones reales del LLM, nunca los fallbacks por error
+            if decided:
+                record_seen_article(seen_index, article.id, assigned_category, is_relevant)
+            apply_decision(article, assigned_category, is_relevant)
+
+    # Candidatos por prioridad (ver scheduler.CandidateQueue.run). Cuando la ventana se llena, o han pasado
+    # scheduler_max_wait_seconds desde el último envío, se procesan los `flush_size` más prioritarios,
+    # suficientes para ocupar todas las llamadas simultáneas permitidas; el llenado de categorías sigue ese orden.
+    flush_size = batch_size * max(get_model_concurrency(get_model("classification")),
+                                  get_model_concurrency(get_model("relevance")))
+    window = max(flush_size, int(global_prefs.get('scheduler_window', 500)))
+    max_wait = float(global_prefs.get('scheduler_max_wait_seconds', 2))
+    CandidateQueue().run(_iter_candidates(articles, run_config, stats, accepted_ids, duplicate_detector, seen_index),
+                         process_candidates, flush_size, window, max_wait)
+
+    _log_classification_stats(stats, len(accepted_ids))
+    log_local_classifier_stats()
+    log_scheduler_stats(budget)
+    save_seen_index(seen_index)
+    result = classified.result()
+    for category, articles_in_category in result.items():
+        logger.info(f"Artículos finales en '{category}': {len(articles_in_category)}")
+    return result
 
 
 if __name__ == '__main__':
@@ -290,4 +660,4 @@ if __name__ == '__main__':
             if articles_in_category:
                 print(f"\nCategoría: {category}")
                 for art in articles_in_category:
-                    print(f"  - {art['title']}")
\ No newline at end of file
+                    print(f"  - {art.title}")
\ No newline at end of file
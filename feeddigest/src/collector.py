@@ -1,9 +1,19 @@
 import feedparser
+import gzip
+import hashlib
 import json
 import logging
+import time
+import urllib.error
+import urllib.request
+import zlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime, timedelta, timezone
-from bs4 import BeautifulSoup  # <--- AÑADIDO para parsear HTML
 from .. import config
+from .storage import load_json_state, save_json_state
+from .feed_recorder import save_recording, replay_recording
+from .models import Article, SourceConfig
+from .text_extraction import html_to_text
 
 logging.basicConfig(level=config.LOG_LEVEL)
 logger = logging.getLogger(__name__)
@@ -22,19 +32,139 @@ def load_sources():
         return []
 
 
-def fetch_articles_from_source(source_config):
-    """Recupera artículos de una única fuente RSS, filtrando por los publicados en las últimas 24 horas."""
+FEED_ACCEPT_HEADER = ("application/atom+xml,application/rdf+xml,application/rss+xml,"
+                      "application/xml;q=0.9,text/xml;q=0.2,*/*;q=0.1")
+
+
+# --- Estado de descarga por fuente (GET condicional) ---
+def load_fetch_state():
+    """Carga el estado por URL de feed: ETag, Last-Modified, hash del contenido y marca de agua."""
+    return load_json_state(config.FETCH_STATE_FILE, "Estado de descarga")
+
+
+def save_fetch_state(fetch_state):
+    """Guarda el estado olvidando los feeds no comprobados en FETCH_STATE_MAX_AGE_DAYS días (fuentes retiradas)."""
+    save_json_state(config.FETCH_STATE_FILE, fetch_state, 'checked_at', config.FETCH_STATE_MAX_AGE_DAYS,
+                    "Estado de descarga", indent=2)
+
+
+def download_feed(url, previous_state=None, timeout=None):
+    """
+    Descarga el feed con un GET condicional (If-None-Match / If-Modified-Since).
+    Devuelve un dict con 'status', 'body' (bytes, vacío en un 304) y 'headers' (claves en minúsculas).
+    """
+    previous_state = previous_state or {}
+    timeout = config.COLLECTOR_SOURCE_TIMEOUT if timeout is None else timeout
+    request = urllib.request.Request(url, headers={
+        "User-Agent": feedparser.USER_AGENT,
+        "Accept": FEED_ACCEPT_HEADER,
+        "Accept-Encoding": "gzip, deflate",
+    })
+    if previous_state.get('etag'):
+        request.add_header("If-None-Match", previous_state['etag'])
+    if previous_state.get('modified'):
+        request.add_header("If-Modified-Since", previous_state['modified'])
+
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            status = response.status
+            headers = {k.lower(): v for k, v in response.headers.items()}
+            body = response.read()
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return {"status": 304, "body": b"", "headers": {k.lower(): v for k, v in e.headers.items()}}
+        raise
+
+    encoding = headers.pop('content-encoding', '').lower()
+    if encoding == 'gzip':
+        body = gzip.decompress(body)
+    elif encoding == 'deflate':
+        try:
+            body = zlib.decompress(body)
+        except zlib.error:
+            body = zlib.decompress(body, -zlib.MAX_WBITS)  # deflate "crudo" sin cabecera zlib
+    return {"status": status, "body": body, "headers": headers}
+
+
+def fetch_feed(url, previous_state=None):
+    """Obtiene la respuesta del feed según config.FEED_MODE: "live", "record" o "replay" (sin red)."""
+    if config.FEED_MODE == "replay":
+        return replay_recording(url, previous_state)
+    if config.FEED_MODE == "record":
+        # Descarga incondicional: la grabación debe contener siempre el cuerpo completo
+        start_time = time.monotonic()
+        response = download_feed(url)
+        save_recording(url, response, elapsed_seconds=time.monotonic() - start_time)
+        return response
+    return download_feed(url, previous_state)
+
+
+def get_time_cutoff(source_state, now=None):
+    """
+    Calcula el corte temporal de una fuente a partir de su marca de agua (último published_date ingerido).
+    Devuelve (corte, es_marca_de_agua): con marca de agua solo se aceptan entradas estrictamente posteriores.
+    """
+    now = now or datetime.now(timezone.utc)
+    max_lookback_cutoff = now - timedelta(hours=config.COLLECTOR_MAX_LOOKBACK_HOURS)
+    watermark = None
+    if source_state.get('watermark'):
+        try:
+            watermark = datetime.fromisoformat(source_state['watermark'])
+        except (TypeError, ValueError):
+            logger.warning(f"Marca de agua no válida: {source_state['watermark']}. Se ignora.")
+    if watermark is None:
+        return now - timedelta(hours=config.COLLECTOR_INITIAL_LOOKBACK_HOURS), False
+    if watermark < max_lookback_cutoff:
+        return max_lookback_cutoff, False
+    return watermark, True
+
+
+def fetch_articles_from_source(source_config, previous_state=None):
+    """
+    Recupera artículos de una única fuente RSS publicados después de su marca de agua
+    (o en las últimas COLLECTOR_INITIAL_LOOKBACK_HOURS horas si no hay estado).
+    Si se pasa `previous_state` (el estado guardado de la fuente, {} si aún no tiene), la descarga es
+    condicional y los feeds sin cambios (304 o mismo contenido) no se vuelven a parsear.
+    Devuelve (artículos, nuevo_estado): el estado (ETag, hash y marca de agua) no se modifica aquí; lo
+    aplica el llamante solo si acepta los artículos. nuevo_estado es None si no hay nada que actualizar.
+    """
     articles = []
-    source_display_name = source_config.get('name', source_config['url'])
+    source = SourceConfig.from_dict(source_config)  # Compartido por todos los artículos de la fuente
+    source_url = source.url
+    source_display_name = source.display_name
     logger.info(f"Procesando fuente: {source_display_name}")
 
+    use_state = previous_state is not None
+    previous_state = previous_state or {}
     try:
-        feed = feedparser.parse(source_config['url'])
+        download = fetch_feed(source_url, previous_state)
+    except Exception as e:
+        logger.error(f"No se pudo descargar el feed de {source_display_name}: {e}")
+        return [], None
+
+    new_state = dict(previous_state)
+    new_state['checked_at'] = datetime.now(timezone.utc).isoformat()
+    new_state['etag'] = download['headers'].get('etag', previous_state.get('etag'))
+    new_state['modified'] = download['headers'].get('last-modified', previous_state.get('modified'))
+
+    if download['status'] == 304:
+        logger.info(f"Fuente '{source_display_name}' sin cambios (HTTP 304). Se omite el parseo.")
+        return [], new_state if use_state else None
+
+    content_hash = hashlib.sha256(download['body']).hexdigest()
+    if use_state and content_hash == previous_state.get('content_hash'):
+        logger.info(f"Fuente '{source_display_name}' sin cambios (mismo contenido). Se omite el parseo.")
+        return [], new_state
+
+    try:
+        feed = feedparser.parse(download['body'], response_headers=download['headers'])
     except Exception as e:
         logger.error(f"No se pudo parsear el feed de {source_display_name}: {e}")
-        return []
+        return [], None
 
-    time_cutoff = datetime.now(timezone.utc) - timedelta(hours=24)
+    now = datetime.now(timezone.utc)
+    time_cutoff, cutoff_is_watermark = get_time_cutoff(previous_state, now)
+    newest_ingested_dt = None
     articles_processed_count = 0
     articles_added_count = 0
 
@@ -43,6 +173,7 @@ def fetch_articles_from_source(source_config):
         published_dt = None
         published_date_iso = None
         title = entry.get('title', 'Sin título')  # Obtener título antes para logs
+        date_is_fallback = False  # True si se asume la fecha actual (no cuenta para la marca de agua)
 
         # --- TU LÓGICA DE GESTIÓN DE FECHAS (MANTENIDA) ---
         if hasattr(entry, 'published_parsed') and entry.published_parsed:
@@ -58,6 +189,7 @@ def fetch_articles_from_source(source_config):
                     f"No se pudo parsear la fecha 'published_parsed' para '{title}': {entry.get('published', 'Fecha no disponible')}. Error: {e}. Se usará la fecha actual.")
                 published_dt = datetime.now(timezone.utc)
                 published_date_iso = published_dt.isoformat()
+                date_is_fallback = True
         elif hasattr(entry, 'updated_parsed') and entry.updated_parsed:
             try:
                 dt_naive = datetime(*entry.updated_parsed[:6])
@@ -72,15 +204,17 @@ def fetch_articles_from_source(source_config):
                     f"No se pudo parsear 'updated_parsed' para '{title}'. Se usará fecha actual. Error: {e}")
                 published_dt = datetime.now(timezone.utc)
                 published_date_iso = published_dt.isoformat()
+                date_is_fallback = True
         else:
             logger.warning(
                 f"Artículo '{title}' no tiene fecha de publicación/actualización. Asumiendo fecha actual.")
             published_dt = datetime.now(timezone.utc)
             published_date_iso = published_dt.isoformat()
+            date_is_fallback = True
 
         # --- TU FILTRADO POR FECHA (MANTENIDO) ---
-        if published_dt < time_cutoff:
-            logger.debug(f"Artículo DESCARTADO (muy antiguo: {published_date_iso}): {title}")
+        if published_dt < time_cutoff or (cutoff_is_watermark and published_dt <= time_cutoff):
+            logger.debug(f"Artículo DESCARTADO (muy antiguo o ya ingerido: {published_date_iso}): {title}")
             continue
 
         # --- EXTRACCIÓN Y LIMPIEZA DE CONTENIDO (FUSIONADO Y MEJORADO) ---
@@ -108,10 +242,9 @@ def fetch_articles_from_source(source_config):
         elif not content_html and 'description' in entry:
             content_html = entry.description
 
-        # Usar BeautifulSoup para obtener texto plano del content_html resultante
+        # Obtener texto plano del content_html resultante (ver text_extraction.py)
         if content_html:  # Solo si tenemos algo de HTML para parsear
-            soup = BeautifulSoup(content_html, 'html.parser')
-            text_content = soup.get_text(separator=' ', strip=True)
+            text_content = html_to_text(content_html)
         else:
             text_content = ""  # Si no hay HTML, no hay texto
             logger.debug(
@@ -125,41 +258,152 @@ def fetch_articles_from_source(source_config):
 
         # --- CONSTRUCCIÓN DEL ARTÍCULO (MANTENIENDO TU ID) ---
         articles_added_count += 1  # Mover aquí, solo se incrementa si el artículo realmente se añade
+        if not date_is_fallback and (newest_ingested_dt is None or published_dt > newest_ingested_dt):
+            newest_ingested_dt = published_dt
 
-        articles.append({
-            "id": link,  # Usar link como ID primario es generalmente más robusto
-            "title": title,
-            "link": link,
-            "published_date": published_date_iso,
-            "content_raw": content_html,  # Guardar el HTML original por si acaso
-            "content_text": text_content,  # El texto limpio
-            "source_name": source_config.get('name'),
-            "default_category": source_config.get('default_category', 'General'),
-            "source_keywords": source_config.get('keywords', []),
-            "source_blacklist": source_config.get('blacklist', []),
-            "include_always": source_config.get('include_always', False)
-        })
+        articles.append(Article(
+            id=link,  # Usar link como ID primario es generalmente más robusto
+            title=title,
+            link=link,
+            published_date=published_date_iso,
+            content_text=text_content,  # El texto limpio
+            source=source,
+            content_raw=content_html if config.KEEP_RAW_HTML else None,  # HTML original solo si se pide
+        ))
 
     logger.info(
         f"Fuente '{source_display_name}': {articles_processed_count} artículos encontrados en el feed, {articles_added_count} añadidos (post-filtro de fecha y contenido).")
-    return articles
 
+    # El nuevo estado solo se calcula tras procesar el feed completo
+    if not use_state:
+        return articles, None
+    new_state['content_hash'] = content_hash
+    if newest_ingested_dt is not None:
+        # Fechas futuras (relojes mal configurados) no deben bloquear las siguientes ejecuciones
+        new_watermark = min(newest_ingested_dt, now)
+        if not cutoff_is_watermark or new_watermark > time_cutoff:
+            new_state['watermark'] = new_watermark.isoformat()
+    return articles, new_state
 
-def collect_all_articles():
-    """Recolecta artículos de todas las fuentes configuradas."""
-    sources = load_sources()
-    all_articles = []
-    # total_articles_from_feeds = 0 # No se usa esta variable, se puede quitar
 
+def _source_url(source_config):
+    return source_config.get('url', '')
+
+
+def _fetch_source_safely(source_config, previous_state):
+    """Envuelve fetch_articles_from_source para que un fallo en una fuente no afecte al resto."""
+    try:
+        return fetch_articles_from_source(source_config, previous_state)
+    except Exception as e:
+        logger.error(f"Error grave procesando la fuente {source_config.get('name', source_config['url'])}: {e}")
+        return [], None
+
+
+def _previous_state(fetch_state, source_config):
+    """Copia del estado guardado de la fuente ({} si no tiene), o None si no se usa estado."""
+    return dict(fetch_state.get(_source_url(source_config), {})) if fetch_state is not None else None
+
+
+def _iter_sources_sequential(sources, fetch_state):
     for source_config in sources:
-        try:
-            articles_from_source = fetch_articles_from_source(source_config)
-            all_articles.extend(articles_from_source)
-        except Exception as e:
-            logger.error(f"Error grave procesando la fuente {source_config.get('name', source_config['url'])}: {e}")
+        yield (source_config, *_fetch_source_safely(source_config, _previous_state(fetch_state, source_config)))
+
+
+def _iter_sources_concurrent(sources, fetch_state, max_workers, source_timeout):
+    """
+    Descarga las fuentes con un pool de hilos acotado y devuelve (source_config, artículos, nuevo_estado)
+    en el orden de `sources`. Los hilos no tocan `fetch_state`: reciben una copia del estado previo de su fuente.
+    Cada fuente dispone de `source_timeout` segundos de reloj desde que empieza a procesarse;
+    si se superan, se descarta (el hilo no se puede interrumpir, pero su resultado, estado incluido, se ignora).
+    """
+    started_at = {}
+    results = {}
+
+    def run(index, source_config, previous_state):
+        started_at[index] = time.monotonic()
+        return _fetch_source_safely(source_config, previous_state)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="feed-fetch")
+    futures = {executor.submit(run, i, source_config, _previous_state(fetch_state, source_config)): i
+               for i, source_config in enumerate(sources)}
+    pending = set(futures)
+    next_to_yield = 0
+    try:
+        while next_to_yield < len(sources):
+            # Entregar en orden todo lo que ya esté resuelto
+            while next_to_yield in results:
+                yield (sources[next_to_yield], *results.pop(next_to_yield))
+                next_to_yield += 1
+            if next_to_yield >= len(sources):
+                break
 
-    logger.info(f"Total de artículos recolectados (post-filtros) de todas las fuentes: {len(all_articles)}")
-    return all_articles
+            now = time.monotonic()
+            deadlines = [started_at[futures[f]] + source_timeout for f in pending if futures[f] in started_at]
+            wait_timeout = max(0.0, min(deadlines) - now) if deadlines else source_timeout
+            done, pending = wait(pending, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[futures[future]] = future.result()
+
+            now = time.monotonic()
+            for future in list(pending):
+                index = futures[future]
+                if index in started_at and now - started_at[index] >= source_timeout:
+                    source_config = sources[index]
+                    logger.error(
+                        f"Tiempo agotado ({source_timeout}s) procesando la fuente "
+                        f"{source_config.get('name', source_config['url'])}. Se descarta.")
+                    future.cancel()
+                    pending.discard(future)
+                    results[index] = ([], None)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_source_articles(sources=None, max_workers=None, source_timeout=None, fetch_state=None):
+    """
+    Genera tuplas (source_config, artículos) en el mismo orden que `sources`.
+    Con max_workers > 1 las fuentes se descargan en paralelo, pero la salida es idéntica a la secuencial.
+    Con `fetch_state` (ver load_fetch_state), las descargas son condicionales y el estado nuevo de cada
+    fuente se aplica en el sitio cuando se entregan sus artículos (no tras un tiempo agotado). No se guarda
+    aquí: el llamante lo guarda (save_fetch_state) cuando los artículos ya están a salvo en el historial,
+    para que un fallo posterior no haga avanzar las marcas de agua sobre artículos que no se publicaron.
+    """
+    if sources is None:
+        sources = load_sources()
+    max_workers = config.COLLECTOR_MAX_WORKERS if max_workers is None else max_workers
+    source_timeout = config.COLLECTOR_SOURCE_TIMEOUT if source_timeout is None else source_timeout
+
+    if max_workers <= 1 or len(sources) <= 1:
+        results = _iter_sources_sequential(sources, fetch_state)
+    else:
+        results = _iter_sources_concurrent(sources, fetch_state, min(max_workers, len(sources)), source_timeout)
+    for source_config, articles, new_state in results:
+        if fetch_state is not None and new_state is not None:
+            fetch_state[_source_url(source_config)] = new_state
+        yield source_config, articles
+
+
+def iter_articles(sources=None, fetch_state=None):
+    """
+    Genera los artículos de todas las fuentes a medida que cada feed termina de descargarse
+    (respetando el orden de las fuentes), para que las fases siguientes puedan empezar a
+    procesarlos mientras el resto de feeds sigue descargándose. `fetch_state`: ver iter_source_articles.
+    """
+    total_articles = 0
+    start_time = time.monotonic()
+
+    for _, articles_from_source in iter_source_articles(sources, fetch_state=fetch_state):
+        total_articles += len(articles_from_source)
+        yield from articles_from_source
+
+    logger.info(
+        f"Total de artículos recolectados (post-filtros) de todas las fuentes: {total_articles} "
+        f"en {time.monotonic() - start_time:.1f}s")
+
+
+def collect_all_articles(sources=None):
+    """Recolecta artículos de todas las fuentes configuradas."""
+    return list(iter_articles(sources))
 
 
 if __name__ == '__main__':
@@ -169,11 +413,11 @@ if __name__ == '__main__':
         print(f"\nTotal de artículos recolectados para prueba: {len(collected_articles)}")
         print(f"Ejemplo de artículo recolectado (de las últimas 24 horas y con contenido):")
         article_example = collected_articles[0]
-        print(f"  ID: {article_example['id']}")
-        print(f"  Título: {article_example['title']}")
-        print(f"  Link: {article_example['link']}")
-        print(f"  Fuente: {article_example['source_name']}")
-        print(f"  Fecha Publicación: {article_example['published_date']}")
-        print(f"  Texto (primeros 150 chars): {article_example['content_text'][:150]}...")
+        print(f"  ID: {article_example.id}")
+        print(f"  Título: {article_example.title}")
+        print(f"  Link: {article_example.link}")
+        print(f"  Fuente: {article_example.source_name}")
+        print(f"  Fecha Publicación: {article_example.published_date}")
+        print(f"  Texto (primeros 150 chars): {article_example.content_text[:150]}...")
     else:
         print("No se recolectaron artículos que cumplan los criterios (últimas 24 horas, con link y contenido).")
\ No newline at end of file
@@ -0,0 +1,112 @@
+import logging
+import re
+import zlib
+import numpy as np
+from .. import config
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+# Detección de noticias casi duplicadas entre fuentes (MinHash + LSH por bandas).
+# Cada artículo se resume en una firma MinHash de NUM_PERMUTATIONS valores sobre sus shingles de palabras;
+# la firma se divide en LSH_BANDS bandas y solo se comparan artículos que coinciden en alguna banda,
+# así el coste es lineal en el número de artículos (sin comparaciones por pares).
+# La detección se hace en classify_and_filter_articles después del filtrado por reglas (Nivel 1): si se
+# hiciera antes, un representativo descartado por las reglas se llevaría consigo a sus casi duplicados.
+
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16  # 16 bandas x 4 filas: umbral de candidatos en torno a Jaccard ~0.5
+SHINGLE_SIZE = 3  # Shingles de 3 palabras
+MAX_CHARS_FOR_SIGNATURE = 2000  # El arranque del texto basta para reconocer la misma noticia
+
+_MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+_rng = np.random.default_rng(20250515)  # Semilla fija: firmas reproducibles entre ejecuciones
+_PERM_A = _rng.integers(1, int(_MERSENNE_PRIME), size=NUM_PERMUTATIONS, dtype=np.uint64)
+_PERM_B = _rng.integers(0, int(_MERSENNE_PRIME), size=NUM_PERMUTATIONS, dtype=np.uint64)
+_WORD_RE = re.compile(r"\w+")
+
+
+def _shingle_hashes(text):
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        shingles = [" ".join(words)] if words else []
+    else:
+        shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    return np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64)
+
+
+def minhash_signature(text):
+    """Firma MinHash (array de NUM_PERMUTATIONS uint64) de `text`, o None si no hay palabras."""
+    hashes = _shingle_hashes(text) % _MERSENNE_PRIME
+    if hashes.size == 0:
+        return None
+    # (a * x + b) mod p para todas las permutaciones a la vez: matriz permutaciones x shingles
+    permuted = (np.outer(_PERM_A, hashes) + _PERM_B[:, None]) % _MERSENNE_PRIME
+    return permuted.min(axis=1)
+
+
+def _article_text(article):
+    return f"{article.title} {article.content_text[:MAX_CHARS_FOR_SIGNATURE]}"
+
+
+class NearDuplicateDetector:
+    """
+    Detector incremental: cada artículo nuevo se compara solo con los que comparten alguna banda LSH.
+    Si se parece lo bastante a un representativo ya visto, se adjunta a él como referencia adicional.
+    """
+
+    def __init__(self, threshold=None):
+        self.threshold = config.DEDUP_THRESHOLD if threshold is None else threshold
+        self._rows_per_band = NUM_PERMUTATIONS // LSH_BANDS
+        self._buckets = {}  # (banda, valores de la banda) -> índices de representativos
+        self._representatives = []  # [(artículo, firma)]
+        self.num_duplicates = 0
+
+    def _band_keys(self, signature):
+        rows = self._rows_per_band
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(LSH_BANDS)]
+
+    def add(self, article):
+        """Registra `article`. Devuelve su representativo si es un casi duplicado, o None si es nuevo."""
+        signature = minhash_signature(_article_text(article))
+        if signature is None:
+            return None
+        band_keys = self._band_keys(signature)
+
+        candidates = set()
+        for key in band_keys:
+            candidates.update(self._buckets.get(key, ()))
+        best_index, best_similarity = None, 0.0
+        for index in sorted(candidates):
+            similarity = float(np.mean(self._representatives[index][1] == signature))
+            if similarity > best_similarity:
+                best_index, best_similarity = index, similarity
+
+        if best_index is not None and best_similarity >= self.threshold:
+            representative = self._representatives[best_index][0]
+            representative.duplicates.append(article)
+            self.num_duplicates += 1
+            logger.info(
+                f"Casi duplicado ({best_similarity:.2f}): '{article.title[:50]}' ({article.source_name}) "
+                f"agrupado con '{representative.title[:50]}' ({representative.source_name}).")
+            return representative
+
+        self._register(article, signature, band_keys)
+        return None
+
+    def register(self, article):
+        """Registra `article` como representativo sin compararlo (p. ej. los ya aceptados en otra ejecución)."""
+        signature = minhash_signature(_article_text(article))
+        if signature is not None:
+            self._register(article, signature, self._band_keys(signature))
+
+    def _register(self, article, signature, band_keys):
+        index = len(self._representatives)
+        self._representatives.append((article, signature))
+        for key in band_keys:
+            self._buckets.setdefault(key, []).append(index)
+
+
+def get_duplicate_detector(threshold=None):
+    """Detector de casi duplicados para una ejecución, o None si config.DEDUP_ENABLED está desactivado."""
+    return NearDuplicateDetector(threshold) if config.DEDUP_ENABLED else None
@@ -0,0 +1,100 @@
+import argparse
+import hashlib
+import json
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from pathlib import Path
+from xml.sax.saxutils import escape
+from .. import config
+from .feed_recorder import save_recording
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+# Genera feeds RSS sintéticos a partir de data/history y los guarda como grabaciones (feed_recorder),
+# para ejecutar el colector en modo replay con 10, 100 o 1000 fuentes sin acceso a la red.
+
+FIXTURE_URL_TEMPLATE = "https://fixtures.feeddigest.invalid/{index}/feed.xml"
+MAX_ITEMS_PER_FEED = 30
+
+
+def _load_history_by_source():
+    by_source = defaultdict(list)
+    for history_file in sorted(config.HISTORY_DIR.glob("*.json")):
+        with open(history_file, 'r', encoding='utf-8') as f:
+            for article in json.load(f):
+                by_source[article.get('source_name') or 'Desconocida'].append(article)
+    return dict(sorted(by_source.items()))
+
+
+def _build_rss(channel_title, articles, now):
+    items = []
+    for position, article in enumerate(articles):
+        # Fechas reescritas hacia el presente para que pasen el corte temporal del colector
+        published = now - timedelta(minutes=5 * (position + 1))
+        content = article.get('content_raw') or article.get('content_text', '')
+        items.append(
+            "<item>"
+            f"<title>{escape(article.get('title', ''))}</title>"
+            f"<link>{escape(article.get('link', ''))}</link>"
+            f"<guid>{escape(article.get('id') or article.get('link', ''))}</guid>"
+            f"<pubDate>{format_datetime(published)}</pubDate>"
+            f"<description>{escape(content)}</description>"
+            "</item>")
+    return ('<?xml version="1.0" encoding="utf-8"?>\n<rss version="2.0"><channel>'
+            f"<title>{escape(channel_title)}</title>{''.join(items)}</channel></rss>").encode('utf-8')
+
+
+def _fixture_latency(url):
+    """Latencia simulada determinista entre 50 y 500 ms, derivada de la URL."""
+    return 0.05 + (int(hashlib.sha256(url.encode('utf-8')).hexdigest()[:8], 16) % 451) / 1000
+
+
+def build_fixture_sources(num_sources, directory, now=None):
+    """
+    Genera `num_sources` feeds sintéticos en `directory` reciclando los artículos de cada fuente del historial.
+    Devuelve la lista de fuentes (formato de sources.json) que apuntan a esas grabaciones.
+    """
+    now = now or datetime.now(timezone.utc)
+    history_by_source = _load_history_by_source()
+    if not history_by_source:
+        raise RuntimeError(f"No hay artículos en {config.HISTORY_DIR} para generar fixtures.")
+    template_sources = list(history_by_source.items())
+
+    sources = []
+    for index in range(num_sources):
+        source_name, articles = template_sources[index % len(template_sources)]
+        # Cada réplica toma una ventana distinta de artículos y enlaces únicos, para no generar feeds idénticos
+        offset = (index // len(template_sources)) * MAX_ITEMS_PER_FEED
+        window = [articles[(offset + i) % len(articles)] for i in range(min(MAX_ITEMS_PER_FEED, len(articles)))]
+        window = [{**a, "link": f"{a.get('link', '')}#fixture-{index}", "id": None} for a in window]
+
+        url = FIXTURE_URL_TEMPLATE.format(index=index)
+        body = _build_rss(f"{source_name} (fixture {index})", window, now)
+        response = {"status": 200, "body": body,
+                    "headers": {"content-type": "application/rss+xml; charset=utf-8",
+                                "etag": f'"{hashlib.sha256(body).hexdigest()[:16]}"'}}
+        save_recording(url, response, elapsed_seconds=_fixture_latency(url), directory=directory)
+        sources.append({
+            "url": url,
+            "name": f"{source_name} #{index}",
+            "default_category": window[0].get('default_category', 'General') if window else 'General',
+            "keywords": [],
+            "blacklist": [],
+        })
+    return sources
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Genera feeds sintéticos grabados a partir de data/history")
+    parser.add_argument("--sources", type=int, default=100, help="Número de fuentes a generar")
+    parser.add_argument("--output", type=Path, default=config.FEED_RECORDINGS_DIR, help="Directorio de grabaciones")
+    args = parser.parse_args()
+    generated_sources = build_fixture_sources(args.sources, args.output)
+    sources_path = Path(args.output) / "sources.json"
+    with open(sources_path, 'w', encoding='utf-8') as f:
+        json.dump({"sources": generated_sources}, f, indent=2, ensure_ascii=False)
+    print(f"{len(generated_sources)} fuentes sintéticas grabadas en {args.output} (lista en {sources_path})")
+    print(f"Para usarlas: FEED_MODE=replay FEED_RECORDINGS_DIR={args.output} FEEDDIGEST_SOURCES_FILE={sources_path}")
@@ -0,0 +1,63 @@
+import hashlib
+import json
+import logging
+import time
+from pathlib import Path
+from .. import config
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+# Grabación y reproducción de respuestas HTTP de feeds.
+# Cada URL se guarda como dos archivos en config.FEED_RECORDINGS_DIR:
+#   <clave>.body  -> bytes exactos del feed (ya descomprimidos)
+#   <clave>.json  -> {"url", "status", "headers", "elapsed_seconds", "recorded_at"}
+
+
+def recording_key(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()[:24]
+
+
+def _recording_paths(url, directory=None):
+    directory = Path(directory or config.FEED_RECORDINGS_DIR)
+    key = recording_key(url)
+    return directory / f"{key}.body", directory / f"{key}.json"
+
+
+def save_recording(url, response, elapsed_seconds=0.0, directory=None):
+    """Guarda la respuesta de `download_feed` (dict con status, body y headers) para poder reproducirla."""
+    body_path, meta_path = _recording_paths(url, directory)
+    body_path.parent.mkdir(parents=True, exist_ok=True)
+    body_path.write_bytes(response['body'])
+    meta = {
+        "url": url,
+        "status": response['status'],
+        "headers": response['headers'],
+        "elapsed_seconds": round(elapsed_seconds, 4),
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2, ensure_ascii=False)
+
+
+def replay_recording(url, previous_state=None, directory=None, simulate_latency=None):
+    """
+    Devuelve la respuesta grabada para `url` con el mismo formato que `download_feed`.
+    Emula el GET condicional: si el ETag/Last-Modified grabado coincide con `previous_state`, responde 304.
+    """
+    body_path, meta_path = _recording_paths(url, directory)
+    if not meta_path.exists():
+        raise FileNotFoundError(f"No hay grabación para {url} en {meta_path.parent}")
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+
+    simulate_latency = config.FEED_REPLAY_LATENCY if simulate_latency is None else simulate_latency
+    if simulate_latency and meta.get('elapsed_seconds'):
+        time.sleep(meta['elapsed_seconds'])
+
+    headers = dict(meta.get('headers', {}))
+    previous_state = previous_state or {}
+    etag, modified = headers.get('etag'), headers.get('last-modified')
+    if (etag and etag == previous_state.get('etag')) or (modified and modified == previous_state.get('modified')):
+        return {"status": 304, "body": b"", "headers": headers}
+    return {"status": meta.get('status', 200), "body": body_path.read_bytes(), "headers": headers}
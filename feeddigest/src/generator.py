@@ -1,13 +1,14 @@
-from jinja2 import Environment, FileSystemLoader, select_autoescape
 import logging
 # from markupsafe import Markup # No longer needed here for the filter
-import markdown  # <-- IMPORT MARKDOWN LIBRARY
 from datetime import datetime
 import os
-import json
 import re
+import tempfile
+import threading
+import time
 from pathlib import Path  # <-- IMPORT PATH
 from .. import config
+from .run_config import get_run_config
 
 logging.basicConfig(level=config.LOG_LEVEL)
 logger = logging.getLogger(__name__)
@@ -29,7 +30,12 @@ def convert_placeholders_to_html_links(text_with_placeholders, articles_details)
                 article_detail = articles_map[ref_id]
                 link_title = f"Fuente {ref_id}: {article_detail['title']}"
                 # Return the HTML string for the link directly
-                return f'<a href="{article_detail["url"]}" target="_blank" title="{link_title}" class="inline-ref-arrow-only"><span class="ref-icon">↗</span></a>'
+                html_link = f'<a href="{article_detail["url"]}" target="_blank" title="{link_title}" class="inline-ref-arrow-only"><span class="ref-icon">↗</span></a>'
+                # One extra arrow per source that published the same story (near-duplicates)
+                for other in article_detail.get('also_reported_by', []):
+                    other_title = f"También en {other.get('source_name') or 'otra fuente'}: {other['title']}"
+                    html_link += f'<a href="{other["url"]}" target="_blank" title="{other_title}" class="inline-ref-arrow-only"><span class="ref-icon">↗</span></a>'
+                return html_link
             else:
                 return match.group(0)  # Keep placeholder if ID not found
         except (ValueError, KeyError) as e:
@@ -40,60 +46,77 @@ def convert_placeholders_to_html_links(text_with_placeholders, articles_details)
     return processed_text
 
 
-def get_jinja_env():
-    env = Environment(
-        loader=FileSystemLoader(config.TEMPLATES_DIR),
-        autoescape=select_autoescape(['html', 'xml'])
-    )
-    # env.filters['replace_refs'] = replace_refs_with_links # Filter is no longer needed
-    return env
+# One Jinja environment per process: templates are compiled once and kept in the environment's cache, and
+# the compiled bytecode is also stored in config.JINJA_CACHE_DIR so new processes skip parsing base.html.
+# Outside dev mode (config.DEV_MODE) templates are not checked for changes on disk.
+_jinja_env = None
+_jinja_env_lock = threading.Lock()
 
 
-def generate_daily_newsletter(synthesized_content, date_str):
+# jinja2 and markdown are imported on first use: importing this module stays cheap
+def get_jinja_env():
+    global _jinja_env
+    if _jinja_env is not None:
+        return _jinja_env
+    with _jinja_env_lock:
+        if _jinja_env is None:
+            from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, select_autoescape
+            bytecode_cache = None
+            try:
+                Path(config.JINJA_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+                bytecode_cache = FileSystemBytecodeCache(str(config.JINJA_CACHE_DIR))
+            except OSError as e:
+                logger.warning(f"No se pudo usar la caché de plantillas en {config.JINJA_CACHE_DIR}: {e}")
+            _jinja_env = Environment(
+                loader=FileSystemLoader(config.TEMPLATES_DIR),
+                autoescape=select_autoescape(['html', 'xml']),
+                bytecode_cache=bytecode_cache,
+                auto_reload=config.DEV_MODE,
+                cache_size=-1  # Never evict compiled templates
+            )
+            # env.filters['replace_refs'] = replace_refs_with_links # Filter is no longer needed
+    return _jinja_env
+
+
+def markdown_to_html(text):
+    # 'extra' includes tables, fenced_code, footnotes, etc.
+    # 'sane_lists' helps with list parsing.
+    # 'nl2br' converts newlines to <br>, useful if source text uses single newlines for breaks
+    import markdown
+    return markdown.markdown(text, extensions=['extra', 'sane_lists', 'nl2br'])
+
+
+def _process_daily_items(items):
+    processed_items_for_category = []
+    for item_data in items:
+        # 1. Get the raw text (assumed to be Markdown + [1] placeholders)
+        markdown_text_with_placeholders = item_data.get('text_with_placeholders', '')
+        original_articles = item_data.get('original_articles_details', [])
+
+        # 2. Convert [1] placeholders to embedded HTML links
+        text_with_embedded_html_links = convert_placeholders_to_html_links(
+            markdown_text_with_placeholders,
+            original_articles
+        )
+
+        # 3. Convert the full Markdown (with embedded HTML links) to final HTML
+        final_html_content = markdown_to_html(text_with_embedded_html_links)
+
+        # Create a new item dictionary or update item_data
+        # It's safer to create a new one to avoid modifying the original dict if it's used elsewhere
+        processed_item = item_data.copy()  # Start with a copy
+        processed_item['content_html'] = final_html_content
+        # Remove old keys if they are no longer directly used by the template for this content
+        # processed_item.pop('text_with_placeholders', None)
+        # processed_item.pop('original_articles_details', None) # Or keep if needed for other things
+        processed_items_for_category.append(processed_item)
+    return processed_items_for_category
+
+
+def _render_daily_page(ordered_content_for_template, date_str, pending_categories=()):
     env = get_jinja_env()
     template = env.get_template("daily.html")
 
-    prefs = {}
-    try:
-        with open(config.PREFERENCES_FILE, 'r', encoding='utf-8') as f:
-            prefs = json.load(f)
-    except Exception:
-        logger.warning("No se pudo cargar preferences.json para el generador (orden).")
-
-    categories_order = prefs.get("global", {}).get("categories_order", list(synthesized_content.keys()))
-
-    ordered_content_for_template = {}
-    for cat_name in categories_order:
-        if cat_name in synthesized_content and synthesized_content[cat_name]:
-            processed_items_for_category = []
-            for item_data in synthesized_content[cat_name]:
-                # 1. Get the raw text (assumed to be Markdown + [1] placeholders)
-                markdown_text_with_placeholders = item_data.get('text_with_placeholders', '')
-                original_articles = item_data.get('original_articles_details', [])
-
-                # 2. Convert [1] placeholders to embedded HTML links
-                text_with_embedded_html_links = convert_placeholders_to_html_links(
-                    markdown_text_with_placeholders,
-                    original_articles
-                )
-
-                # 3. Convert the full Markdown (with embedded HTML links) to final HTML
-                # 'extra' includes tables, fenced_code, footnotes, etc.
-                # 'sane_lists' helps with list parsing.
-                final_html_content = markdown.markdown(text_with_embedded_html_links,
-                                                       extensions=['extra', 'sane_lists', 'nl2br'])
-
-                # Create a new item dictionary or update item_data
-                # It's safer to create a new one to avoid modifying the original dict if it's used elsewhere
-                processed_item = item_data.copy()  # Start with a copy
-                processed_item['content_html'] = final_html_content
-                # Remove old keys if they are no longer directly used by the template for this content
-                # processed_item.pop('text_with_placeholders', None)
-                # processed_item.pop('original_articles_details', None) # Or keep if needed for other things
-                processed_items_for_category.append(processed_item)
-
-            ordered_content_for_template[cat_name] = processed_items_for_category
-
     nav_links = {
         "today_file": f"{date_str}.html",  # This should ideally be just the filename, path handled by root
         "yesterday_file": "yesterday.html",  # Placeholder, logic needed
@@ -102,31 +125,162 @@ def generate_daily_newsletter(synthesized_content, date_str):
     }
     current_datetime_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S UTC")
 
-    html_output = template.render(
+    return template.render(
         title=f"FeedDigest - {date_str}",
         date_published=date_str,
         categories=ordered_content_for_template,  # Pass the content with 'content_html'
+        pending_categories=set(pending_categories),  # Still being synthesized (progressive rendering)
         nav_links=nav_links,
         current_year=datetime.now().year,
         generated_at_datetime=current_datetime_str
     )
 
+
+def _write_html(path, html_output):
+    # Write to a temp file and rename it, so a reader (or a re-render in progress) never sees a half-written page
+    fd, tmp_path = tempfile.mkstemp(dir=Path(path).parent, prefix=f".{Path(path).name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(html_output)
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+def _publish_daily_page(html_output, date_str):
     daily_filename = f"{date_str}.html"
     output_path = config.ARCHIVE_DIR / daily_filename  # Store in archive
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(html_output)
-    logger.info(f"Newsletter diaria generada: {output_path}")
-
+    _write_html(output_path, html_output)
     # Update index.html in the root output directory to be the latest daily
-    index_path = config.OUTPUT_DIR / "index.html"
-    with open(index_path, 'w', encoding='utf-8') as f:
-        f.write(html_output)
+    _write_html(config.OUTPUT_DIR / "index.html", html_output)
+    return output_path
+
+
+def _ordered_categories(run_config, categories):
+    """
+    `categories` in the categories_order of the preferences, followed by any category missing from it
+    (e.g. the default category of an 'include_always' source) in its original order.
+    """
+    categories = list(categories)
+    ordered = [cat_name for cat_name in run_config.global_prefs.get("categories_order", []) if cat_name in categories]
+    return ordered + [cat_name for cat_name in categories if cat_name not in ordered]
+
+
+def generate_daily_newsletter(synthesized_content, date_str, run_config=None):
+    config.ensure_directories()
+
+    run_config = run_config or get_run_config()
+
+    ordered_content_for_template = {}
+    for cat_name in _ordered_categories(run_config, synthesized_content.keys()):
+        if cat_name in synthesized_content and synthesized_content[cat_name]:
+            ordered_content_for_template[cat_name] = _process_daily_items(synthesized_content[cat_name])
+
+    html_output = _render_daily_page(ordered_content_for_template, date_str)
+    output_path = _publish_daily_page(html_output, date_str)
+    logger.info(f"Newsletter diaria generada: {output_path}")
     logger.info(f"index.html actualizado para apuntar a la edición de: {date_str}")
 
     return output_path
 
 
+class ProgressiveNewsletter:
+    """
+    Publishes the daily page while synthesis is still running, so readers (and whoever watches the run) get
+    content as soon as the first category is ready instead of after the slowest one.
+    Completed categories are rendered to HTML once; categories still streaming show their partial text or a
+    placeholder, and the page refreshes itself until nothing is pending. Re-renders triggered by streamed chunks
+    are throttled to one every `render_interval` seconds. Callbacks may come from several synthesis threads.
+    Partial pages go to config.LIVE_PAGE_FILE only: index.html and the archive are left untouched until
+    generate_daily_newsletter() writes the final page, so a run that dies mid-synthesis cannot leave the site
+    on a half-built edition. Use it as a context manager (or call close()) so the live page stops refreshing
+    even if synthesis fails.
+    """
+
+    def __init__(self, date_str, categories, run_config=None, render_interval=None):
+        self.date_str = date_str
+        self.run_config = run_config or get_run_config()
+        self.render_interval = (config.SYNTHESIS_STREAM_RENDER_INTERVAL if render_interval is None
+                                else render_interval)
+        self._categories = list(categories)
+        self._pending = set(self._categories)
+        self._rendered = {}  # category -> processed items (final, or partial while it is streaming)
+        self._lock = threading.Lock()
+        self._started_at = time.monotonic()
+        self._last_publish = 0.0
+        self.first_content_seconds = None  # Time from start() to the first published content
+
+    def start(self):
+        """Publishes the page skeleton (every category pending)."""
+        config.ensure_directories()
+        with self._lock:
+            self._started_at = time.monotonic()
+            self._publish()
+
+    def close(self):
+        """
+        Publishes the live page one last time without the refresh. Categories that never finished are dropped,
+        since their partial text is incomplete.
+        """
+        with self._lock:
+            for cat_name in self._pending:
+                self._rendered.pop(cat_name, None)
+            self._pending.clear()
+            self._publish()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def category_progress(self, category_name, partial_items):
+        """Streamed partial synthesis of a category. Ignored once the category is ready."""
+        with self._lock:
+            if category_name not in self._pending:
+                return
+            if time.monotonic() - self._last_publish < self.render_interval:
+                return
+            self._rendered[category_name] = self._process(category_name, partial_items)
+            self._publish()
+
+    def category_ready(self, category_name, items):
+        """Final synthesis of a category: rendered once and published right away."""
+        with self._lock:
+            self._pending.discard(category_name)
+            self._rendered[category_name] = self._process(category_name, items)
+            self._publish()
+
+    def _process(self, category_name, items):
+        try:
+            return _process_daily_items(items)
+        except Exception as e:
+            logger.error(f"Error al renderizar la categoría '{category_name}' para la publicación progresiva: {e}")
+            return []
+
+    def _publish(self):
+        ordered_content_for_template = {cat_name: self._rendered.get(cat_name, [])
+                                        for cat_name in _ordered_categories(self.run_config, self._categories)}
+        try:
+            _write_html(config.LIVE_PAGE_FILE,
+                        _render_daily_page(ordered_content_for_template, self.date_str, self._pending))
+        except Exception as e:
+            # A failed partial page must not stop the synthesis: the final page is written afterwards anyway
+            logger.error(f"Error al publicar la página parcial de {self.date_str}: {e}")
+            return
+        self._last_publish = time.monotonic()
+        if self.first_content_seconds is None and any(ordered_content_for_template.values()):
+            self.first_content_seconds = self._last_publish - self._started_at
+            logger.info(f"Primer contenido de {self.date_str} publicado a los {self.first_content_seconds:.1f}s "
+                        f"({len(self._pending)} categorías pendientes).")
+        logger.debug(f"Página parcial de {self.date_str} publicada; pendientes: {sorted(self._pending)}")
+
+
 def generate_archive_index():
+    config.ensure_directories()
     env = get_jinja_env()
     template = env.get_template("archive_index.html")
 
@@ -156,21 +310,15 @@ def generate_archive_index():
     return output_path
 
 
-def generate_weekly_summary_page(summary_content, week_str):
+def generate_weekly_summary_page(summary_content, week_str, run_config=None):
+    config.ensure_directories()
     env = get_jinja_env()
     template = env.get_template("weekly_summary.html")
 
-    prefs = {}
-    try:
-        with open(config.PREFERENCES_FILE, 'r', encoding='utf-8') as f:
-            prefs = json.load(f)
-    except Exception:
-        logger.warning("No se pudo cargar preferences.json para el generador semanal.")
-
-    categories_order = prefs.get("global", {}).get("categories_order", list(summary_content.keys()))
+    run_config = run_config or get_run_config()
 
     ordered_content_for_template = {}
-    for cat_name in categories_order:
+    for cat_name in _ordered_categories(run_config, summary_content.keys()):
         if cat_name in summary_content and summary_content.get(cat_name):
             processed_items_for_category = []
             for item_data in summary_content[cat_name]:
@@ -178,10 +326,7 @@ def generate_weekly_summary_page(summary_content, week_str):
                 markdown_input = item_data.get('text', '')
 
                 # Convert Markdown to HTML
-                # 'extra' includes tables, fenced_code, footnotes, etc.
-                # 'sane_lists' helps with list parsing.
-                # 'nl2br' converts newlines to <br>, useful if source text uses single newlines for breaks
-                final_html_content = markdown.markdown(markdown_input, extensions=['extra', 'sane_lists', 'nl2br'])
+                final_html_content = markdown_to_html(markdown_input)
 
                 processed_item = item_data.copy()
                 processed_item['content_html'] = final_html_content
@@ -0,0 +1,100 @@
+import functools
+import logging
+import re
+import unicodedata
+from .. import config
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+# Búsqueda de muchas palabras clave a la vez para el filtrado por reglas (Nivel 1).
+# Cada lista de keywords se compila una sola vez en una expresión regular construida a partir de un
+# trie (los prefijos comunes se comparten, así que el coste por artículo apenas crece con la lista),
+# y el resultado se cachea por lista y opciones durante toda la ejecución.
+
+
+def normalize_text(text, accent_insensitive=False):
+    """Pasa a minúsculas y, opcionalmente, elimina tildes y diéresis ('Canción' -> 'cancion')."""
+    text = text.lower()
+    if accent_insensitive:
+        text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    return text
+
+
+def _trie_pattern(node):
+    """Convierte un nodo del trie ({carácter: hijo}, con '' marcando fin de palabra) en una regex."""
+    is_terminal = '' in node
+    singles, alternatives = [], []
+    for char in sorted(c for c in node if c):
+        child = node[char]
+        if list(child) == ['']:
+            singles.append(re.escape(char))
+        else:
+            alternatives.append(re.escape(char) + _trie_pattern(child))
+    if singles:
+        alternatives.append(singles[0] if len(singles) == 1 else f"[{''.join(singles)}]")
+
+    if len(alternatives) == 1 and not is_terminal:
+        return alternatives[0]
+    pattern = f"(?:{'|'.join(alternatives)})"
+    return pattern + "?" if is_terminal else pattern
+
+
+def build_keyword_pattern(keywords, word_boundary=False):
+    """Regex que encuentra cualquiera de `keywords` (ya normalizadas). Devuelve None si no hay ninguna."""
+    trie = {}
+    for keyword in keywords:
+        if not keyword:
+            continue
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    if not trie:
+        return None
+    pattern = _trie_pattern(trie)
+    if word_boundary:
+        pattern = rf"(?<!\w){pattern}(?!\w)"
+    return re.compile(pattern)
+
+
+class KeywordMatcher:
+    """Conjunto compilado de keywords. `find` recibe texto ya pasado por normalize_text con las mismas opciones."""
+
+    def __init__(self, keywords, word_boundary=False, accent_insensitive=False):
+        self.accent_insensitive = accent_insensitive
+        # Keyword normalizada -> keyword original (para los mensajes de log)
+        self.originals = {normalize_text(k, accent_insensitive): k for k in keywords if k}
+        self.pattern = build_keyword_pattern(self.originals, word_boundary)
+
+    def __bool__(self):
+        return self.pattern is not None
+
+    def find(self, normalized_text):
+        """Devuelve la keyword original de la primera coincidencia, o None."""
+        if self.pattern is None:
+            return None
+        match = self.pattern.search(normalized_text)
+        return self.originals.get(match.group(0), match.group(0)) if match else None
+
+
+# Caché por identidad de la lista: evita re-hashear una tupla de miles de keywords en cada artículo.
+# Guarda una referencia a la lista para que su id no se reutilice; las listas de preferencias y de
+# SourceConfig no se modifican durante la ejecución.
+_matchers_by_identity = {}
+
+
+def get_keyword_matcher(keywords, word_boundary=False, accent_insensitive=False):
+    """KeywordMatcher cacheado para una secuencia de keywords (p. ej. la blacklist global o las de un SourceConfig)."""
+    identity_key = (id(keywords), word_boundary, accent_insensitive)
+    entry = _matchers_by_identity.get(identity_key)
+    if entry is not None and entry[0] is keywords:
+        return entry[1]
+    matcher = _compile_keyword_matcher(tuple(keywords), word_boundary, accent_insensitive)
+    _matchers_by_identity[identity_key] = (keywords, matcher)
+    return matcher
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_keyword_matcher(keywords, word_boundary, accent_insensitive):
+    return KeywordMatcher(keywords, word_boundary, accent_insensitive)
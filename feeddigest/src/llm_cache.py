@@ -0,0 +1,150 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from .. import config
+from .llm_executor import execute_prompt, LLMBudgetExhausted
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+# Caché persistente de respuestas del LLM, direccionada por contenido:
+# clave = sha256(id del modelo, prompt completo, hash de las opciones).
+# Cada entrada es un JSON en config.LLM_CACHE_DIR/<2 primeros hex>/<clave>.json.
+# Una re-ejecución con la misma entrada (tras un fallo, un cambio de plantilla que no afecta a
+# ciertos prompts o un workflow_dispatch manual) no vuelve a llamar al proveedor.
+
+_stats = {"hits": 0, "misses": 0, "errors": 0}
+_stats_lock = threading.Lock()
+
+
+def _model_id(model):
+    return getattr(model, 'model_id', None) or str(model)
+
+
+def cache_key(model, prompt, options=None):
+    options_hash = hashlib.sha256(
+        json.dumps(options or {}, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    payload = "\x1f".join([_model_id(model), options_hash, prompt])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _entry_path(key):
+    return Path(config.LLM_CACHE_DIR) / key[:2] / f"{key}.json"
+
+
+def _count(stat):
+    with _stats_lock:
+        _stats[stat] += 1
+
+
+def _read_entry(key):
+    path = _entry_path(key)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Entrada de caché LLM ilegible ({path.name}): {e}. Se ignora.")
+        return None
+    if time.time() - entry.get('created', 0) > config.LLM_CACHE_MAX_AGE_DAYS * 86400:
+        return None
+    return entry
+
+
+def _write_entry(key, model, text):
+    path = _entry_path(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"model": _model_id(model), "created": time.time(), "text": text}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"No se pudo escribir en la caché LLM: {e}")
+
+
+def prompt_text(model, prompt, on_chunk=None, on_start=None, budget=None, **options):
+    """
+    Equivalente a model.prompt(prompt, **options).text() pasando por la caché persistente
+    y, en caso de fallo de caché, por el ejecutor (límites de concurrencia, cuota y reintentos).
+    Las respuestas vacías no se guardan, para no fijar un fallo del proveedor.
+    Con `on_chunk` la respuesta se recibe en streaming (un acierto de caché llega como un único fragmento).
+    `on_start()` se llama cuando empieza de verdad una llamada al modelo (nunca en un acierto de caché).
+    `budget`: presupuesto contra el que se cargan las llamadas (ver llm_executor.execute_prompt); los aciertos
+    de caché no lo consumen.
+    """
+    use_cache = config.LLM_CACHE_ENABLED
+    key = cache_key(model, prompt, options) if use_cache else None
+    if use_cache:
+        entry = _read_entry(key)
+        if entry is not None:
+            _count("hits")
+            if on_chunk is not None:
+                on_chunk(entry['text'])
+            return entry['text']
+    _count("misses")
+
+    try:
+        text = execute_prompt(model, prompt, on_chunk=on_chunk, on_start=on_start, budget=budget, **options)
+    except LLMBudgetExhausted:
+        raise  # No es un error del proveedor
+    except Exception:
+        _count("errors")
+        raise
+
+    if use_cache and text and text.strip():
+        _write_entry(key, model, text)
+    return text
+
+
+def get_cache_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def log_cache_stats():
+    stats = get_cache_stats()
+    total = stats['hits'] + stats['misses']
+    hit_rate = 100.0 * stats['hits'] / total if total else 0.0
+    logger.info(f"Caché LLM: {stats['hits']} aciertos, {stats['misses']} fallos "
+                f"({hit_rate:.0f}% de aciertos), {stats['errors']} errores del proveedor.")
+
+
+def prune_llm_cache(max_age_days=None, max_size_mb=None):
+    """Elimina las entradas caducadas y, si la caché supera `max_size_mb`, las más antiguas hasta cumplirlo."""
+    max_age_days = config.LLM_CACHE_MAX_AGE_DAYS if max_age_days is None else max_age_days
+    max_size_bytes = (config.LLM_CACHE_MAX_SIZE_MB if max_size_mb is None else max_size_mb) * 1024 * 1024
+    cache_dir = Path(config.LLM_CACHE_DIR)
+    if not cache_dir.exists():
+        return 0
+
+    now = time.time()
+    entries = []
+    removed = 0
+    for path in cache_dir.glob("*/*.json"):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        if now - stat.st_mtime > max_age_days * 86400:
+            path.unlink(missing_ok=True)
+            removed += 1
+        else:
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):  # Las más antiguas primero
+        if total_size <= max_size_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total_size -= size
+        removed += 1
+
+    if removed:
+        logger.info(f"Caché LLM: {removed} entradas eliminadas (edad o tamaño).")
+    return removed
@@ -0,0 +1,222 @@
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .. import config
+from .truncation import estimate_tokens
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+# Ejecutor de llamadas al LLM: limita las llamadas simultáneas por modelo (semáforo), respeta la
+# cuota de peticiones por minuto del proveedor (token bucket) y reintenta con espera exponencial
+# con jitter los errores transitorios (429, 5xx, red). Se sitúa por debajo de la caché de
+# llm_cache: los aciertos de caché no consumen cuota ni hueco de concurrencia.
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+# Excepciones de los clientes de los proveedores que se reintentan aunque no expongan código HTTP
+RETRYABLE_EXCEPTION_NAMES = {"RateLimitError", "APIConnectionError", "APITimeoutError", "InternalServerError",
+                             "ServiceUnavailableError", "ResourceExhausted", "ServiceUnavailable", "DeadlineExceeded"}
+
+_stats = {"calls": 0, "retries": 0, "failures": 0, "refused": 0, "input_tokens": 0, "output_tokens": 0,
+          "throttled_seconds": 0.0}
+_stats_lock = threading.Lock()
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class LLMBudgetExhausted(Exception):
+    """El presupuesto de llamadas/tokens de la llamada está agotado: la llamada no se ha hecho."""
+
+
+class TokenBucket:
+    """Token bucket thread-safe: `rate_per_minute` peticiones por minuto con ráfagas de hasta `capacity`."""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1.0, float(capacity if capacity is not None else min(rate_per_minute, 10)))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Bloquea hasta disponer de un token. Devuelve los segundos esperados."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return waited
+                delay = (1.0 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+def _model_id(model):
+    return getattr(model, 'model_id', None) or str(model)
+
+
+def _model_limits(model_id):
+    """Devuelve (concurrencia, peticiones por minuto) para el modelo, aplicando LLM_MODEL_LIMITS."""
+    limits = {}
+    if config.LLM_MODEL_LIMITS:
+        try:
+            limits = json.loads(config.LLM_MODEL_LIMITS).get(model_id, {})
+        except (json.JSONDecodeError, AttributeError) as e:
+            logger.error(f"LLM_MODEL_LIMITS no es un JSON válido ({e}). Usando los límites por defecto.")
+    concurrency = max(1, int(limits.get("concurrency", config.LLM_MAX_CONCURRENCY)))
+    requests_per_minute = float(limits.get("requests_per_minute", config.LLM_REQUESTS_PER_MINUTE))
+    return concurrency, requests_per_minute
+
+
+def _get_limiter(model):
+    """Semáforo y token bucket (o None si no hay cuota) compartidos por todas las llamadas a un modelo."""
+    model_id = _model_id(model)
+    with _limiters_lock:
+        if model_id not in _limiters:
+            concurrency, requests_per_minute = _model_limits(model_id)
+            bucket = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+            _limiters[model_id] = (threading.BoundedSemaphore(concurrency), bucket)
+            logger.debug(f"Límites para '{model_id}': {concurrency} llamadas simultáneas, "
+                         f"{requests_per_minute or 'sin límite de'} peticiones/min.")
+        return _limiters[model_id]
+
+
+def reset_limiters():
+    """Descarta los semáforos y token buckets creados, para que los siguientes usen los límites actuales de config."""
+    with _limiters_lock:
+        _limiters.clear()
+
+
+def get_model_concurrency(model):
+    return _model_limits(_model_id(model))[0]
+
+
+def _status_code(exc):
+    for candidate in (exc, getattr(exc, 'response', None)):
+        for attribute in ('status_code', 'status', 'code'):
+            value = getattr(candidate, attribute, None)
+            if isinstance(value, int):
+                return value
+    return None
+
+
+def is_retryable_error(exc):
+    status = _status_code(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    return isinstance(exc, (ConnectionError, TimeoutError)) or type(exc).__name__ in RETRYABLE_EXCEPTION_NAMES
+
+
+def _retry_delay(attempt):
+    """Espera exponencial con 'full jitter': aleatoria entre 0 y base * 2^intento (acotada)."""
+    return random.uniform(0, min(config.LLM_RETRY_MAX_DELAY, config.LLM_RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def _record_usage(response, prompt, text):
+    """Suma el uso de la respuesta a las estadísticas. Devuelve los tokens (entrada + salida) contabilizados."""
+    try:
+        usage = response.usage()
+        input_tokens, output_tokens = getattr(usage, 'input', None), getattr(usage, 'output', None)
+    except Exception:  # Modelos o versiones de llm sin información de uso
+        input_tokens = output_tokens = None
+    input_tokens = input_tokens if input_tokens is not None else estimate_tokens(prompt)
+    output_tokens = output_tokens if output_tokens is not None else estimate_tokens(text)
+    with _stats_lock:
+        _stats["input_tokens"] += input_tokens
+        _stats["output_tokens"] += output_tokens
+    return input_tokens + output_tokens
+
+
+def execute_prompt(model, prompt, on_chunk=None, on_start=None, budget=None, **options):
+    """
+    Equivalente a model.prompt(prompt, **options).text() respetando los límites de concurrencia y
+    cuota del modelo. Los errores transitorios se reintentan hasta LLM_MAX_RETRIES veces; el resto
+    (o el último intento fallido) se propaga para que el llamante aplique su fallback.
+    Con `on_chunk`, la respuesta se consume en streaming y cada fragmento se pasa a on_chunk según llega;
+    un error después del primer fragmento ya no se reintenta (el llamante habría recibido texto duplicado).
+    Con `budget` (scheduler.LLMBudget), cada intento, reintentos incluidos, reserva una llamada con
+    budget.reserve(tokens_estimados) antes de hacerse y, si ya no cabe, se lanza LLMBudgetExhausted; al
+    terminar, budget.settle(reservados, usados) ajusta los tokens reales.
+    `on_start()` se llama al empezar cada intento, ya obtenidos el hueco de concurrencia y la cuota.
+    """
+    semaphore, bucket = _get_limiter(model)
+    reserved_tokens = estimate_tokens(prompt)
+    attempt = 0
+    while True:
+        chunks = []
+        # La cuota se espera fuera del semáforo: un hilo dormido en el bucket no debe ocupar un hueco de
+        # concurrencia que otro hilo con cuota ya disponible podría usar.
+        if bucket is not None:
+            waited = bucket.acquire()
+            if waited:
+                with _stats_lock:
+                    _stats["throttled_seconds"] += waited
+        with semaphore:
+            if budget is not None and not budget.reserve(reserved_tokens):
+                with _stats_lock:
+                    _stats["refused"] += 1
+                raise LLMBudgetExhausted("presupuesto de llamadas/tokens de la ejecución agotado")
+            with _stats_lock:
+                _stats["calls"] += 1
+            if on_start is not None:
+                on_start()
+            try:
+                response = model.prompt(prompt, **options)
+                if on_chunk is None:
+                    text = response.text()
+                else:
+                    for chunk in response:
+                        chunks.append(chunk)
+                        on_chunk(chunk)
+                    text = "".join(chunks)
+            except Exception as e:
+                error = e
+            else:
+                used_tokens = _record_usage(response, prompt, text)
+                if budget is not None:
+                    budget.settle(reserved_tokens, used_tokens)
+                return text
+
+        if chunks or attempt >= config.LLM_MAX_RETRIES or not is_retryable_error(error):
+            with _stats_lock:
+                _stats["failures"] += 1
+            raise error
+        delay = _retry_delay(attempt)
+        attempt += 1
+        with _stats_lock:
+            _stats["retries"] += 1
+        logger.warning(f"Error transitorio del LLM ({type(error).__name__}: {error}). "
+                       f"Reintento {attempt}/{config.LLM_MAX_RETRIES} en {delay:.1f}s.")
+        time.sleep(delay)
+
+
+def map_ordered(function, items, max_workers=None):
+    """
+    Aplica `function` a cada elemento de `items` en paralelo y devuelve los resultados en el orden
+    de entrada, de modo que el resultado no depende del orden en que terminan las llamadas.
+    """
+    items = list(items)
+    max_workers = config.LLM_MAX_CONCURRENCY if max_workers is None else max_workers
+    if max_workers <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items)), thread_name_prefix="llm") as pool:
+        return list(pool.map(function, items))
+
+
+def get_executor_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def log_executor_stats():
+    stats = get_executor_stats()
+    logger.info(f"Ejecutor LLM: {stats['calls']} llamadas, {stats['retries']} reintentos, "
+                f"{stats['failures']} fallos definitivos, {stats['refused']} rechazadas por presupuesto, "
+                f"{stats['input_tokens']} tokens de entrada, "
+                f"{stats['output_tokens']} de salida, {stats['throttled_seconds']:.1f}s esperando cuota.")
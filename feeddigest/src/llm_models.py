@@ -0,0 +1,47 @@
+import logging
+import threading
+from .. import config
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+# Carga diferida de los modelos LLM: `import llm` y llm.get_model() (que descubre e importa todos los
+# plugins instalados y sus SDK) solo se ejecutan la primera vez que una fase necesita el modelo. Así,
+# importar los módulos o ejecutar comandos que no llaman al LLM (re-generar páginas, benchmarks...)
+# no paga ese coste.
+
+# Rol -> variable de config con el id del modelo
+MODEL_SETTINGS = {
+    "classification": "LLM_MODEL_CLASSIFICATION",
+    "relevance": "LLM_MODEL_RELEVANCE",
+    "synthesis": "LLM_MODEL_SYNTHESIS",
+}
+
+_models = {}  # rol -> modelo (o None si no se pudo cargar: el error se registra una sola vez)
+_models_lock = threading.Lock()
+
+
+def get_model(role):
+    """Modelo LLM para `role` ('classification', 'relevance' o 'synthesis'), o None si no está disponible."""
+    if role in _models:
+        return _models[role]
+    with _models_lock:
+        if role not in _models:
+            model_id = getattr(config, MODEL_SETTINGS[role])
+            try:
+                import llm
+                _models[role] = llm.get_model(model_id)
+                logger.info(f"Usando modelo para '{role}': {model_id}")
+            except Exception as e:
+                logger.error(f"Error al cargar el modelo LLM para '{role}' ({model_id}): {e}. "
+                             f"Las funciones de IA que lo usan no operarán correctamente.")
+                _models[role] = None
+    return _models[role]
+
+
+def set_model(role, model):
+    """Sustituye el modelo de `role` (benchmarks o pruebas con modelos simulados)."""
+    if role not in MODEL_SETTINGS:
+        raise ValueError(f"Rol de modelo desconocido: {role}")
+    with _models_lock:
+        _models[role] = model
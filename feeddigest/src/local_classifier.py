@@ -0,0 +1,224 @@
+import json
+import logging
+import re
+import threading
+import unicodedata
+import zlib
+from datetime import datetime
+import numpy as np
+from .. import config
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+# Pre-clasificador local (Naive Bayes multinomial sobre rasgos TF-IDF con hashing) entrenado con las
+# categorías asignadas en data/history. Si su confianza supera el umbral de preferences.json, el
+# artículo no se envía al LLM para clasificarlo. El modelo se guarda en config.LOCAL_CLASSIFIER_FILE
+# (caché regenerable) y se entrena de forma incremental: guarda la fecha del último día del historial con
+# el que se entrenó (trained_until) y en cada ejecución solo añade los días posteriores ya cerrados (el de
+# hoy puede cambiar aún con una re-ejecución; se añade al día siguiente).
+
+NUM_FEATURES = 2 ** 18
+TOKEN_RE = re.compile(r"\w{3,}")
+MAX_CONTENT_CHARS = 1000
+SMOOTHING_ALPHA = 0.1
+# Las probabilidades de Naive Bayes crecen con la longitud del texto hasta saturar en 1.0, así que la
+# verosimilitud se calcula sobre los pesos normalizados (suma 1), como si cada artículo tuviera un solo
+# "token". `confidence_scale` (local_classifier_confidence_scale en preferences.json) es el número de tokens
+# equivalentes: cuanto mayor, más extremas las probabilidades. Va junto a local_classifier_confidence_threshold:
+# el umbral solo tiene sentido para una escala dada.
+DEFAULT_CONFIDENCE_SCALE = 5.0
+
+_stats = {"local": 0, "llm": 0, "audited": 0, "audit_agreements": 0, "fallback_agreements": 0}
+_stats_lock = threading.Lock()
+
+
+def _normalize(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def extract_features(title, content_text, source_name):
+    """Devuelve (índices, tf sublineal) de los rasgos hasheados: palabras del título y del texto y la fuente."""
+    counts = {}
+    tokens = TOKEN_RE.findall(_normalize(f"{title} {title} {content_text[:MAX_CONTENT_CHARS]}"))
+    if source_name:
+        tokens.append(f"__source__{source_name}")
+    for token in tokens:
+        index = zlib.crc32(token.encode('utf-8')) % NUM_FEATURES
+        counts[index] = counts.get(index, 0) + 1
+    if not counts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    values = 1.0 + np.log(np.fromiter(counts.values(), dtype=np.float64, count=len(counts)))
+    return indices, values
+
+
+class LocalClassifier:
+    """Naive Bayes multinomial con conteos por clase acumulables (entrenamiento incremental)."""
+
+    def __init__(self, classes=(), feature_counts=None, class_counts=None, document_frequency=None,
+                 num_documents=0, trained_until=None):
+        self.classes = list(classes)
+        self.feature_counts = (feature_counts if feature_counts is not None
+                               else np.zeros((len(self.classes), NUM_FEATURES), dtype=np.float32))
+        self.class_counts = class_counts if class_counts is not None else np.zeros(len(self.classes))
+        self.document_frequency = (document_frequency if document_frequency is not None
+                                   else np.zeros(NUM_FEATURES, dtype=np.float32))
+        self.num_documents = num_documents
+        self.trained_until = trained_until  # Fecha (YYYY-MM-DD) del último día del historial ya entrenado
+        self._log_probabilities = None
+
+    def _class_index(self, category):
+        if category not in self.classes:
+            self.classes.append(category)
+            self.feature_counts = np.vstack([self.feature_counts, np.zeros((1, NUM_FEATURES), dtype=np.float32)])
+            self.class_counts = np.append(self.class_counts, 0.0)
+        return self.classes.index(category)
+
+    def partial_fit(self, documents):
+        """Añade documentos (título, texto, fuente, categoría). Devuelve cuántos se añadieron."""
+        added = 0
+        for title, content_text, source_name, category in documents:
+            if not category:
+                continue
+            indices, values = extract_features(title, content_text, source_name)
+            class_index = self._class_index(category)
+            self.feature_counts[class_index, indices] += values
+            self.class_counts[class_index] += 1
+            self.document_frequency[indices] += 1
+            self.num_documents += 1
+            added += 1
+        if added:
+            self._log_probabilities = None
+        return added
+
+    def _model(self):
+        if self._log_probabilities is None:
+            smoothed = self.feature_counts.astype(np.float64) + SMOOTHING_ALPHA
+            self._log_probabilities = np.log(smoothed / smoothed.sum(axis=1, keepdims=True))
+            self._log_priors = np.log((self.class_counts + 1.0) / (self.class_counts.sum() + len(self.classes)))
+            self._idf = np.log((1.0 + self.num_documents) / (1.0 + self.document_frequency)) + 1.0
+        return self._log_probabilities, self._log_priors, self._idf
+
+    def predict(self, title, content_text, source_name, allowed_classes=None,
+                confidence_scale=DEFAULT_CONFIDENCE_SCALE):
+        """
+        Devuelve (categoría, confianza) o (None, 0.0) si el modelo está vacío. La confianza es la probabilidad a
+        posteriori de la categoría con la verosimilitud escalada por `confidence_scale` (ver arriba).
+        """
+        if not self.classes or not self.num_documents:
+            return None, 0.0
+        log_probabilities, log_priors, idf = self._model()
+        indices, values = extract_features(title, content_text, source_name)
+        if not len(indices):
+            return None, 0.0
+        weights = values * idf[indices]  # Rasgos TF-IDF: las palabras comunes a todas las categorías pesan poco
+        scores = log_priors + confidence_scale * (log_probabilities[:, indices] @ (weights / weights.sum()))
+        if allowed_classes is not None:
+            scores = np.where([c in allowed_classes for c in self.classes], scores, -np.inf)
+        if not np.isfinite(scores).any():
+            return None, 0.0
+        probabilities = np.exp(scores - scores.max())
+        probabilities /= probabilities.sum()
+        best = int(np.argmax(probabilities))
+        return self.classes[best], float(probabilities[best])
+
+    def save(self, path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp.npz")
+        np.savez_compressed(tmp_path, feature_counts=self.feature_counts, class_counts=self.class_counts,
+                            document_frequency=self.document_frequency,
+                            metadata=np.array(json.dumps({"classes": self.classes, "num_documents": self.num_documents,
+                                                          "num_features": NUM_FEATURES,
+                                                          "trained_until": self.trained_until})))
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            metadata = json.loads(str(data['metadata']))
+            if metadata.get('num_features') != NUM_FEATURES:
+                raise ValueError("número de rasgos distinto; se reentrena")
+            if 'trained_until' not in metadata:
+                raise ValueError("formato anterior sin trained_until; se reentrena")
+            return cls(metadata['classes'], data['feature_counts'], data['class_counts'], data['document_frequency'],
+                       metadata['num_documents'], metadata['trained_until'])
+
+
+def _history_files_to_train(trained_until, today):
+    """Ficheros del historial (YYYY-MM-DD.json) posteriores a `trained_until` y anteriores a `today`."""
+    return [history_file for history_file in sorted(config.HISTORY_DIR.glob("*.json"))
+            if (trained_until is None or history_file.stem > trained_until) and history_file.stem < today]
+
+
+def _iter_history_documents(history_files):
+    for history_file in history_files:
+        try:
+            with open(history_file, 'r', encoding='utf-8') as f:
+                articles = json.load(f)
+        except Exception as e:
+            logger.error(f"Error cargando {history_file} para el clasificador local: {e}")
+            continue
+        for data in articles:
+            # Los artículos 'include_always' nunca pasan por el clasificador: su categoría no es una etiqueta útil
+            if data.get('include_always') or not data.get('content_text'):
+                continue
+            yield data.get('title', ''), data['content_text'], data.get('source_name'), data.get('assigned_category')
+
+
+def load_local_classifier(today=None):
+    """
+    Carga el modelo guardado (si existe) y lo actualiza con los días del historial posteriores a su
+    trained_until y anteriores a `today` (YYYY-MM-DD, por defecto la fecha actual).
+    """
+    today = today or datetime.now().strftime("%Y-%m-%d")
+    path = config.LOCAL_CLASSIFIER_FILE
+    model = None
+    if path.exists():
+        try:
+            model = LocalClassifier.load(path)
+        except Exception as e:
+            logger.warning(f"No se pudo cargar el clasificador local ({e}). Se entrena desde cero.")
+    model = model or LocalClassifier()
+
+    history_files = _history_files_to_train(model.trained_until, today)
+    if not history_files:
+        return model
+    added = model.partial_fit(_iter_history_documents(history_files))
+    model.trained_until = history_files[-1].stem
+    logger.info(f"Clasificador local: {added} artículos nuevos del historial hasta {model.trained_until} "
+                f"({model.num_documents} en total).")
+    try:
+        model.save(path)
+    except OSError as e:
+        logger.warning(f"No se pudo guardar el clasificador local: {e}")
+    return model
+
+
+def is_audit_sample(article_id, audit_rate):
+    """Selección determinista (por id) de la fracción de artículos que se envía al LLM pese a la confianza local."""
+    return audit_rate > 0 and zlib.crc32(article_id.encode('utf-8')) % 10000 < audit_rate * 10000
+
+
+def record_local_decision(stat, agreed=None):
+    with _stats_lock:
+        _stats[stat] += 1
+        if agreed:
+            _stats["audit_agreements" if stat == "audited" else "fallback_agreements"] += 1
+
+
+def get_local_classifier_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def log_local_classifier_stats():
+    stats = get_local_classifier_stats()
+    if not stats['local'] and not stats['llm'] and not stats['audited']:
+        return
+    audit_agreement = 100.0 * stats['audit_agreements'] / stats['audited'] if stats['audited'] else 0.0
+    fallback_agreement = 100.0 * stats['fallback_agreements'] / stats['llm'] if stats['llm'] else 0.0
+    logger.info(f"Clasificador local: {stats['local']} llamadas de clasificación evitadas, {stats['llm']} enviadas "
+                f"al LLM por baja confianza (coincidencia {fallback_agreement:.0f}%), {stats['audited']} auditadas "
+                f"(coincidencia con el LLM {audit_agreement:.0f}%).")
@@ -4,10 +4,15 @@ from datetime import datetime
 from pathlib import Path
 
 from .. import config  # Uso de importación relativa
-from .collector import collect_all_articles
+from .collector import iter_articles, load_fetch_state, save_fetch_state
 from .classifier import classify_and_filter_articles
+from .models import Article
+from .storage import load_json_file
 from .synthesizer import synthesize_data
-from .generator import generate_daily_newsletter, generate_archive_index
+from .generator import generate_daily_newsletter, generate_archive_index, ProgressiveNewsletter
+from .run_config import get_run_config
+from .llm_executor import log_executor_stats
+from .llm_cache import log_cache_stats, prune_llm_cache
 
 logging.basicConfig(level=config.LOG_LEVEL, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -17,6 +22,7 @@ def save_processed_articles_to_history(classified_articles, date_str):
     """
     Guarda los artículos clasificados y filtrados (antes de la síntesis) en el historial.
     Estos datos pueden ser usados por el generador de resúmenes semanales.
+    Devuelve False si no se pudo guardar.
     """
     try:
         # Aplanar la estructura de classified_articles (dict de listas) a una sola lista para el historial
@@ -26,14 +32,31 @@ def save_processed_articles_to_history(classified_articles, date_str):
 
         if not all_processed_articles:
             logger.info(f"No hay artículos procesados para guardar en el historial del {date_str}.")
-            return
+            return True
 
         history_file_path = config.HISTORY_DIR / f"{date_str}.json"
         with open(history_file_path, 'w', encoding='utf-8') as f:
-            json.dump(all_processed_articles, f, indent=2, ensure_ascii=False)
+            json.dump([article.to_dict() for article in all_processed_articles], f, indent=2, ensure_ascii=False)
         logger.info(f"Artículos procesados guardados en: {history_file_path}")
+        return True
     except Exception as e:
         logger.error(f"Error guardando artículos procesados en el historial: {e}")
+        return False
+
+
+def load_processed_articles_from_history(date_str):
+    """
+    Artículos ya aceptados en `date_str` por una ejecución anterior (history/<fecha>.json), o [] si no hay.
+    Una re-ejecución del mismo día (workflow_dispatch) solo recibe lo nuevo de cada feed (GET condicional y
+    marcas de agua), así que parte de lo ya aceptado para no sustituir la edición del día por una parcial.
+    """
+    history_file_path = config.HISTORY_DIR / f"{date_str}.json"
+    history = load_json_file(history_file_path, default=[])
+    if not isinstance(history, list):
+        logger.warning(f"Formato inesperado en {history_file_path}. Se ignora el historial del día.")
+        return []
+    sources_cache = {}
+    return [Article.from_dict(data, sources_cache) for data in history]
 
 
 def run_daily_digest():
@@ -44,48 +67,82 @@ def run_daily_digest():
     logger.info("Iniciando el proceso de FeedDigest diario...")
 
     today_str = start_time.strftime("%Y-%m-%d")
+    # Instantánea de preferences.json y prompts.json para toda la ejecución (se pasa a cada fase)
+    run_config = get_run_config()
+    config.ensure_directories()
 
-    # 1. Recolectar artículos
-    logger.info("Fase 1: Recolección de artículos RSS...")
-    raw_articles = collect_all_articles()
-    if not raw_articles:
+    # 1 y 2. Recolectar, clasificar y filtrar artículos.
+    # La recolección es un generador: la clasificación de los primeros feeds se solapa
+    # con la descarga del resto y no se materializa la lista completa de artículos brutos.
+    logger.info("Fase 1: Recolección de artículos RSS (en streaming hacia la Fase 2)...")
+    collected = {"count": 0}
+
+    def count_collected(article_stream):
+        for article in article_stream:
+            collected["count"] += 1
+            yield article
+
+    logger.info("Fase 2: Clasificación y filtrado de artículos...")
+    accepted_today = load_processed_articles_from_history(today_str)
+    if accepted_today:
+        logger.info(f"{len(accepted_today)} artículos ya aceptados hoy en una ejecución anterior: se conservan.")
+    # Estado de descarga (ETag, hash, marcas de agua): se guarda solo cuando lo recolectado ya está en el historial
+    fetch_state = load_fetch_state()
+    classified_articles = classify_and_filter_articles(
+        count_collected(iter_articles(fetch_state=fetch_state)), run_config, accepted_today)
+    if collected["count"] == 0 and not accepted_today:
         logger.info("No se recolectaron artículos. Finalizando proceso.")
+        save_fetch_state(fetch_state)  # No se ingirió nada: solo se actualizan ETags y hashes
         return
-    logger.info(f"Recolectados {len(raw_articles)} artículos en total.")
+    logger.info(f"Recolectados {collected['count']} artículos en total.")
+
+    # Guardar artículos clasificados y filtrados en el historial para el resumen semanal
+    if save_processed_articles_to_history(classified_articles, today_str):
+        save_fetch_state(fetch_state)
+    else:
+        logger.warning("No se guarda el estado de descarga: los artículos de hoy se volverán a recolectar.")
 
-    # 2. Clasificar y Filtrar
-    logger.info("Fase 2: Clasificación y filtrado de artículos...")
-    classified_articles = classify_and_filter_articles(raw_articles)
     num_relevant_articles = sum(len(arts) for arts in classified_articles.values())
     if num_relevant_articles == 0:
         logger.info("No quedaron artículos relevantes después de la clasificación y filtrado. Finalizando.")
         # Aún así, generamos una página vacía para indicar que se ejecutó
-        generate_daily_newsletter({}, today_str)
+        generate_daily_newsletter({}, today_str, run_config)
         generate_archive_index()  # Actualizar el archivo de todas formas
         return
     logger.info(f"Clasificados {num_relevant_articles} artículos relevantes en {len(classified_articles)} categorías.")
 
-    # Guardar artículos clasificados y filtrados en el historial para el resumen semanal
-    save_processed_articles_to_history(classified_articles, today_str)
-
     # 3. Analizar y Sintetizar
     logger.info("Fase 3: Análisis y síntesis de contenido...")
-    synthesized_content = synthesize_data(classified_articles)
+    if config.SYNTHESIS_STREAMING:
+        # Publicar en output/live.html a medida que cada categoría se sintetiza (la versión final, la única que
+        # llega a index.html y al archivo, se genera en la fase 4). Al salir del bloque, aunque la síntesis
+        # falle, la página parcial deja de recargarse.
+        with ProgressiveNewsletter(today_str, [c for c, a in classified_articles.items() if a],
+                                   run_config) as progressive_page:
+            synthesized_content = synthesize_data(classified_articles, run_config,
+                                                  on_progress=progressive_page.category_progress,
+                                                  on_category_ready=progressive_page.category_ready)
+    else:
+        synthesized_content = synthesize_data(classified_articles, run_config)
     if not any(synthesized_content.values()):  # Check si hay algún contenido sintetizado
         logger.info("No se generó contenido sintetizado. Finalizando.")
-        generate_daily_newsletter({}, today_str)  # Generar página vacía
+        generate_daily_newsletter({}, today_str, run_config)  # Generar página vacía
         generate_archive_index()
         return
     logger.info("Síntesis completada.")
 
     # 4. Generar Newsletter
     logger.info("Fase 4: Generación de la newsletter HTML...")
-    generate_daily_newsletter(synthesized_content, today_str)
+    generate_daily_newsletter(synthesized_content, today_str, run_config)
 
     # 5. Actualizar índice del archivo
     logger.info("Fase 5: Actualización del índice del archivo...")
     generate_archive_index()
 
+    log_cache_stats()
+    log_executor_stats()
+    prune_llm_cache()
+
     end_time = datetime.now()
     logger.info(f"Proceso de FeedDigest diario completado en {end_time - start_time}.")
     logger.info(f"Resultados publicados en: {config.OUTPUT_DIR}")
@@ -0,0 +1,121 @@
+from dataclasses import dataclass, field
+from typing import Optional
+
+# Tipos de datos compartidos por todas las fases del pipeline.
+# Article usa __slots__ y referencia un SourceConfig compartido en lugar de copiar
+# en cada artículo las keywords, blacklist, categoría por defecto e include_always de su fuente.
+
+
+@dataclass(frozen=True, slots=True)
+class SourceConfig:
+    """Configuración inmutable de una fuente RSS (una entrada de sources.json)."""
+    url: str
+    name: Optional[str] = None
+    default_category: str = "General"
+    keywords: tuple = ()
+    blacklist: tuple = ()
+    include_always: bool = False
+    priority_weight: float = 1.0  # Peso de la fuente al priorizar las llamadas al LLM (ver scheduler.py)
+
+    @property
+    def display_name(self):
+        return self.name or self.url
+
+    @classmethod
+    def from_dict(cls, source_dict):
+        return cls(
+            url=source_dict.get('url', ''),
+            name=source_dict.get('name'),
+            default_category=source_dict.get('default_category', 'General'),
+            keywords=tuple(source_dict.get('keywords', [])),
+            blacklist=tuple(source_dict.get('blacklist', [])),
+            include_always=bool(source_dict.get('include_always', False)),
+            priority_weight=float(source_dict.get('priority_weight', 1.0)),
+        )
+
+
+@dataclass(slots=True, eq=False)
+class Article:
+    id: str
+    title: str
+    link: str
+    published_date: Optional[str]
+    content_text: str
+    source: SourceConfig
+    content_raw: Optional[str] = None  # Solo se conserva si config.KEEP_RAW_HTML
+    assigned_category: Optional[str] = None
+    relevance_score: Optional[float] = None  # Puntuación 0-1 cuando la relevancia es numérica
+    duplicates: list = field(default_factory=list)  # Casi duplicados de otras fuentes (ver dedup.py)
+
+    # --- Accesos a la configuración de la fuente (compartida, no copiada) ---
+    @property
+    def source_name(self):
+        return self.source.name
+
+    @property
+    def default_category(self):
+        return self.source.default_category
+
+    @property
+    def source_keywords(self):
+        return self.source.keywords
+
+    @property
+    def source_blacklist(self):
+        return self.source.blacklist
+
+    @property
+    def include_always(self):
+        return self.source.include_always
+
+    # --- Serialización (formato de data/history/*.json) ---
+    def to_dict(self):
+        """Formato compacto para el historial: sin copias de la configuración de la fuente."""
+        data = {
+            "id": self.id,
+            "title": self.title,
+            "link": self.link,
+            "published_date": self.published_date,
+            "content_text": self.content_text,
+            "source_name": self.source.name,
+            "default_category": self.source.default_category,
+            "include_always": self.source.include_always,
+        }
+        if self.content_raw is not None:
+            data["content_raw"] = self.content_raw
+        if self.assigned_category is not None:
+            data["assigned_category"] = self.assigned_category
+        if self.duplicates:
+            data["duplicates"] = [{"id": d.id, "title": d.title, "link": d.link, "source_name": d.source_name}
+                                  for d in self.duplicates]
+        return data
+
+    @classmethod
+    def from_dict(cls, data, sources_cache=None):
+        """
+        Construye un Article desde un dict del historial. Acepta tanto el formato compacto como el
+        antiguo (con source_keywords/source_blacklist copiados en cada artículo).
+        `sources_cache` permite compartir un único SourceConfig entre artículos de la misma fuente.
+        """
+        source = SourceConfig(
+            url="",
+            name=data.get('source_name'),
+            default_category=data.get('default_category', 'General'),
+            keywords=tuple(data.get('source_keywords', ())),
+            blacklist=tuple(data.get('source_blacklist', ())),
+            include_always=bool(data.get('include_always', False)),
+        )
+        if sources_cache is not None:
+            source = sources_cache.setdefault(source, source)
+        duplicates = [cls.from_dict({**d, "content_text": ""}, sources_cache) for d in data.get('duplicates', [])]
+        return cls(
+            id=data.get('id') or data.get('link', ''),
+            title=data.get('title', 'Sin título'),
+            link=data.get('link', ''),
+            published_date=data.get('published_date'),
+            content_text=data.get('content_text', ''),
+            source=source,
+            content_raw=data.get('content_raw'),
+            assigned_category=data.get('assigned_category'),
+            duplicates=duplicates,
+        )
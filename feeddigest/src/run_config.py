@@ -0,0 +1,320 @@
+import json
+import logging
+import string
+import threading
+from dataclasses import dataclass
+from types import MappingProxyType
+from .. import config
+from .truncation import CHARS_PER_TOKEN
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+# Instantánea inmutable de la configuración de una ejecución (preferences.json + prompts.json).
+# Se carga y valida una sola vez y se pasa a todas las fases (clasificación, síntesis, generación);
+# las plantillas de prompt se analizan una vez y las partes que no dependen del artículo (lista de
+# categorías, criterios de cada categoría...) se sustituyen por adelantado, una vez por categoría.
+# Los procesos de larga duración pueden llamar a reload_run_config() para releer los ficheros.
+
+_formatter = string.Formatter()
+
+# Campos que el código rellena en cada plantilla: una plantilla con otros campos no se podría formatear
+PROMPT_FIELDS = {
+    ("classification", "default"): {"categories_list", "title", "short_content", "default_category"},
+    ("classification", "batch"): {"categories_list", "articles_section"},
+    ("classification", "batch_article_template"): {"index", "title", "short_content", "default_category"},
+    ("relevance", "base"): {"category", "criteria_text", "title", "short_content"},
+    ("fused", "batch"): {"categories_list", "criteria_section", "articles_section"},
+    ("fused", "article_template"): {"index", "title", "short_content", "default_category"},
+    ("synthesis", "default"): {"category", "articles_section"},
+    ("synthesis", "article_template"): {"index", "title", "content", "url"},
+    ("synthesis", "map"): {"category", "articles_section"},
+    ("synthesis", "reduce"): {"category", "summaries_section"},
+}
+
+# Tipos esperados de las claves globales de preferences.json (las que no cumplen se ignoran con un aviso)
+GLOBAL_PREFERENCE_TYPES = {
+    "max_articles_per_category": int,
+    "max_articles_per_category_weekly": int,
+    "min_article_length_chars": int,
+    "blacklist_keywords_global": list,
+    "categories_order": list,
+    "max_chars_for_relevance_check": int,
+    "max_chars_for_classification_check": int,
+    "max_tokens_for_relevance_check": int,
+    "max_tokens_for_classification_check": int,
+    "max_tokens_for_synthesis_articles": int,
+    "max_tokens_per_synthesis_article": int,
+    "synthesis_hierarchical_min_articles": int,
+    "synthesis_chunk_size": int,
+    "classification_batch_size": int,
+    "classification_mode": str,
+    "keyword_match_word_boundary": bool,
+    "keyword_match_accent_insensitive": bool,
+    "local_classifier_enabled": bool,
+    "local_classifier_confidence_threshold": (int, float),
+    "local_classifier_confidence_scale": (int, float),
+    "local_classifier_audit_rate": (int, float),
+    "local_classifier_min_training_articles": int,
+    "max_llm_calls_per_run": int,
+    "max_llm_tokens_per_run": int,
+    "scheduler_window": int,
+    "scheduler_max_wait_seconds": (int, float),
+}
+
+# Presupuesto de tokens del contenido de los artículos en cada prompt: (clave en preferences.json, clave
+# antigua en caracteres que se sigue aceptando, valor por defecto). Ver truncation.py.
+CONTENT_TOKEN_BUDGETS = {
+    "classification": ("max_tokens_for_classification_check", "max_chars_for_classification_check", 40),
+    "relevance": ("max_tokens_for_relevance_check", "max_chars_for_relevance_check", 75),
+    "synthesis": ("max_tokens_for_synthesis_articles", None, 5000),  # Total de los artículos de una categoría
+    "synthesis_article": ("max_tokens_per_synthesis_article", None, 250),  # Máximo por artículo en la síntesis
+}
+
+
+def _escape_braces(text):
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+class PromptTemplate:
+    """Plantilla de prompt analizada una sola vez, con sustitución parcial de campos."""
+    __slots__ = ("text", "fields")
+
+    def __init__(self, text):
+        self.text = text
+        self.fields = frozenset(name for _, name, _, _ in _formatter.parse(text) if name)
+
+    def partial(self, **values):
+        """Nueva plantilla con los campos de `values` ya sustituidos (escapando sus llaves); el resto queda pendiente."""
+        pieces = []
+        for literal, name, format_spec, conversion in _formatter.parse(self.text):
+            pieces.append(_escape_braces(literal))
+            if name is None:
+                continue
+            if name in values:
+                value = _formatter.convert_field(values[name], conversion)
+                pieces.append(_escape_braces(_formatter.format_field(value, format_spec)))
+            else:
+                pieces.append("{" + name + (f"!{conversion}" if conversion else "") +
+                              (f":{format_spec}" if format_spec else "") + "}")
+        return PromptTemplate("".join(pieces))
+
+    def format(self, **values):
+        return self.text.format(**values)
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _load_json(path, description):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        logger.error(f"Archivo de {description} no encontrado: {path}")
+        return {}
+    except json.JSONDecodeError:
+        logger.error(f"Error decodificando el archivo JSON de {description}: {path}")
+        return {}
+    if not isinstance(data, dict):
+        logger.error(f"Formato inesperado en {path}: se esperaba un objeto JSON.")
+        return {}
+    return data
+
+
+def _validate_preferences(prefs):
+    """Descarta (con aviso) las claves globales con un tipo incorrecto, para que se apliquen los valores por defecto."""
+    global_prefs = prefs.get('global')
+    if not isinstance(global_prefs, dict):
+        if global_prefs is not None:
+            logger.error("La sección 'global' de preferences.json no es un objeto. Se ignora.")
+        prefs['global'] = global_prefs = {}
+    for key, expected_type in GLOBAL_PREFERENCE_TYPES.items():
+        value = global_prefs.get(key)
+        # bool es subclase de int: no se acepta un booleano donde se espera un número
+        if value is not None and (not isinstance(value, expected_type) or
+                                  (isinstance(value, bool) and expected_type is not bool)):
+            logger.error(f"Valor no válido para '{key}' en preferences.json ({value!r}). Se usa el valor por defecto.")
+            del global_prefs[key]
+    if not isinstance(prefs.get('categories', {}), dict):
+        logger.error("La sección 'categories' de preferences.json no es un objeto. Se ignora.")
+        prefs['categories'] = {}
+    return prefs
+
+
+def _compile_prompt(prompts, section, name):
+    """PromptTemplate de prompts.json[section][name], o None si falta o usa campos que el código no rellena."""
+    text = prompts.get(section, {}).get(name)
+    if not isinstance(text, str) or not text:
+        return None
+    try:
+        template = PromptTemplate(text)
+    except ValueError as e:
+        logger.error(f"Plantilla de prompt '{section}.{name}' mal formada: {e}. Se ignora.")
+        return None
+    unknown_fields = template.fields - PROMPT_FIELDS[(section, name)]
+    if unknown_fields:
+        logger.error(f"La plantilla de prompt '{section}.{name}' usa campos desconocidos {sorted(unknown_fields)}. "
+                     f"Se ignora.")
+        return None
+    return template
+
+
+def _build_criteria_text(prompts, category, category_prefs):
+    relevance_prompts = prompts.get("relevance", {})
+    criteria_templates = relevance_prompts.get("criteria_templates", {})
+    no_specific_criteria_text = relevance_prompts.get("no_specific_criteria", "No hay criterios específicos.")
+    category_criteria_template = criteria_templates.get(category, criteria_templates.get("General"))
+    if not category_criteria_template:
+        return no_specific_criteria_text
+    # Los placeholders de la plantilla (teams_of_interest, topics_of_interest...) son claves de la categoría
+    try:
+        return category_criteria_template.format(**category_prefs)
+    except KeyError as e:
+        logger.warning(
+            f"Falta la clave '{e}' en preferences.json para formatear criterios de relevancia de '{category}'. Usando texto genérico.")
+        return no_specific_criteria_text
+
+
+@dataclass(frozen=True, slots=True)
+class RunConfig:
+    """Configuración validada e inmutable de una ejecución. Las colecciones son de solo lectura."""
+    preferences: MappingProxyType
+    prompts: MappingProxyType
+    categories_order: tuple
+    criteria_texts: MappingProxyType  # categoría -> texto de criterios de relevancia
+    min_relevance_scores: MappingProxyType  # categoría -> min_relevance_score
+    classification_prompt: PromptTemplate
+    classification_batch_prompt: PromptTemplate
+    classification_batch_article: PromptTemplate
+    relevance_prompt: PromptTemplate  # Sin sustituir: para categorías que no están en preferences.json
+    relevance_prompts: MappingProxyType  # categoría -> plantilla con category y criteria_text ya sustituidos
+    fused_prompt: PromptTemplate
+    fused_article: PromptTemplate
+    synthesis_prompt: PromptTemplate
+    synthesis_article: PromptTemplate
+    synthesis_map_prompt: PromptTemplate  # Síntesis jerárquica: resumen de cada lote de artículos
+    synthesis_reduce_prompt: PromptTemplate  # Síntesis jerárquica: boletín a partir de los resúmenes
+
+    @property
+    def global_prefs(self):
+        return self.preferences.get('global', MappingProxyType({}))
+
+    @property
+    def categories_prefs(self):
+        return self.preferences.get('categories', MappingProxyType({}))
+
+    def category_prefs(self, category):
+        return self.categories_prefs.get(category, MappingProxyType({}))
+
+    def criteria_text(self, category):
+        if category in self.criteria_texts:
+            return self.criteria_texts[category]
+        return _build_criteria_text(self.prompts, category, {})
+
+    def min_relevance_score(self, category):
+        return self.min_relevance_scores.get(category, 0.5)
+
+    def max_articles_per_category(self, category):
+        """Máximo de artículos de `category` en la edición diaria (preferencia de la categoría o global)."""
+        return self.category_prefs(category).get(
+            'max_articles_per_category',
+            self.global_prefs.get('max_articles_per_category', config.MAX_ARTICLES_PER_CATEGORY_DEFAULT))
+
+    def content_token_budget(self, stage):
+        """Tokens de contenido por artículo (o en total, para 'synthesis') en los prompts de `stage`."""
+        key, legacy_chars_key, default = CONTENT_TOKEN_BUDGETS[stage]
+        if key in self.global_prefs:
+            return self.global_prefs[key]
+        if legacy_chars_key in self.global_prefs:
+            return max(1, self.global_prefs[legacy_chars_key] // CHARS_PER_TOKEN)
+        return default
+
+    def relevance_prompt_for(self, category):
+        """Plantilla de relevancia de `category` con solo title y short_content pendientes."""
+        if category in self.relevance_prompts:
+            return self.relevance_prompts[category]
+        if self.relevance_prompt is None:
+            return None
+        return self.relevance_prompt.partial(category=category, criteria_text=self.criteria_text(category))
+
+
+def load_run_config():
+    """Lee y valida preferences.json y prompts.json y compila las plantillas. Devuelve un RunConfig nuevo."""
+    prefs = _validate_preferences(_load_json(config.PREFERENCES_FILE, "preferencias"))
+    prompts = _load_json(config.PROMPTS_FILE, "prompts")
+
+    categories_prefs = prefs.get('categories', {})
+    categories_order = prefs['global'].get("categories_order", list(categories_prefs.keys())) or ["General"]
+    # Los criterios se formatean con las preferencias originales (listas), igual que antes de la instantánea
+    criteria_texts = {category: _build_criteria_text(prompts, category, categories_prefs.get(category, {}))
+                      for category in dict.fromkeys([*categories_order, *categories_prefs])}
+    min_relevance_scores = {}
+    for category in criteria_texts:
+        try:
+            min_relevance_scores[category] = float(categories_prefs.get(category, {}).get('min_relevance_score', 0.5))
+        except (TypeError, ValueError):
+            logger.error(f"min_relevance_score no válido para '{category}'. Se usa 0.5.")
+            min_relevance_scores[category] = 0.5
+    categories_list_text = ", ".join(f"'{c}'" for c in categories_order)
+
+    classification_prompt = _compile_prompt(prompts, "classification", "default")
+    classification_batch_prompt = _compile_prompt(prompts, "classification", "batch")
+    relevance_prompt = _compile_prompt(prompts, "relevance", "base")
+    fused_prompt = _compile_prompt(prompts, "fused", "batch")
+    criteria_section = "\n".join(
+        f"Categoría '{category}' (puntuación mínima {min_relevance_scores[category]}):\n{criteria_texts[category]}"
+        for category in categories_order)
+
+    return RunConfig(
+        preferences=_freeze(prefs),
+        prompts=_freeze(prompts),
+        categories_order=tuple(categories_order),
+        criteria_texts=MappingProxyType(criteria_texts),
+        min_relevance_scores=MappingProxyType(min_relevance_scores),
+        classification_prompt=classification_prompt and classification_prompt.partial(
+            categories_list=categories_list_text),
+        classification_batch_prompt=classification_batch_prompt and classification_batch_prompt.partial(
+            categories_list=categories_list_text),
+        classification_batch_article=_compile_prompt(prompts, "classification", "batch_article_template"),
+        relevance_prompt=relevance_prompt,
+        relevance_prompts=MappingProxyType({} if relevance_prompt is None else {
+            category: relevance_prompt.partial(category=category, criteria_text=criteria_texts[category])
+            for category in criteria_texts}),
+        fused_prompt=fused_prompt and fused_prompt.partial(categories_list=categories_list_text,
+                                                           criteria_section=criteria_section),
+        fused_article=_compile_prompt(prompts, "fused", "article_template"),
+        synthesis_prompt=_compile_prompt(prompts, "synthesis", "default"),
+        synthesis_article=_compile_prompt(prompts, "synthesis", "article_template"),
+        synthesis_map_prompt=_compile_prompt(prompts, "synthesis", "map"),
+        synthesis_reduce_prompt=_compile_prompt(prompts, "synthesis", "reduce"),
+    )
+
+
+_run_config = None
+_run_config_lock = threading.Lock()
+
+
+def get_run_config():
+    """Instantánea de la ejecución actual (se carga la primera vez que se pide)."""
+    global _run_config
+    if _run_config is None:
+        with _run_config_lock:
+            if _run_config is None:
+                _run_config = load_run_config()
+    return _run_config
+
+
+def reload_run_config():
+    """Relee preferences.json y prompts.json (procesos de larga duración). Devuelve la nueva instantánea."""
+    global _run_config
+    new_config = load_run_config()
+    with _run_config_lock:
+        _run_config = new_config
+    logger.info("Configuración recargada.")
+    return new_config
@@ -0,0 +1,205 @@
+import heapq
+import itertools
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timezone
+from .. import config
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+# Planificación de las llamadas al LLM del clasificador:
+# - Los candidatos se ordenan por una prioridad barata (recencia, peso de la fuente y confianza del
+#   clasificador local) dentro de una ventana (heap) de tamaño acotado, sin renunciar al streaming.
+# - Se lleva la cuenta del hueco que queda en cada categoría (max_articles_per_category), para no
+#   gastar llamadas en artículos que no cabrían: la relevancia se comprueba por oleadas (decide_in_waves).
+# - Se aplica un presupuesto máximo de llamadas y tokens por ejecución (max_llm_calls_per_run y
+#   max_llm_tokens_per_run en preferences.json; 0 = sin límite). El límite lo hace cumplir el ejecutor LLM
+#   en cada llamada del clasificador (el presupuesto se le pasa explícitamente, ver llm_executor.execute_prompt),
+#   sean llamadas por lotes, fusionadas o reintentos.
+
+RECENCY_HALF_LIFE_HOURS = 24.0
+# Los artículos con decisión ya conocida (include_always, vistos antes) no cuestan llamadas: van primero
+FREE_PRIORITY = math.inf
+
+_stats = {"full": 0, "budget": 0}
+_stats_lock = threading.Lock()
+
+
+def article_priority(article, local_confidence=0.0, now=None):
+    """Prioridad de un candidato: peso de la fuente x decaimiento por antigüedad x (0.5 + 0.5 x confianza local)."""
+    now = now or datetime.now(timezone.utc)
+    recency = 0.5
+    if article.published_date:
+        try:
+            published = datetime.fromisoformat(article.published_date)
+            if published.tzinfo is None:
+                published = published.replace(tzinfo=timezone.utc)
+            age_hours = max(0.0, (now - published).total_seconds() / 3600)
+            recency = 0.5 ** (age_hours / RECENCY_HALF_LIFE_HOURS)
+        except ValueError:
+            pass
+    return article.source.priority_weight * recency * (0.5 + 0.5 * local_confidence)
+
+
+class CandidateQueue:
+    """Heap de candidatos por prioridad (desempate por orden de llegada, para que el resultado sea determinista)."""
+
+    def __init__(self):
+        self._heap = []
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, priority, item):
+        heapq.heappush(self._heap, (-priority, next(self._sequence), item))
+
+    def pop_many(self, count):
+        return [heapq.heappop(self._heap)[2] for _ in range(min(count, len(self._heap)))]
+
+    def run(self, candidates, process_batch, flush_size, window, max_wait=None):
+        """
+        Encola `candidates` (iterable de (prioridad, elemento)) según llegan y llama a process_batch(elementos)
+        con los `flush_size` más prioritarios cada vez que la cola alcanza `window` elementos o han pasado
+        `max_wait` segundos desde el último envío (para no esperar a la ventana mientras llega el resto).
+        Al agotarse `candidates` se vacía la cola.
+        """
+        last_flush = time.monotonic()
+        for priority, item in candidates:
+            self.push(priority, item)
+            if len(self) >= window or (max_wait is not None and time.monotonic() - last_flush >= max_wait):
+                process_batch(self.pop_many(flush_size))
+                last_flush = time.monotonic()
+        while self._heap:
+            process_batch(self.pop_many(flush_size))
+
+
+class CategoryCapacity:
+    """Hueco restante en cada categoría según max_articles_per_category."""
+
+    def __init__(self, limits):
+        self.limits = limits  # categoría -> máximo de artículos
+        self.used = {}
+
+    def remaining(self, category):
+        return max(0, self.limits(category) - self.used.get(category, 0))
+
+    def is_full(self, category):
+        return self.remaining(category) <= 0
+
+    def take(self, category):
+        self.used[category] = self.used.get(category, 0) + 1
+
+
+class LLMBudget:
+    """
+    Presupuesto de llamadas y tokens para esta ejecución (thread-safe). El ejecutor LLM reserva cada llamada
+    antes de hacerla (reserve) y ajusta después los tokens reales (settle); ver llm_executor.execute_prompt.
+    """
+
+    def __init__(self, max_calls=0, max_tokens=0):
+        self.max_calls = max_calls
+        self.max_tokens = max_tokens
+        self.calls = 0
+        self.tokens = 0
+        self.warned = False
+        self.lock = threading.Lock()
+
+    def used(self):
+        with self.lock:
+            return self.calls, self.tokens
+
+    def reserve(self, estimated_tokens):
+        """Reserva una llamada de unos `estimated_tokens` de entrada. False si ya no cabe en el presupuesto."""
+        with self.lock:
+            if ((self.max_calls and self.calls >= self.max_calls) or
+                    (self.max_tokens and self.tokens + estimated_tokens > self.max_tokens)):
+                self._warn()
+                return False
+            self.calls += 1
+            self.tokens += estimated_tokens
+            return True
+
+    def settle(self, estimated_tokens, used_tokens):
+        """Sustituye la estimación de una llamada reservada por los tokens realmente usados (entrada + salida)."""
+        with self.lock:
+            self.tokens += used_tokens - estimated_tokens
+
+    def exhausted(self):
+        with self.lock:
+            exhausted = ((self.max_calls and self.calls >= self.max_calls) or
+                         (self.max_tokens and self.tokens >= self.max_tokens))
+            if exhausted:
+                self._warn()
+            return bool(exhausted)
+
+    def _warn(self):
+        if not self.warned:
+            logger.warning(f"Presupuesto de LLM agotado ({self.calls} llamadas, {self.tokens} tokens). "
+                           f"El resto de candidatos no se enviará al LLM en esta ejecución.")
+            self.warned = True
+
+
+def decide_in_waves(candidates, category_of, decide_wave, capacity=None, budget=None):
+    """
+    Decide `candidates` (en orden de prioridad) por oleadas: en cada categoría (category_of(candidato)) solo
+    se envían tantos candidatos como huecos le quedan según `capacity`; si alguno resulta irrelevante, la
+    siguiente oleada toma los siguientes. decide_wave(oleada) devuelve, alineado con la oleada,
+    (categoría, relevante, decidido) o None si el presupuesto no permitió decidirlo.
+    Devuelve {candidato: decisión} con los candidatos decididos.
+    """
+    decisions = {}
+    remaining = {}
+    undecided = list(candidates)
+    while undecided:
+        if budget is not None and budget.exhausted():
+            record_skipped("budget", len(undecided))
+            break
+        wave, rest, quota = [], [], {}
+        for candidate in undecided:
+            category = category_of(candidate)
+            if capacity is not None:
+                if category not in remaining:
+                    remaining[category] = capacity.remaining(category)
+                quota.setdefault(category, remaining[category])
+                if quota[category] <= 0:
+                    rest.append(candidate)
+                    continue
+                quota[category] -= 1
+            wave.append(candidate)
+        if not wave:
+            record_skipped("full", len(rest))
+            break
+        for candidate, decision in zip(wave, decide_wave(wave)):
+            if decision is None:
+                record_skipped("budget")
+                continue
+            decisions[candidate] = decision
+            if decision[1] and capacity is not None:
+                remaining[category_of(candidate)] -= 1
+        undecided = rest
+    return decisions
+
+
+def record_skipped(reason, count=1):
+    """Cuenta candidatos descartados sin decidir: 'full' (categoría llena) o 'budget' (presupuesto agotado)."""
+    with _stats_lock:
+        _stats[reason] += count
+
+
+def get_scheduler_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def log_scheduler_stats(budget=None):
+    stats = get_scheduler_stats()
+    message = (f"Planificador: {stats['full']} candidatos descartados por categoría llena y "
+               f"{stats['budget']} por presupuesto agotado")
+    if budget is not None:
+        calls, tokens = budget.used()
+        message += f"; consumo de esta ejecución: {calls} llamadas y {tokens} tokens"
+    logger.info(message + ".")
@@ -0,0 +1,43 @@
+import logging
+from datetime import datetime, timezone
+from .. import config
+from .storage import load_json_state, prune_json_state, save_json_state
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+# Índice persistente de artículos ya clasificados en ejecuciones anteriores.
+# Formato en disco: {article_id: {"category": str, "relevant": bool, "seen_at": iso8601}}
+# Permite que las re-ejecuciones (workflow_dispatch, ventanas solapadas, feeds que re-fechan
+# entradas antiguas) reutilicen la decisión previa en lugar de volver a pagar las llamadas al LLM.
+
+
+def load_seen_index():
+    return load_json_state(config.SEEN_INDEX_FILE, "Índice de artículos vistos")
+
+
+def prune_seen_index(index, max_age_days=None):
+    """Elimina en el sitio las entradas más antiguas que `max_age_days`. Devuelve cuántas se eliminaron."""
+    max_age_days = config.SEEN_INDEX_MAX_AGE_DAYS if max_age_days is None else max_age_days
+    return prune_json_state(index, 'seen_at', max_age_days)
+
+
+def save_seen_index(index):
+    save_json_state(config.SEEN_INDEX_FILE, index, 'seen_at', config.SEEN_INDEX_MAX_AGE_DAYS,
+                    "Índice de artículos vistos")
+
+
+def lookup_seen_article(index, article_id):
+    """Devuelve (categoría, relevante) si el artículo ya se procesó, o None."""
+    entry = index.get(article_id)
+    if not entry:
+        return None
+    return entry.get('category'), bool(entry.get('relevant'))
+
+
+def record_seen_article(index, article_id, category, relevant):
+    index[article_id] = {
+        "category": category,
+        "relevant": relevant,
+        "seen_at": datetime.now(timezone.utc).isoformat(),
+    }
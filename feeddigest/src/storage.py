@@ -0,0 +1,81 @@
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from .. import config
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+
+def load_json_file(path, default=None):
+    """Carga un JSON de estado. Si no existe o está corrupto devuelve `default` (un dict vacío por defecto)."""
+    if default is None:
+        default = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except (json.JSONDecodeError, OSError) as e:
+        logger.error(f"No se pudo leer el archivo de estado {path}: {e}. Se empieza desde cero.")
+        return default
+
+
+def save_json_file(path, data, indent=2):
+    """
+    Guarda `data` como JSON de forma atómica (archivo temporal + rename),
+    para que una ejecución interrumpida nunca deje un estado a medio escribir.
+    Con indent=None el archivo se escribe compacto.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=indent, ensure_ascii=False, sort_keys=True)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.error(f"No se pudo guardar el archivo de estado {path}: {e}")
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+
+# --- Estado persistente con caducidad: {clave: {..., timestamp_key: iso8601}} ---
+def load_json_state(path, description):
+    """Carga un estado {clave: entrada}. Si no es un objeto JSON se ignora y se devuelve {}."""
+    state = load_json_file(path)
+    if not isinstance(state, dict):
+        logger.warning(f"{description}: formato inesperado en {path}. Se ignora.")
+        return {}
+    return state
+
+
+def prune_json_state(state, timestamp_key, max_age_days):
+    """
+    Elimina en el sitio las entradas cuyo `timestamp_key` es más antiguo que `max_age_days`.
+    Devuelve cuántas se eliminaron.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=max_age_days)
+    expired = []
+    for key, entry in state.items():
+        try:
+            if datetime.fromisoformat(entry[timestamp_key]) < cutoff:
+                expired.append(key)
+        except (KeyError, TypeError, ValueError):
+            expired.append(key)  # Entrada corrupta: mejor olvidarla
+    for key in expired:
+        del state[key]
+    return len(expired)
+
+
+def save_json_state(path, state, timestamp_key, max_age_days, description, indent=None):
+    """Poda las entradas caducadas (ver prune_json_state) y guarda el estado de forma atómica."""
+    removed = prune_json_state(state, timestamp_key, max_age_days)
+    if removed:
+        logger.info(f"{description}: {removed} entradas caducadas eliminadas.")
+    save_json_file(path, state, indent=indent)
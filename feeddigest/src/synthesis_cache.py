@@ -0,0 +1,75 @@
+import hashlib
+import json
+import logging
+from datetime import datetime, timezone
+from .. import config
+from .storage import load_json_state, prune_json_state, save_json_state
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+# Síntesis ya generadas de cada categoría, indexadas por una huella de sus entradas (artículos en orden
+# con el hash de su contenido, prompts, preferencias de síntesis y modelo). Si una re-ejecución
+# (workflow_dispatch, arreglo de plantillas, una fuente que vuelve tras fallar) produce la misma huella,
+# se reutiliza la síntesis en lugar de volver a llamar al LLM. Se guarda en data/state para que persista
+# entre ejecuciones del workflow.
+# Formato en disco: {huella: {"category": str, "items": [bloques de síntesis], "created_at": iso8601}}
+
+# Preferencias globales que cambian el prompt o el resultado de la síntesis
+SYNTHESIS_PREFERENCE_KEYS = ("max_tokens_for_synthesis_articles", "max_tokens_per_synthesis_article",
+                             "synthesis_hierarchical_min_articles", "synthesis_chunk_size")
+
+
+def _article_fingerprint(article):
+    content = "\x1f".join([article.title or "", article.link or "", article.content_text or ""])
+    # Los casi duplicados aparecen como enlaces adicionales en los detalles de cada referencia
+    duplicates = [[d.link, d.title, d.source_name] for d in article.duplicates]
+    return [article.id, hashlib.sha256(content.encode('utf-8')).hexdigest(), duplicates]
+
+
+def synthesis_fingerprint(category_name, articles_in_category, run_config, model_id):
+    """Huella de todo lo que determina la síntesis de una categoría."""
+    payload = {
+        "category": category_name,
+        "articles": [_article_fingerprint(article) for article in articles_in_category],
+        "prompts": run_config.prompts.get("synthesis", {}),
+        "preferences": {key: run_config.global_prefs.get(key) for key in SYNTHESIS_PREFERENCE_KEYS},
+        "model": model_id,
+    }
+    serialized = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=dict)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+def load_synthesis_cache():
+    if not config.SYNTHESIS_CACHE_ENABLED:
+        return {}
+    return load_json_state(config.SYNTHESIS_CACHE_FILE, "Caché de síntesis")
+
+
+def lookup_synthesis(cache, fingerprint):
+    """Devuelve los bloques de síntesis guardados para `fingerprint`, o None."""
+    entry = cache.get(fingerprint)
+    if not isinstance(entry, dict) or not isinstance(entry.get('items'), list):
+        return None
+    return entry['items']
+
+
+def record_synthesis(cache, fingerprint, category_name, items):
+    cache[fingerprint] = {
+        "category": category_name,
+        "items": items,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def prune_synthesis_cache(cache, max_age_days=None):
+    """Elimina en el sitio las entradas más antiguas que `max_age_days`. Devuelve cuántas se eliminaron."""
+    max_age_days = config.SYNTHESIS_CACHE_MAX_AGE_DAYS if max_age_days is None else max_age_days
+    return prune_json_state(cache, 'created_at', max_age_days)
+
+
+def save_synthesis_cache(cache):
+    if not config.SYNTHESIS_CACHE_ENABLED:
+        return
+    save_json_state(config.SYNTHESIS_CACHE_FILE, cache, 'created_at', config.SYNTHESIS_CACHE_MAX_AGE_DAYS,
+                    "Caché de síntesis")
@@ -1,38 +1,28 @@
-import json
 import logging
 import re  # Para parsear referencias
-import llm  # <--- AÑADIDO
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from .. import config
+from .llm_cache import prompt_text
+from .llm_executor import get_model_concurrency, map_ordered
+from .llm_models import get_model
+from .truncation import fit_texts_to_budget
+from .run_config import get_run_config
+from .synthesis_cache import load_synthesis_cache, save_synthesis_cache, synthesis_fingerprint, lookup_synthesis, \
+    record_synthesis
+from .models import Article, SourceConfig
 
 logging.basicConfig(level=config.LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
-# --- Carga de Configuraciones --- (similar a classifier.py)
-_prompts_cache = None
+# Referencias inline a artículos: [3], o varias juntas como [1, 2]
+CITATION_RE = re.compile(r'\[(\d+(?:\s*[,;]\s*\d+)*)\]')
 
 
+# --- Carga de Configuraciones ---
 def get_prompts():
-    global _prompts_cache
-    if _prompts_cache is None:
-        try:
-            with open(config.PROMPTS_FILE, 'r', encoding='utf-8') as f:
-                _prompts_cache = json.load(f)
-        except FileNotFoundError:
-            logger.error(f"Archivo de prompts no encontrado: {config.PROMPTS_FILE}")
-            _prompts_cache = {}
-        except json.JSONDecodeError:
-            logger.error(f"Error decodificando el archivo JSON de prompts: {config.PROMPTS_FILE}")
-            _prompts_cache = {}
-    return _prompts_cache
-
-
-# --- Modelo de IA ---
-try:
-    model_synthesis = llm.get_model(config.LLM_MODEL_SYNTHESIS)
-    # model_synthesis.options.timeout = 60 # Ejemplo de timeout más largo para síntesis
-except Exception as e:
-    logger.error(f"Error al cargar modelo LLM para síntesis: {e}. La síntesis no operará correctamente.")
-    model_synthesis = None
+    """Prompts de la instantánea de configuración de la ejecución (solo lectura)."""
+    return get_run_config().prompts
 
 
 def parse_synthesis_response(response_text, original_articles):
@@ -63,8 +53,8 @@ def parse_synthesis_response(response_text, original_articles):
         if i in found_reference_indices:  # Si el artículo fue referenciado
             references_for_item.append({
                 "id": i + 1,  # Mantener ID 1-based para el template
-                "url": article['link'],
-                "title": article['title']
+                "url": article.link,
+                "title": article.title
             })
 
     # Si no se encuentran referencias explícitas en el texto pero hay artículos,
@@ -77,71 +67,158 @@ def parse_synthesis_response(response_text, original_articles):
         # Opcional, dependiendo de si se quiere siempre la lista completa.
         # for i, article in enumerate(original_articles):
         #    references_for_item.append({
-        #        "id": i + 1, "url": article['link'], "title": article['title']
+        #        "id": i + 1, "url": article.link, "title": article.title
         #    })
 
     return synthesized_text, references_for_item
 
 
-def synthesize_category_articles(articles_in_category, category_name):
-    if not model_synthesis:
+def _build_articles_section(articles, article_template, run_config):
+    """Sección de artículos de un prompt de síntesis, numerados desde 1, dentro del presupuesto de tokens."""
+    # El presupuesto de tokens del prompt se reparte entre sus artículos (cortando en finales de frase)
+    contents = fit_texts_to_budget([article.content_text for article in articles],
+                                   run_config.content_token_budget("synthesis"),
+                                   run_config.content_token_budget("synthesis_article"))
+    return "\n\n".join(article_template.format(index=i + 1, title=article.title, content=content, url=article.link)
+                        for i, (article, content) in enumerate(zip(articles, contents)))
+
+
+def _remap_citations(text, offset, count):
+    """
+    Convierte las referencias [k] (1..count) de un lote en [offset + k]; separa las múltiples ([1, 2] -> [1][2])
+    y elimina las que no corresponden a ningún artículo del lote.
+    """
+    def replacer(match):
+        numbers = (int(number) for number in re.findall(r'\d+', match.group(1)))
+        return "".join(f"[{offset + number}]" for number in numbers if 1 <= number <= count)
+    return CITATION_RE.sub(replacer, text)
+
+
+def _use_hierarchical_synthesis(num_articles, run_config):
+    min_articles = run_config.global_prefs.get('synthesis_hierarchical_min_articles', 0)
+    chunk_size = run_config.global_prefs.get('synthesis_chunk_size', 8)
+    return (bool(min_articles) and num_articles >= min_articles and 0 < chunk_size < num_articles and
+            run_config.synthesis_map_prompt is not None and run_config.synthesis_reduce_prompt is not None)
+
+
+def _synthesize_hierarchical(model, articles_in_category, category_name, run_config, on_chunk=None, on_start=None):
+    """
+    Síntesis map-reduce de una categoría grande: los artículos se dividen en lotes de synthesis_chunk_size que
+    se resumen en paralelo (con referencias locales [1..k]), las referencias se renumeran a la numeración global
+    de la categoría y un último prompt combina los resúmenes en el boletín (en streaming si se pasa `on_chunk`).
+    Devuelve (texto, completa); completa es False si algún lote o la combinación usaron un fallback.
+    """
+    chunk_size = run_config.global_prefs.get('synthesis_chunk_size', 8)
+    chunks = [(start, articles_in_category[start:start + chunk_size])
+              for start in range(0, len(articles_in_category), chunk_size)]
+
+    failed_chunks = []
+
+    def summarize_chunk(chunk):
+        offset, chunk_articles = chunk
+        prompt = run_config.synthesis_map_prompt.format(
+            category=category_name,
+            articles_section=_build_articles_section(chunk_articles, run_config.synthesis_article, run_config))
+        try:
+            notes = prompt_text(model, prompt, on_start=on_start).strip()
+        except Exception as e:
+            logger.error(f"Error resumiendo el lote {offset // chunk_size + 1} de '{category_name}': {e}. "
+                         f"Se usan sus títulos.")
+            notes = ""
+        if not notes:
+            failed_chunks.append(offset)
+            # Sin resumen del lote, el boletín aún puede citar sus artículos por el título
+            notes = "\n".join(f"- {article.title} [{i + 1}]" for i, article in enumerate(chunk_articles))
+        return _remap_citations(notes, offset, len(chunk_articles))
+
+    summaries = map_ordered(summarize_chunk, chunks, max_workers=get_model_concurrency(model))
+    summaries_section = "\n\n".join(
+        f"Lote {i + 1} (artículos {start + 1}-{start + len(chunk_articles)}):\n{summary}"
+        for i, ((start, chunk_articles), summary) in enumerate(zip(chunks, summaries)))
+    prompt = run_config.synthesis_reduce_prompt.format(category=category_name, summaries_section=summaries_section)
+    try:
+        text = prompt_text(model, prompt, on_chunk=on_chunk, on_start=on_start)
+        return _remap_citations(text, 0, len(articles_in_category)), not failed_chunks
+    except Exception as e:
+        logger.error(f"Error combinando los resúmenes de '{category_name}': {e}. Se publican los resúmenes por lotes.")
+        return "\n".join(summaries), False
+
+
+def _article_details(articles_in_category):
+    """Detalles de las referencias [n] de una categoría para la plantilla (IDs 1-based)."""
+    return [{
+        "id": i + 1,
+        "url": article.link,
+        "title": article.title,
+        # La misma noticia publicada por otras fuentes (casi duplicados agrupados antes de clasificar)
+        "also_reported_by": [{"url": d.link, "title": d.title, "source_name": d.source_name}
+                             for d in article.duplicates]
+    } for i, article in enumerate(articles_in_category)]
+
+
+def synthesize_category_articles(articles_in_category, category_name, run_config=None):
+    return _synthesize_category_articles(articles_in_category, category_name, run_config)[0]
+
+
+def _synthesize_category_articles(articles_in_category, category_name, run_config=None, on_progress=None,
+                                  on_start=None):
+    """
+    Devuelve (bloques, sintetizada_por_ia). sintetizada_por_ia es False cuando se usó un fallback.
+    Con `on_progress`, la respuesta del LLM se recibe en streaming y se llama a on_progress(categoría, bloques)
+    con el texto parcial cada vez que llega un fragmento (desde el hilo que sintetiza la categoría).
+    `on_start()` se llama cada vez que empieza una llamada al modelo (ver llm_cache.prompt_text).
+    """
+    model = get_model("synthesis")
+    if not model:
         logger.warning(f"Modelo de síntesis no disponible para '{category_name}'. Se listarán títulos como fallback.")
         # Fallback simple
-        items = []
-        for i, article in enumerate(articles_in_category):
-            items.append({
-                "text_with_placeholders": f"{article['title']}. (Contenido no sintetizado por IA)",
-                "original_articles_details": [{"id": j + 1, "url": art['link'], "title": art['title']} for j, art in
-                                              enumerate(articles_in_category)]
-            })
-        return items
+        return _title_fallback_items(articles_in_category, "Contenido no sintetizado por IA"), False
 
     if not articles_in_category:
-        return []
+        return [], False
 
-    prompts = get_prompts()
-    prompt_template = prompts.get("synthesis", {}).get("default")
-    article_template = prompts.get("synthesis", {}).get("article_template")
+    run_config = run_config or get_run_config()
+    prompt_template = run_config.synthesis_prompt
+    article_template = run_config.synthesis_article
 
     if not prompt_template or not article_template:
         logger.error(f"No se encontraron plantillas de prompt para síntesis en '{category_name}'. Listando títulos.")
         # Fallback (igual que arriba)
-        items = []
-        for i, article in enumerate(articles_in_category):
-            items.append({
-                "text_with_placeholders": f"{article['title']}. (Contenido no sintetizado por falta de prompt)",
-                "original_articles_details": [{"id": j + 1, "url": art['link'], "title": art['title']} for j, art in
-                                              enumerate(articles_in_category)]
-            })
-        return items
-
-    articles_section_parts = []
-    original_articles_details_for_template = []  # Para pasar al template
-    for i, article in enumerate(articles_in_category):
-        content_for_synthesis = article['content_text'][:1000]
-        articles_section_parts.append(
-            article_template.format(index=i + 1, title=article['title'], content=content_for_synthesis,
-                                    url=article['link'])
-        )
-        original_articles_details_for_template.append({
-            "id": i + 1,  # ID 1-based para el template
-            "url": article['link'],
-            "title": article['title']
-        })
+        return _title_fallback_items(articles_in_category, "Contenido no sintetizado por falta de prompt"), False
 
-    articles_section_str = "\n\n".join(articles_section_parts)
+    original_articles_details_for_template = _article_details(articles_in_category)  # Para pasar al template
 
-    prompt = prompt_template.format(
-        category=category_name,
-        articles_section=articles_section_str
-    )
+    on_chunk = None
+    if on_progress is not None:
+        received = []
 
-    logger.info(
-        f"Sintetizando (IA) para categoría '{category_name}' con {len(articles_in_category)} artículos (esperando refs inline)...")
+        def on_chunk(chunk):
+            received.append(chunk)
+            on_progress(category_name, [{
+                "text_with_placeholders": "".join(received),
+                "original_articles_details": original_articles_details_for_template
+            }])
+
+    hierarchical = _use_hierarchical_synthesis(len(articles_in_category), run_config)
+    if hierarchical:
+        logger.info(f"Sintetizando (IA, por lotes) para categoría '{category_name}' con "
+                    f"{len(articles_in_category)} artículos...")
+    else:
+        prompt = prompt_template.format(
+            category=category_name,
+            articles_section=_build_articles_section(articles_in_category, article_template, run_config)
+        )
+        logger.info(
+            f"Sintetizando (IA) para categoría '{category_name}' con {len(articles_in_category)} artículos (esperando refs inline)...")
 
     try:
-        response = model_synthesis.prompt(prompt)
-        synthesized_text_with_placeholders = response.text().strip()
+        if hierarchical:
+            synthesized_text_with_placeholders, complete = _synthesize_hierarchical(
+                model, articles_in_category, category_name, run_config, on_chunk, on_start)
+            synthesized_text_with_placeholders = synthesized_text_with_placeholders.strip()
+        else:
+            synthesized_text_with_placeholders, complete = prompt_text(model, prompt, on_chunk=on_chunk,
+                                                                       on_start=on_start).strip(), True
 
         if not synthesized_text_with_placeholders:
             logger.warning(f"IA devolvió síntesis vacía para '{category_name}'.")
@@ -149,13 +226,13 @@ def synthesize_category_articles(articles_in_category, category_name):
             return [{
                 "text_with_placeholders": "(Síntesis de IA vacía)",
                 "original_articles_details": original_articles_details_for_template
-            }]
+            }], False
 
         # El texto ya tiene [1], [2], etc. El template se encargará de reemplazarlos.
         return [{
             "text_with_placeholders": synthesized_text_with_placeholders,
             "original_articles_details": original_articles_details_for_template  # Pasar todos los detalles
-        }]
+        }], complete
 
     except Exception as e:
         logger.error(f"Error en llamada a LLM para síntesis de '{category_name}': {e}. Listando títulos.")
@@ -163,54 +240,165 @@ def synthesize_category_articles(articles_in_category, category_name):
         items = []
         for i, article in enumerate(articles_in_category):  # Usar un bucle diferente para el fallback
             items.append({
-                "text_with_placeholders": f"{article['title']}. (Error durante la síntesis por IA: {str(e)[:100]})",
+                "text_with_placeholders": f"{article.title}. (Error durante la síntesis por IA: {str(e)[:100]})",
                 # Limitar longitud del error
                 "original_articles_details": original_articles_details_for_template
             })
-        return items
+        return items, False
 
-def synthesize_data(classified_articles):
-    synthesized_content = {}
-    prefs = {}
-    try:
-        with open(config.PREFERENCES_FILE, 'r', encoding='utf-8') as f: # Corrección aquí
-            prefs = json.load(f)
-    except Exception:
-        logger.warning("No se pudo cargar preferences.json para el sintetizador (orden de categorías).")
 
-    categories_order = prefs.get("global", {}).get("categories_order", list(classified_articles.keys()))
+def _title_fallback_items(articles_in_category, reason):
+    """Fallback de una categoría sin síntesis: un bloque por artículo con su título."""
+    details = _article_details(articles_in_category)
+    return [{"text_with_placeholders": f"{article.title}. ({reason})", "original_articles_details": details}
+            for article in articles_in_category]
+
+
+def _synthesize_categories_concurrent(tasks, run_config, max_workers, category_timeout, on_progress=None,
+                                      on_category_ready=None):
+    """
+    Sintetiza las categorías de `tasks` ({categoría: artículos}) con un pool de hilos acotado.
+    Devuelve {categoría: (bloques, sintetizada_por_ia)}; on_category_ready(categoría, bloques) se llama (en este
+    hilo) en cuanto cada categoría termina.
+    Cada categoría dispone de `category_timeout` segundos de reloj desde su primera llamada al modelo (el tiempo
+    esperando hilo, hueco de concurrencia o cuota no cuenta); si se superan, se usa el fallback de títulos (el
+    hilo no se puede interrumpir, pero su resultado se ignora). Mientras los hilos abandonados ocupen todo el
+    pool, las categorías que aún no han empezado cuentan su tiempo desde ese momento, para no esperarlos sin límite.
+    """
+    started_at = {}
+    waiting_since = {}  # Categorías sin empezar mientras el pool está ocupado por hilos abandonados
+    results = {}
+    abandoned = []
+
+    def run(category_name, articles_in_category):
+        def on_start():
+            started_at.setdefault(category_name, time.monotonic())
+        return _synthesize_category_articles(articles_in_category, category_name, run_config, on_progress, on_start)
+
+    def finish(category_name, result):
+        results[category_name] = result
+        if on_category_ready is not None:
+            on_category_ready(category_name, result[0])
+
+    def clock_start(category_name):
+        return started_at.get(category_name, waiting_since.get(category_name))
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="synthesis")
+    futures = {executor.submit(run, category_name, articles): category_name
+               for category_name, articles in tasks.items()}
+    pending = set(futures)
+    try:
+        while pending:
+            now = time.monotonic()
+            deadlines = [clock_start(futures[f]) + category_timeout for f in pending
+                         if clock_start(futures[f]) is not None]
+            wait_timeout = max(0.0, min(deadlines) - now) if deadlines else category_timeout
+            done, pending = wait(pending, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                category_name = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error(f"Error inesperado sintetizando '{category_name}': {e}. Listando títulos.")
+                    result = (_title_fallback_items(tasks[category_name], "Error durante la síntesis por IA"), False)
+                finish(category_name, result)
+
+            now = time.monotonic()
+            for future in list(pending):
+                category_name = futures[future]
+                clock = clock_start(category_name)
+                if clock is not None and now - clock >= category_timeout:
+                    logger.error(f"Tiempo agotado ({category_timeout}s) sintetizando '{category_name}'. Listando títulos.")
+                    future.cancel()
+                    pending.discard(future)
+                    abandoned.append(future)
+                    finish(category_name, (_title_fallback_items(tasks[category_name],
+                                                                 "Síntesis por IA no completada a tiempo"), False))
+            if sum(not future.done() for future in abandoned) >= max_workers:
+                for future in pending:
+                    waiting_since.setdefault(futures[future], now)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
+
+
+def synthesize_data(classified_articles, run_config=None, max_workers=None, category_timeout=None,
+                    on_progress=None, on_category_ready=None):
+    """
+    Sintetiza cada categoría con artículos. Las categorías se sintetizan en paralelo (hasta max_workers,
+    por defecto config.SYNTHESIS_MAX_WORKERS y como mucho la concurrencia del modelo de síntesis), pero el
+    resultado sigue el orden de categories_order. Las categorías cuyas entradas no han cambiado desde una
+    ejecución anterior reutilizan su síntesis (ver synthesis_cache).
+    Para publicar la página a medida que avanza la síntesis (ver generator.ProgressiveNewsletter):
+    on_category_ready(categoría, bloques) se llama en cuanto una categoría está lista (las reutilizadas, al
+    principio) y on_progress(categoría, bloques_parciales) con el texto recibido en streaming.
+    """
+    run_config = run_config or get_run_config()
+    categories_order = list(run_config.global_prefs.get("categories_order", classified_articles.keys()))
+    max_workers = config.SYNTHESIS_MAX_WORKERS if max_workers is None else max_workers
+    category_timeout = config.SYNTHESIS_CATEGORY_TIMEOUT if category_timeout is None else category_timeout
 
     for cat_name in classified_articles.keys():
         if cat_name not in categories_order:
             categories_order.append(cat_name)
 
+    model = get_model("synthesis")
+    model_id = getattr(model, 'model_id', None) or config.LLM_MODEL_SYNTHESIS
+    synthesis_cache = load_synthesis_cache()
+    synthesized = {}  # categoría -> bloques reutilizados de una ejecución anterior
+    fingerprints = {}
+    tasks = {}
     for category_name in categories_order:
         if category_name not in classified_articles or not classified_articles[category_name]:
             continue
-
         articles_in_category = classified_articles[category_name]
-
+        fingerprints[category_name] = synthesis_fingerprint(category_name, articles_in_category, run_config, model_id)
+        cached_items = lookup_synthesis(synthesis_cache, fingerprints[category_name]) if model else None
+        if cached_items is not None:
+            synthesized[category_name] = cached_items
+            logger.info(f"Síntesis de '{category_name}' sin cambios desde la última ejecución: se reutiliza.")
+            if on_category_ready is not None:
+                on_category_ready(category_name, cached_items)
+            continue
+        tasks[category_name] = articles_in_category
         logger.info(f"Preparando para sintetizar {len(articles_in_category)} artículos para la categoría: {category_name}")
-        synthesized_items = synthesize_category_articles(articles_in_category, category_name)
-        synthesized_content[category_name] = synthesized_items
 
-    return synthesized_content
+    # Más hilos que llamadas simultáneas al modelo solo harían esperar al semáforo del ejecutor LLM.
+    # Con un solo hilo se usa igualmente el pool, para aplicar el mismo límite de tiempo por categoría.
+    max_workers = max(1, min(max_workers, len(tasks), get_model_concurrency(model)))
+    start_time = time.monotonic()
+    results = {}
+    if tasks:
+        results = _synthesize_categories_concurrent(tasks, run_config, max_workers, category_timeout,
+                                                    on_progress, on_category_ready)
+        logger.info(f"Síntesis de {len(tasks)} categorías completada en {time.monotonic() - start_time:.1f}s "
+                    f"({max_workers} en paralelo); {len(synthesized)} reutilizadas.")
+
+    for category_name, (items, synthesized_by_ia) in results.items():
+        synthesized[category_name] = items
+        if synthesized_by_ia:  # Los fallbacks no se guardan: se reintentan en la siguiente ejecución
+            record_synthesis(synthesis_cache, fingerprints[category_name], category_name, items)
+    if results:
+        save_synthesis_cache(synthesis_cache)
+
+    return {category_name: synthesized[category_name] for category_name in fingerprints}
 
 
 if __name__ == '__main__':
+    sample_source = SourceConfig(url="http://example.com/rss", name="Ejemplo")
     sample_classified_articles = {
         "Tecnología": [
-            {"title": "Avance en IA Genial",
-             "content_text": "Una nueva IA puede escribir código y poemas. Es un gran avance para la humanidad y cambiará todo.",
-             "link": "http://example.com/ia", "id": "ia1"},
-            {"title": "Python 4.0 Anunciado Oficialmente",
-             "content_text": "La Python Software Foundation anuncia Python 4.0 con mejoras en rendimiento y nuevas librerías estándar. La comunidad está expectante.",
-             "link": "http://example.com/py4", "id": "py1"}
+            Article(id="ia1", title="Avance en IA Genial",
+                    content_text="Una nueva IA puede escribir código y poemas. Es un gran avance para la humanidad y cambiará todo.",
+                    link="http://example.com/ia", published_date=None, source=sample_source),
+            Article(id="py1", title="Python 4.0 Anunciado Oficialmente",
+                    content_text="La Python Software Foundation anuncia Python 4.0 con mejoras en rendimiento y nuevas librerías estándar. La comunidad está expectante.",
+                    link="http://example.com/py4", published_date=None, source=sample_source)
         ],
         "Deportes": [
-            {"title": "Final de Copa Emocionante",
-             "content_text": "El equipo local ganó la final en un partido no apto para cardíacos. Hubo goles y mucha tensión hasta el último minuto.",
-             "link": "http://example.com/game1", "id": "game1"}
+            Article(id="game1", title="Final de Copa Emocionante",
+                    content_text="El equipo local ganó la final en un partido no apto para cardíacos. Hubo goles y mucha tensión hasta el último minuto.",
+                    link="http://example.com/game1", published_date=None, source=sample_source)
         ]
     }
     # Asegúrate de tener `llm` instalado y un modelo configurado (ej. `llm install llm-gpt4all` y luego `llm -m gpt4all-j Llama-2-7B-Chat-GGML`)
@@ -218,7 +406,7 @@ if __name__ == '__main__':
     # y ajustar LLM_MODEL_SYNTHESIS en config.py a un modelo disponible.
     # Para prueba sin API real, puedes temporalmente hacer que los modelos en config.py sean alias de un modelo local que tengas.
 
-    if not model_synthesis:
+    if not get_model("synthesis"):
         print("ADVERTENCIA: Modelo de síntesis no cargado. La prueba será limitada.")
 
     synthesized = synthesize_data(sample_classified_articles)
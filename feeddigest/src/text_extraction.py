@@ -0,0 +1,81 @@
+import logging
+from html.parser import HTMLParser
+from .. import config
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+# Extracción de texto plano a partir del HTML de los feeds.
+# El backend "fast" recorre el HTML en streaming con html.parser de la stdlib, sin construir árbol;
+# "bs4" es el comportamiento original (BeautifulSoup + get_text) y queda como fallback.
+# Ambos producen la misma salida que BeautifulSoup(html, 'html.parser').get_text(separator=' ', strip=True).
+
+# Contenido que BeautifulSoup no considera texto visible en get_text()
+_SKIPPED_TAGS = frozenset({"script", "style", "template"})
+
+
+class _StreamingTextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIPPED_TAGS:
+            self._skip_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in _SKIPPED_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            stripped = data.strip()
+            if stripped:
+                self.parts.append(stripped)
+
+    def unknown_decl(self, data):
+        # BeautifulSoup sí incluye las secciones CDATA en get_text()
+        if data.startswith("CDATA[") and not self._skip_depth:
+            stripped = data[6:].strip()
+            if stripped:
+                self.parts.append(stripped)
+
+
+def html_to_text_fast(html):
+    extractor = _StreamingTextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return " ".join(extractor.parts)
+
+
+def html_to_text_bs4(html):
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(html, 'html.parser').get_text(separator=' ', strip=True)
+
+
+EXTRACTION_BACKENDS = {
+    "fast": html_to_text_fast,
+    "bs4": html_to_text_bs4,
+}
+
+
+def html_to_text(html, backend=None):
+    """
+    Convierte un fragmento HTML en texto plano con el backend configurado (config.TEXT_EXTRACTION_BACKEND).
+    Si el backend rápido falla con un HTML patológico, se recurre a BeautifulSoup.
+    """
+    if not html:
+        return ""
+    backend = backend or config.TEXT_EXTRACTION_BACKEND
+    extract = EXTRACTION_BACKENDS.get(backend)
+    if extract is None:
+        logger.warning(f"Backend de extracción de texto desconocido '{backend}'. Usando 'bs4'.")
+        extract = html_to_text_bs4
+    try:
+        return extract(html)
+    except Exception as e:
+        if extract is html_to_text_bs4:
+            raise
+        logger.warning(f"Fallo en la extracción de texto con '{backend}': {e}. Reintentando con BeautifulSoup.")
+        return html_to_text_bs4(html)
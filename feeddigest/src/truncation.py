@@ -0,0 +1,68 @@
+import re
+
+# Recorte del contenido de los artículos por presupuesto de tokens (en lugar de cortes fijos por
+# caracteres): los tokens se estiman sin llamar al proveedor, el texto se corta en el último final de
+# frase que quepa y, cuando varios artículos comparten un prompt, el presupuesto total se reparte de
+# forma equitativa (los textos cortos ceden lo que no usan a los largos).
+
+CHARS_PER_TOKEN = 4  # Aproximación para español/inglés con los tokenizadores de los proveedores habituales
+# Final de frase: . ! ? … (con comillas o paréntesis de cierre opcionales) seguido de espacio
+SENTENCE_END_RE = re.compile(r'[.!?…]+["\'»”’)\]]*(?=\s)')
+# Si el último final de frase deja fuera más de esta fracción del presupuesto, se corta por palabra
+MIN_SENTENCE_FRACTION = 0.5
+
+
+def estimate_tokens(text):
+    """Aproximación de tokens (~4 caracteres por token) cuando el proveedor no informa del uso."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN if text else 0
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Recorta `text` a unos `max_tokens` tokens, en un final de frase (o de palabra) cuando es posible."""
+    if not text or estimate_tokens(text) <= max_tokens:
+        return text or ""
+    max_chars = max(0, max_tokens) * CHARS_PER_TOKEN
+    if max_chars == 0:
+        return ""
+    window = text[:max_chars + 1]  # +1: un final de frase justo en el límite también vale
+    sentence_end = 0
+    for match in SENTENCE_END_RE.finditer(window):
+        if match.end() <= max_chars:
+            sentence_end = match.end()
+    if sentence_end >= max_chars * MIN_SENTENCE_FRACTION:
+        return text[:sentence_end]
+    word_end = window.rfind(" ", 0, max_chars + 1)
+    if word_end >= max_chars * MIN_SENTENCE_FRACTION:
+        return text[:word_end].rstrip()
+    return text[:max_chars]
+
+
+def allocate_token_budget(token_counts, total_tokens, max_tokens_per_item=None):
+    """
+    Reparto max-min del presupuesto: cada elemento recibe lo que necesita si cabe en la cuota equitativa y
+    el sobrante de los cortos se reparte entre los largos. Devuelve la cuota de tokens de cada elemento.
+    """
+    needs = [min(count, max_tokens_per_item) if max_tokens_per_item is not None else count
+             for count in token_counts]
+    budgets = [0] * len(needs)
+    remaining = max(0, total_tokens)
+    pending = sorted(range(len(needs)), key=needs.__getitem__)
+    while pending:
+        share = remaining // len(pending)
+        index = pending[0]
+        if needs[index] > share:
+            # Nadie de los pendientes cabe entero: todos reciben la cuota equitativa (el resto, a los primeros)
+            extra = remaining - share * len(pending)
+            for position, index in enumerate(sorted(pending)):
+                budgets[index] = share + (1 if position < extra else 0)
+            break
+        budgets[index] = needs[index]
+        remaining -= needs[index]
+        pending.pop(0)
+    return budgets
+
+
+def fit_texts_to_budget(texts, total_tokens, max_tokens_per_item=None):
+    """Recorta cada texto a su parte equitativa de `total_tokens` (y como mucho a `max_tokens_per_item`)."""
+    budgets = allocate_token_budget([estimate_tokens(text) for text in texts], total_tokens, max_tokens_per_item)
+    return [truncate_to_tokens(text, budget) for text, budget in zip(texts, budgets)]
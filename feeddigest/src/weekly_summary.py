@@ -3,8 +3,12 @@ import logging
 from datetime import datetime, timedelta
 import os
 from .. import config
+from .models import Article
+from .run_config import get_run_config
 from .synthesizer import synthesize_data  # Reutilizar el sintetizador
 from .generator import generate_weekly_summary_page  # Reutilizar el generador
+from .llm_executor import log_executor_stats
+from .llm_cache import log_cache_stats
 
 logging.basicConfig(level=config.LOG_LEVEL)
 logger = logging.getLogger(__name__)
@@ -18,6 +22,7 @@ def load_articles_from_history(days=7):
     """
     articles_from_week = []
     base_path = config.HISTORY_DIR
+    sources_cache = {}  # Un único SourceConfig por fuente para todos los artículos cargados
 
     for i in range(days):
         date = datetime.now() - timedelta(days=i)
@@ -25,7 +30,7 @@ def load_articles_from_history(days=7):
         if os.path.exists(history_file_path):
             try:
                 with open(history_file_path, 'r', encoding='utf-8') as f:
-                    daily_articles = json.load(f)  # Asume que es una lista de artículos
+                    daily_articles = [Article.from_dict(data, sources_cache) for data in json.load(f)]
                     articles_from_week.extend(daily_articles)
                 logger.info(f"Cargados {len(daily_articles)} artículos de {history_file_path}")
             except Exception as e:
@@ -35,7 +40,7 @@ def load_articles_from_history(days=7):
 
     # Eliminar duplicados (basado en 'id' o 'link') si es necesario, aunque no debería haber
     # si cada archivo diario es único.
-    # unique_articles = {article['id']: article for article in articles_from_week}.values()
+    # unique_articles = {article.id: article for article in articles_from_week}.values()
     # logger.info(f"Total de artículos únicos de la semana: {len(unique_articles)}")
     # return list(unique_articles)
 
@@ -44,7 +49,7 @@ def load_articles_from_history(days=7):
     return articles_from_week
 
 
-def select_weekly_highlights(all_weekly_articles, classified_articles_by_day):
+def select_weekly_highlights(all_weekly_articles, classified_articles_by_day, run_config=None):
     """
     Selecciona los "highlights" de la semana.
     Esta es una lógica placeholder. Podría ser más sofisticada:
@@ -82,24 +87,18 @@ def select_weekly_highlights(all_weekly_articles, classified_articles_by_day):
     # Agruparlos por categoría
     temp_classified = {}
     for article in all_weekly_articles:
-        category = article.get('assigned_category', 'General')
+        category = article.assigned_category or 'General'
         temp_classified.setdefault(category, []).append(article)
 
     # Luego, de cada categoría, seleccionar algunos (ej. los N más recientes o aleatorios)
     # Esta lógica es muy básica y necesita refinamiento.
-    prefs = {}
-    try:
-        with open(config.PREFERENCES_FILE, 'r', encoding='utf-8') as f:
-            prefs = json.load(f)
-    except Exception:
-        logger.warning("No se pudo cargar preferences.json para el resumen semanal.")
-
-    max_highlights_per_category = prefs.get("global", {}).get("max_articles_per_category_weekly", 3)  # Nueva config
+    run_config = run_config or get_run_config()
+    max_highlights_per_category = run_config.global_prefs.get("max_articles_per_category_weekly", 3)  # Nueva config
 
     for category, articles in temp_classified.items():
         # Ordenar por fecha (asumiendo que 'published_date' está presente y es comparable)
         # y tomar los más recientes
-        sorted_articles = sorted(articles, key=lambda x: x.get('published_date', ''), reverse=True)
+        sorted_articles = sorted(articles, key=lambda x: x.published_date or '', reverse=True)
         weekly_highlights_by_category[category] = sorted_articles[:max_highlights_per_category]
 
     logger.info(
@@ -107,11 +106,14 @@ def select_weekly_highlights(all_weekly_articles, classified_articles_by_day):
     return weekly_highlights_by_category
 
 
-def generate_weekly_summary():
+def generate_weekly_summary(run_config=None):
     """
     Función principal para generar el resumen semanal.
     """
     logger.info("Iniciando generación de resumen semanal...")
+    # Instantánea de configuración única para toda la ejecución (selección, síntesis y página)
+    run_config = run_config or get_run_config()
+    config.ensure_directories()
 
     # 1. Cargar artículos de la semana.
     #    Esto asume que main.py guarda los artículos *filtrados y categorizados* diariamente.
@@ -135,26 +137,19 @@ def generate_weekly_summary():
     #    Por ahora, simplemente agrupamos los artículos ya categorizados.
     highlights_by_category = {}
     for article in weekly_processed_articles:
-        category = article.get('assigned_category', 'General')  # Asegurarse que el artículo tenga esto
+        category = article.assigned_category or 'General'  # Asegurarse que el artículo tenga esto
         # Aplicar algún criterio para "highlight", ej. solo los N más recientes o importantes.
         # Para esta demo, los tomaremos todos y dejaremos que el sintetizador y el generador limiten.
         highlights_by_category.setdefault(category, []).append(article)
 
     # Aplicar un límite similar al diario si es necesario, o uno específico para el semanal
-    prefs = {}
-    try:
-        with open(config.PREFERENCES_FILE, 'r', encoding='utf-8') as f:
-            prefs = json.load(f)
-    except Exception:
-        pass  # Usar defaults
-
-    max_articles_cat_weekly = prefs.get("global", {}).get("max_articles_per_category_weekly",
+    max_articles_cat_weekly = run_config.global_prefs.get("max_articles_per_category_weekly",
                                                           config.MAX_ARTICLES_PER_CATEGORY_DEFAULT * 2)  # Ejemplo: el doble que el diario
 
     final_highlights = {}
     for cat, arts in highlights_by_category.items():
         # Podríamos ordenar por fecha y tomar los más recientes, o aplicar otra lógica de "highlight"
-        arts.sort(key=lambda x: x.get('published_date', ''), reverse=True)
+        arts.sort(key=lambda x: x.published_date or '', reverse=True)
         final_highlights[cat] = arts[:max_articles_cat_weekly]
 
     if not any(final_highlights.values()):
@@ -165,14 +160,16 @@ def generate_weekly_summary():
     #    Reutilizamos la lógica de synthesizer.py
     logger.info("Sintetizando highlights semanales...")
     synthesized_weekly_content = synthesize_data(
-        final_highlights)  # synthesize_data espera un dict {categoria: [artículos]}
+        final_highlights, run_config)  # synthesize_data espera un dict {categoria: [artículos]}
 
     # 4. Generar la página HTML del resumen semanal
     #    Reutilizamos la lógica de generator.py
     week_str = datetime.now().strftime("%Y-W%U")  # Ejemplo: 2025-W20
     logger.info(f"Generando página HTML para el resumen semanal: {week_str}")
-    generate_weekly_summary_page(synthesized_weekly_content, week_str)
+    generate_weekly_summary_page(synthesized_weekly_content, week_str, run_config)
 
+    log_cache_stats()
+    log_executor_stats()
     logger.info("Resumen semanal generado exitosamente.")
 
 